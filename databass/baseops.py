@@ -259,6 +259,24 @@ class Op(object):
           arg.append(str(v))
     return "%s(%s)" % (name, ", ".join(arg))
 
+  def iter_batches(self):
+    """
+    Batch-at-a-time counterpart of __iter__ (see batch.py).  Operators
+    that don't implement it batch the rows that __iter__ yields
+
+    @return iterator of batch.Batch objects that conform to self.schema
+    """
+    from .batch import Batch, BATCHSIZE
+    ncols = len(self.schema.attrs)
+    rows = []
+    for row in self:
+      rows.append(list(row.row))
+      if len(rows) >= BATCHSIZE:
+        yield Batch.from_rows(rows, ncols)
+        rows = []
+    if rows:
+      yield Batch.from_rows(rows, ncols)
+
   def produce(self, ctx):
     """
     Implementation of compilation's produce phase
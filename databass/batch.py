@@ -0,0 +1,178 @@
+"""
+Batch-at-a-time execution for the interpreted engine.
+
+Operators that implement Op.iter_batches() pass Batches of up to BATCHSIZE
+rows to their parents, and evaluate their expressions over whole columns
+with ExprBase.eval_batch(), rather than calling them once per ListTuple.
+Operators that don't implement it fall back to batching their rows.
+See Sink(batched=True)
+"""
+import numpy as np
+import pandas
+
+BATCHSIZE = 4096
+
+
+def column(vals):
+  """
+  @vals list of values
+  @return numpy array of @vals.  Values that aren't all numbers are stored
+          in an object array, so that numpy doesn't coerce them to strings
+  """
+  if isinstance(vals, np.ndarray):
+    return vals
+  arr = np.asarray(vals)
+  if arr.ndim != 1 or arr.dtype.kind not in "biuf":
+    arr = np.empty(len(vals), dtype=object)
+    arr[:] = vals
+  return arr
+
+def as_column(v, n):
+  """
+  @v result of ExprBase.eval_batch(): an array, or a scalar for
+     expressions that don't reference any attribute
+  @return array of @n values
+  """
+  if isinstance(v, np.ndarray) and v.ndim == 1:
+    return v
+  return np.repeat(column([v]), n)
+
+
+class Batch(object):
+  """
+  A batch of rows stored as one numpy array per attribute, in schema order.
+  Filters don't copy the columns; they narrow the selection vector to the
+  positions of the rows that are still active.
+  """
+  def __init__(self, cols, sel=None):
+    """
+    @cols list of equal length numpy arrays
+    @sel  sorted integer array of the positions of the active rows,
+          or None if all rows are active
+    """
+    self.cols = cols
+    self.sel = sel
+
+  @staticmethod
+  def from_rows(rows, ncols):
+    """
+    @rows list of row lists
+    """
+    if not rows:
+      return Batch([column([]) for _ in range(ncols)])
+    return Batch([column(list(vals)) for vals in zip(*rows)])
+
+  @staticmethod
+  def concat(batches, ncols):
+    """
+    @return a single compacted Batch of the active rows of @batches
+    """
+    batches = [b.compact() for b in batches]
+    if not batches:
+      return Batch([column([]) for _ in range(ncols)])
+    if len(batches) == 1:
+      return batches[0]
+    return Batch([np.concatenate([b.cols[i] for b in batches])
+      for i in range(ncols)])
+
+  @property
+  def n(self):
+    """
+    number of rows, including inactive ones
+    """
+    return len(self.cols[0]) if self.cols else 0
+
+  def active(self):
+    """
+    @return integer array of the positions of the active rows
+    """
+    return np.arange(self.n) if self.sel is None else self.sel
+
+  def select(self, mask):
+    """
+    @mask boolean array over all of the rows
+    @return Batch of the active rows that satisfy @mask
+    """
+    if self.sel is None:
+      return Batch(self.cols, np.flatnonzero(mask))
+    return Batch(self.cols, self.sel[mask[self.sel]])
+
+  def compact(self):
+    """
+    @return Batch that only contains the active rows, and no selection vector
+    """
+    if self.sel is None:
+      return self
+    return Batch([col[self.sel] for col in self.cols])
+
+  def take(self, idxs):
+    """
+    @idxs positions of rows to copy, e.g., from a join or sort
+    """
+    return Batch([col[idxs] for col in self.cols])
+
+  def scatter(self, vals):
+    """
+    @vals array of one value per active row
+    @return array of one value per row, aligned with the columns
+    """
+    if self.sel is None:
+      return vals
+    out = np.zeros(self.n, dtype=vals.dtype)
+    out[self.sel] = vals
+    return out
+
+  def rows(self):
+    """
+    @return list of the active rows as lists
+    """
+    cols = [col.tolist() for col in self.compact().cols]
+    return [list(row) for row in zip(*cols)]
+
+  def __len__(self):
+    return self.n if self.sel is None else len(self.sel)
+
+
+def join_pairs(lkeys, rkeys):
+  """
+  Equijoin two key columns, or two lists of the columns of composite keys.
+  Null keys don't match anything.
+
+  @return (left positions, right positions) of the matching pairs,
+          in the order of the left keys
+  """
+  if not isinstance(lkeys, list):
+    lkeys, rkeys = [lkeys], [rkeys]
+  names = ["k%d" % i for i in range(len(lkeys))]
+  lkeys, rkeys = list(lkeys), list(rkeys)
+  lvalid = np.ones(len(lkeys[0]), dtype=bool)
+  rvalid = np.ones(len(rkeys[0]), dtype=bool)
+  for i, (lkey, rkey) in enumerate(zip(lkeys, rkeys)):
+    if lkey.dtype.kind != rkey.dtype.kind and "O" in (lkey.dtype.kind, rkey.dtype.kind):
+      lkeys[i], rkeys[i] = lkey.astype(object), rkey.astype(object)
+    lvalid &= ~pandas.isnull(lkeys[i])
+    rvalid &= ~pandas.isnull(rkeys[i])
+  lvalid, rvalid = np.flatnonzero(lvalid), np.flatnonzero(rvalid)
+
+  ldf = pandas.DataFrame(dict(zip(names, [k[lvalid] for k in lkeys]), l=lvalid))
+  rdf = pandas.DataFrame(dict(zip(names, [k[rvalid] for k in rkeys]), r=rvalid))
+  pairs = ldf.merge(rdf, on=names, how="inner", sort=False)
+  return pairs["l"].to_numpy(), pairs["r"].to_numpy()
+
+def group_codes(keys, n):
+  """
+  @keys list of key columns of @n rows
+  @return (group id of each row, number of groups).  Groups are numbered
+          in the order of their first row
+  """
+  if not keys:
+    return np.zeros(n, dtype=np.int64), (1 if n else 0)
+  codes = None
+  for key in keys:
+    kcodes, uniques = pandas.factorize(key, use_na_sentinel=False)
+    if codes is None:
+      codes = kcodes
+    else:
+      codes, _ = pandas.factorize(codes * len(uniques) + kcodes)
+  codes, uniques = pandas.factorize(codes)
+  return codes, len(uniques)
@@ -8,10 +8,13 @@ class HashJoinLeftTranslator(LeftTranslator):
 
     # allocate variables for all state shared between produce/consume
     self.v_ht = None   # hashtable
+    self.right = None  # HashJoinRightTranslator that probes the hashtable
+    self.spilling = False
 
 class HashJoinRightTranslator(RightTranslator):
   def __init__(self, *args, **kwargs):
     super(HashJoinRightTranslator, self).__init__(*args, **kwargs)
+    self.left.right = self
 
     self.v_irow = None
 
@@ -0,0 +1,13 @@
+from ..ops import IndexNestedLoopJoin
+from .translator import *
+
+
+class IndexNestedLoopJoinTranslator(Translator):
+  """
+  Index joins don't break the pipeline: the left (outer) child's rows
+  probe the right table's index, which isn't scanned
+  """
+  def __init__(self, *args, **kwargs):
+    super(IndexNestedLoopJoinTranslator, self).__init__(*args, **kwargs)
+
+    self.v_irow = None
@@ -5,6 +5,9 @@ class OrderByBottomTranslator(BottomTranslator):
   def __init__(self, *args, **kwargs):
     super(OrderByBottomTranslator, self).__init__(*args, **kwargs)
 
+    # whether rows are buffered in an ExternalSort, as (row list, l_i) pairs
+    self.external = False
+
 
 class OrderByTopTranslator(TopTranslator):
   def __init__(self, *args, **kwargs):
@@ -39,6 +39,7 @@ class Pipeline(list):
 
     if not lineage_policy:
       lineage_policy = NoLineagePolicy()
+    self.lineage_policy = lineage_policy
     if not isinstance(lineage_policy, NoLineagePolicy):
       self.prepare_lineage(ctx, lineage_policy)
     ctx.declare("")
@@ -145,7 +146,7 @@ class Pipelines(object):
 
       curpipeline.append(top)
 
-    elif node.is_type(HashJoin):
+    elif node.is_type([HashJoin, SortMergeJoin]):
       left = self.create_left(node)
       right = self.create_right(node, left)
 
@@ -157,6 +158,12 @@ class Pipelines(object):
       self.make_pipelines(node.children()[1], curpipeline)
       curpipeline.append(right)
 
+    elif node.is_type(IndexNestedLoopJoin):
+      # the right table is only accessed through its index, so it 
+      # doesn't have a translator
+      self.make_pipelines(node.children()[0], curpipeline)
+      curpipeline.append(self.create_normal(node))
+
     elif node.is_type(ThetaJoin):
       left = self.create_left(node)
       right = self.create_right(node, left)
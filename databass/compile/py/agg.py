@@ -15,9 +15,18 @@ class PyGroupByBottomTranslator(GroupByBottomTranslator, PyTranslator):
     self.v_ht = ctx.new_var("gb_ht")
     self.v_irow = self.compile_new_tuple(ctx, self.op.schema, "gb_irow")
 
+    # If every aggregate has code snippets (see udfs.py), each bucket only
+    # holds the aggregates' states, which are updated inline.
+    self.aggs = [e for e in self.op.project_exprs if e.is_type(AggFunc)]
+    self.snippets = [agg_snippets(ctx, e.name) for e in self.aggs]
+    self.incremental = None not in self.snippets
     
     # initialize variables in compiled program
-    initargs = ["None", "None", "[]"]
+    if self.incremental:
+      states = [udf["init"] for udf in self.snippets]
+      initargs = ["None", "None", "[%s]" % ", ".join(states)]
+    else:
+      initargs = ["None", "None", "[]"]
 
     if self.l_i is not None:
       initargs.append("[]")
@@ -40,10 +49,11 @@ class PyGroupByBottomTranslator(GroupByBottomTranslator, PyTranslator):
 
     Each hashtable entry contains the following information
 
-    1. the hash probe key: e.g., hash of a+b-c
+    1. the hash probe key: e.g., the value of a+b-c
     2. values of attributes referenced in the grouping terms e.g., (a, b, c)
        see databass/ops/agg.py for their semantics
-    3. the group of tuples
+    3. the state of each aggregate if they are all incremental, 
+       otherwise the group of tuples
     """
 
 
@@ -66,12 +76,13 @@ class PyGroupByBottomTranslator(GroupByBottomTranslator, PyTranslator):
       "",
       "# Add entry to hash table",
       "{vals} = [{attrs}]", 
-      "{key} = hash(({exprs}))",
+      "{key} = ({exprs})",
       "{bucket} = %s[{key}]" % self.v_ht,
       "{bucket}[0] = {key}",
       "{bucket}[1] = {vals}"]
 
-    lines.append("{bucket}[2].append({v_in}.copy())")
+    if not self.incremental:
+      lines.append("{bucket}[2].append({v_in}.copy())")
 
     if self.l_i is not None:
       lines.append("{bucket}[-1].append({l_i})")
@@ -79,11 +90,31 @@ class PyGroupByBottomTranslator(GroupByBottomTranslator, PyTranslator):
     formatargs = dict(
       bucket=bucket, v_in = v_in, key=v_key, vals=v_attrvals,
       l_i=self.l_i,
-      exprs=", ".join(v_gexprs),
+      exprs="".join("%s, " % v for v in v_gexprs),
       attrs=", ".join(v_gattrs)
     )
     ctx.add_lines(lines, **formatargs)
 
+    if self.incremental:
+      self.update_states(ctx, "%s[2]" % bucket, v_in)
+
+  def update_states(self, ctx, v_states, v_in):
+    """
+    Inline the update snippet of each aggregate
+    """
+    v_s = ctx.new_var("gb_states")
+    ctx.set(v_s, v_states)
+    for i, (e, udf) in enumerate(zip(self.aggs, self.snippets)):
+      ctx.add_line("# update %s" % e)
+      args = dict(s="%s[%d]" % (v_s, i))
+      if "{v}" in udf["update"]:
+        args["v"] = self.compile_expr(ctx, e.args[0], v_in)
+      if "{args}" in udf["update"]:
+        args["args"] = ", ".join(self.compile_exprs(ctx, e.args, v_in))
+      for n in range(1, udf.get("nvars", 0) + 1):
+        args["var%d" % n] = ctx.new_var("gb_tmp")
+      ctx.add_lines(udf["update"].format(**args).split("\n"))
+
   
 class PyGroupByTopTranslator(GroupByTopTranslator, PyTranslator):
 
@@ -111,7 +142,7 @@ class PyGroupByTopTranslator(GroupByTopTranslator, PyTranslator):
     self.initialize_lineage_indexes(ctx)
 
     # loop through hash table to emit results and call parent's consume
-    with ctx.indent("for {bucket} in {ht}.values():", bucket=v_bucket, ht=v_ht): 
+    with ctx.loop("for {bucket} in {ht}.values():", bucket=v_bucket, ht=v_ht): 
       self.populate_lineage_indexes(ctx, v_bucket)
       self.fill_output_row(ctx, v_bucket)
 
@@ -149,7 +180,13 @@ class PyGroupByTopTranslator(GroupByTopTranslator, PyTranslator):
 
     aggidx = 0
     for i, e in enumerate(self.op.project_exprs):
-      if e.is_type(AggFunc):
+      if e.is_type(AggFunc) and self.bottom.incremental:
+        # finalize the aggregate's state
+        udf = self.bottom.snippets[aggidx]
+        v_expr_result = "(%s)" % udf["finalize"].format(
+            s="%s[%d]" % (v_grp, aggidx))
+        aggidx += 1
+      elif e.is_type(AggFunc):
         v_expr_result = self.compile_expr(ctx, e, v_grp)
       else:
         ctx.add_line("{terms}.row = {bucket}[1]", terms=self.v_term_row, bucket=v_bucket)
@@ -18,6 +18,7 @@ class PyCompiledQuery(CompiledQuery):
     with comp.indent("def %s(db=None, lineage=None):" % fname):
       comp.add_lines([
         "from databass import UDFRegistry",
+        "from databass.spill import SpillingHashTable, ExternalSort, is_null_key",
         "from datetime import date, datetime",
         "if not db:",
         "  db = Database()"
@@ -1,8 +1,30 @@
 from ...ops import HashJoin
+from ...db import Database
+from ...hashcache import HashTableCache
 from ..hashjoin import *
 from .translator import *
 
 
+def compile_join_key(translator, ctx, attrs, v_row):
+  """
+  @return compiled join key of @v_row: the attribute's value, or a tuple of
+          the values of a composite key
+  """
+  keys = [translator.compile_expr(ctx, attr, v_row) for attr in attrs]
+  if len(keys) == 1:
+    return keys[0]
+  return "(%s,)" % ", ".join(keys)
+
+def compile_null_key(v_key, nattrs):
+  """
+  @return compiled check that join key @v_key is NULL or NaN, so it can't
+          match (see spill.is_null_key)
+  """
+  if nattrs == 1:
+    return "{k} is None or {k} != {k}".format(k=v_key)
+  return "is_null_key(%s)" % v_key
+
+
 class PyHashJoinLeftTranslator(HashJoinLeftTranslator, PyTranslator):
   """
   The left translator scans the left child and populates the hash table
@@ -16,6 +38,33 @@ class PyHashJoinLeftTranslator(HashJoinLeftTranslator, PyTranslator):
     """
     self.v_ht = ctx.new_var("hjoin_ht")
 
+    # Under a join memory budget, the hash table is a SpillingHashTable,
+    # whose buckets contain row lists.  Queries that capture lineage 
+    # don't spill
+    db = Database.db()
+    lineage = self.l_capture or self.right.l_capture
+    self.spilling = db.join_memory_budget is not None and not lineage
+    if self.spilling and HashJoin.is_base_table(self.op.l):
+      table = db[self.op.l.tablename]
+      self.spilling = HashTableCache.table_bytes(table) > db.join_memory_budget
+
+    if self.spilling:
+      row_bytes = HashTableCache.row_bytes(len(self.op.l.schema.attrs))
+      ctx.declare(self.v_ht, "SpillingHashTable(db.join_memory_budget, %d, "
+          "db.spill_stats, db.spill_dir)" % row_bytes)
+      ctx.request_vars(dict(row=None))
+      self.child_translator.produce(ctx)
+      return
+
+    # Reuse the cached hash table of an unfiltered base table, instead of 
+    # scanning it.  Its buckets contain row lists rather than tuples.
+    self.cached = not self.l_capture and HashJoin.is_base_table(self.op.l)
+    if self.cached:
+      idx, decode = HashJoin.cache_key(self.op.join_attrs[0])
+      ctx.declare(self.v_ht, "db.hash_tables.get(db['%s'], %r, %r)" % (
+        self.op.l.tablename, idx, decode))
+      return
+
     if not self.l_capture:
       htinit = "defaultdict(list)"
     else:
@@ -35,9 +84,15 @@ class PyHashJoinLeftTranslator(HashJoinLeftTranslator, PyTranslator):
     v_lrow = ctx['row']
     ctx.pop_vars()
 
-    
-    ctx.add_line("# left probe key: %s" % self.op.join_attrs[0])
-    v_lkey = self.compile_expr(ctx, self.op.join_attrs[0], v_lrow)
+    lattrs = self.op.join_attrs[0]
+    ctx.add_line("# left build key: %s" % ", ".join(map(str, lattrs)))
+    ctx.set(v_lkey, compile_join_key(self, ctx, lattrs, v_lrow))
+    if self.spilling:
+      ctx.add_line("{ht}.add({lkey}, {lrow}.row.copy())", 
+          ht=self.v_ht, lkey=v_lkey, lrow=v_lrow)
+      return
+    with ctx.indent("if %s:" % compile_null_key(v_lkey, len(lattrs))):
+      ctx.add_line("continue")
     v_bucket = "%s[%s]" % (self.v_ht, v_lkey)
     if self.l_capture:
       ctx.add_line("{bucket}[0].append({lrow}.copy())", bucket=v_bucket, lrow=v_lrow)
@@ -68,6 +123,31 @@ class PyHashJoinRightTranslator(HashJoinRightTranslator, PyRightTranslator):
     if self.l_capture:
       self.clean_prev_lineage_indexes()
 
+    if self.left.spilling:
+      self.produce_spilled_pairs(ctx)
+
+  def produce_spilled_pairs(self, ctx):
+    """
+    After the probe loop, join the partitions that the hash table spilled,
+    and pass their results to a second copy of the parent's consume code
+    """
+    v_lrow = ctx.new_var("hjoin_lrow")
+    v_rrow = ctx.new_var("hjoin_rrow")
+    nlattrs = len(self.op.l.schema.attrs)
+    cond = "for {lrow}, {rrow} in {ht}.spilled_pairs():"
+    with ctx.loop(cond, lrow=v_lrow, rrow=v_rrow, ht=self.left.v_ht):
+      ctx.add_line("{irow}.row[:{n}] = {lrow}", 
+          irow=self.v_irow, n=nlattrs, lrow=v_lrow)
+      ctx.add_line("{irow}.row[{n}:] = {rrow}", 
+          irow=self.v_irow, n=nlattrs, rrow=v_rrow)
+
+      # the first consume popped the parents' variable requests 
+      op_vars = ctx.op_vars
+      ctx.op_vars = self.parent_vars
+      ctx['row'] = self.v_irow
+      self.parent_translator.consume(ctx)
+      ctx.op_vars = op_vars
+
   def consume(self, ctx):
     """
     Given variable name for right row, 
@@ -75,8 +155,8 @@ class PyHashJoinRightTranslator(HashJoinRightTranslator, PyRightTranslator):
     2. probe hash table, 
     3. create intermediate row to pass to parent's consume
 
-    Note that because the hash key may not be unique, it's good hygiene
-    to check the join condition again when probing.
+    The hash table is keyed on the join values themselves (tuples of
+    them for composite keys), so a match doesn't need to be rechecked.
     """
     # reference to the left translator's hash table variable
     v_ht = self.left.v_ht
@@ -88,15 +168,22 @@ class PyHashJoinRightTranslator(HashJoinRightTranslator, PyRightTranslator):
 
     
     # compute probe key 
-    ctx.add_line("# probe ht with: %s" % self.op.join_attrs[1])
-    v_rkey = self.compile_expr(ctx, self.op.join_attrs[1], v_rrow)
+    rattrs = self.op.join_attrs[1]
+    ctx.add_line("# probe ht with: %s" % ", ".join(map(str, rattrs)))
+    ctx.set(v_rkey, compile_join_key(self, ctx, rattrs, v_rrow))
+
+    if self.left.spilling:
+      self.consume_spilling(ctx, v_rkey, v_rrow)
+      return
 
     # continue probe loop if no match
-    with ctx.indent("if {rkey} not in {ht}:", rkey=v_rkey, ht=v_ht):
+    cond = "if %s or {rkey} not in {ht}:" % compile_null_key(v_rkey, len(rattrs))
+    with ctx.indent(cond, rkey=v_rkey, ht=v_ht):
       ctx.add_line("continue")
 
     # build intermediate row f
     nlattrs = len(self.op.l.schema.attrs)
+    lrow_vals = "{lrow}" if self.left.cached else "{lrow}.row"
     ctx.add_line("{irow}.row[{n}:] = {rrow}.row", 
         irow=self.v_irow, n=nlattrs, rrow=v_rrow)
 
@@ -104,8 +191,8 @@ class PyHashJoinRightTranslator(HashJoinRightTranslator, PyRightTranslator):
     v_group = "%s[0]" % v_bucket if self.left.l_capture else v_bucket
     l_idx = ctx.new_var("l_idx")
     cond = "for {idx}, {lrow} in enumerate({group}):"
-    with ctx.indent(cond, lrow=v_lrow, group=v_group, idx=l_idx):
-      ctx.add_line("{irow}.row[:{n}] = {lrow}.row",
+    with ctx.loop(cond, lrow=v_lrow, group=v_group, idx=l_idx):
+      ctx.add_line("{irow}.row[:{n}] = %s" % lrow_vals,
           irow=self.v_irow, n=nlattrs, lrow=v_lrow)
 
       # capture lineage
@@ -128,6 +215,20 @@ class PyHashJoinRightTranslator(HashJoinRightTranslator, PyRightTranslator):
       ctx['row'] = self.v_irow
       self.parent_translator.consume(ctx)
 
-
-
+  def consume_spilling(self, ctx, v_rkey, v_rrow):
+    """
+    Probe the SpillingHashTable, which spills the rows that belong to 
+    spilled partitions
+    """
+    v_lrow = ctx.new_var("hjoin_lrow")
+    nlattrs = len(self.op.l.schema.attrs)
+    ctx.add_line("{irow}.row[{n}:] = {rrow}.row", 
+        irow=self.v_irow, n=nlattrs, rrow=v_rrow)
+    cond = "for {lrow} in {ht}.probe({rkey}, {rrow}.row):"
+    with ctx.loop(cond, lrow=v_lrow, ht=self.left.v_ht, rkey=v_rkey, rrow=v_rrow):
+      ctx.add_line("{irow}.row[:{n}] = {lrow}", 
+          irow=self.v_irow, n=nlattrs, lrow=v_lrow)
+      ctx['row'] = self.v_irow
+      self.parent_vars = [dict(d) for d in ctx.op_vars]
+      self.parent_translator.consume(ctx)
 
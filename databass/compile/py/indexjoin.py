@@ -0,0 +1,42 @@
+from ..indexjoin import *
+from .translator import *
+
+
+class PyIndexNestedLoopJoinTranslator(IndexNestedLoopJoinTranslator, PyTranslator):
+
+  def produce(self, ctx):
+    self.v_irow = self.compile_new_tuple(ctx, self.op.schema, "ijoin_row")
+    ctx.request_vars(dict(row=None))
+    self.child_translator.produce(ctx)
+
+  def consume(self, ctx):
+    """
+    Compute the left row's join key, and loop over the right rows that 
+    the index returns for it
+    """
+    v_lrow = ctx['row']
+    ctx.pop_vars()
+    v_index = ctx.bind(("index", self.op.index), 
+        "db.index('%s')" % self.op.index, "index")
+    v_rrow = ctx.new_var("ijoin_rrow")
+    lattrs, rattrs = self.op.join_attrs
+    nlattrs = len(self.op.l.schema.attrs)
+
+    ctx.add_line("# probe %s with: %s" % (
+      self.op.index, ", ".join(map(str, lattrs))))
+    v_keys = [self.compile_expr(ctx, attr, v_lrow) for attr in lattrs]
+    nulls = ["{k} is None or {k} != {k}".format(k=v_key) for v_key in v_keys]
+    with ctx.indent("if %s:" % " or ".join(nulls)):
+      ctx.add_line("continue")
+
+    preds = ", ".join("(%d, '=', %s)" % (rattr.idx, v_key) 
+        for rattr, v_key in zip(rattrs, v_keys))
+    ctx.add_line("{irow}.row[:{n}] = {lrow}.row", 
+        irow=self.v_irow, n=nlattrs, lrow=v_lrow)
+    cond = "for {rrow} in {index}.iter_rows([{preds}], {residual}, encoded=True):"
+    with ctx.loop(cond, rrow=v_rrow, index=v_index, preds=preds, 
+        residual=repr(self.op.r.preds)):
+      ctx.add_line("{irow}.row[{n}:] = {rrow}", 
+          irow=self.v_irow, n=nlattrs, rrow=v_rrow)
+      ctx['row'] = self.v_irow
+      self.parent_translator.consume(ctx)
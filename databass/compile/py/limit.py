@@ -1,5 +1,7 @@
 from ...ops import GroupBy
 from ..limit import *
+from ..lpolicy import NoLineagePolicy
+from ..root import YieldTranslator
 from .translator import *
 
 
@@ -11,8 +13,10 @@ class PyLimitTranslator(LimitTranslator, PyTranslator):
     self.v_break = ctx.new_var("lim_break")
     ctx.request_vars(dict(row=None))
 
-    # TODO: to be more efficient, propogate breaker to all sources in subplan
-    #       to exit out of deeply nested loops directly
+    # only the loops that the child opens are exited once the limit is 
+    # reached.  Enclosing loops, e.g., of a theta join, restart the limit
+    self.loop_depth = len(ctx.loops)
+
     lines = [
       "%s = 0" % self.v_nyield,
       "%s = -1" % self.v_niter,
@@ -21,14 +25,33 @@ class PyLimitTranslator(LimitTranslator, PyTranslator):
     ctx.add_lines(lines)
     self.child_translator.produce(ctx)
 
+  def returns_early(self):
+    """
+    Under a Yield root, the compiled function can return as soon as the 
+    limit is reached, unless it materializes lineage afterwards, or a
+    join above the limit emits rows after its loops (e.g., a sort-merge join)
+    """
+    if not isinstance(self.pipeline.lineage_policy, NoLineagePolicy):
+      return False
+    parents = self.pipeline[self.pipeline.index(self)+1:]
+    return (parents[-1].is_type(YieldTranslator) and 
+        not any(t.is_type(RightTranslator) for t in parents))
+
   def consume(self, ctx):
     v_irow = ctx['row']
     ctx.pop_vars()
 
+    # exit all of the pipeline's loops, not only the innermost one
+    if self.returns_early():
+      stop = "return"
+    else:
+      ctx.stop_loops(self.v_break, self.loop_depth)
+      stop = "break"
+
     lines = [
       "%s += 1" % self.v_niter, 
       "if %s < %s: continue" % (self.v_niter, self.op._offset),
-      "if %s: break" % self.v_break,
+      "if %s: %s" % (self.v_break, stop),
       "%s += 1" % self.v_nyield,
       "%s = %s >= %s" % (self.v_break, self.v_nyield, self.op._limit)
     ]
@@ -37,4 +60,6 @@ class PyLimitTranslator(LimitTranslator, PyTranslator):
     ctx['row'] = v_irow
     self.parent_translator.consume(ctx)
 
-
+    # stop right after the last row, rather than when the next one arrives
+    with ctx.indent("if %s:" % self.v_break):
+      ctx.add_line(stop)
@@ -1,4 +1,6 @@
 from ...ops import GroupBy
+from ...db import Database
+from ...hashcache import HashTableCache
 from ..translator import *
 from ..orderby import *
 from .translator import *
@@ -31,10 +33,22 @@ class PyOrderByBottomTranslator(OrderByBottomTranslator, PyTranslator):
         "return OBTuple(({v_all},), {order})"
         ], v_all=", ".join(v_all), order=v_ordersort)
 
-
+    self.declare_rows(ctx)
     ctx.request_vars(dict(row=None))
     self.child_translator.produce(ctx)
 
+  def declare_rows(self, ctx):
+    """
+    Under a sort memory budget, rows are buffered in an ExternalSort 
+    rather than a list
+    """
+    self.external = Database.db().sort_memory_budget is not None
+    if self.external:
+      row_bytes = HashTableCache.row_bytes(len(self.op.schema.attrs))
+      ctx.set(self.v_rows, "ExternalSort({keyf}, db.sort_memory_budget, "
+          "{row_bytes}, db.spill_stats, db.spill_dir)".format(
+            keyf=self.v_keyf, row_bytes=row_bytes))
+
   def consume(self, ctx):
     """
     Actually populate buffer with copies of input rows
@@ -42,6 +56,11 @@ class PyOrderByBottomTranslator(OrderByBottomTranslator, PyTranslator):
     v_in = ctx['row']
     ctx.pop_vars()
 
+    if self.external:
+      ctx.add_line("{rows}.add((list({v_in}.row), {l_i}))",
+          rows=self.v_rows, v_in=v_in, l_i=self.l_i)
+      return
+
     tmp = self.compile_new_tuple(ctx, self.op.schema, "ord_row")
     ctx.add_lines([
       "{tmp}.row = list({v_in}.row)", 
@@ -58,7 +77,7 @@ class PyOrderByTopTranslator(OrderByTopTranslator, PyTranslator):
     """
     if self.l_capture:
       ctx.add_line("# {op}", op=self.op)
-      size = "len(%s)" % self.bottom.v_rows
+      size = self.input_size()
       for lindex in self.lindexes:
         lindex.fw.initialize(size)
         lindex.bw.initialize(size)
@@ -71,27 +90,83 @@ class PyOrderByTopTranslator(OrderByTopTranslator, PyTranslator):
       self.clean_prev_lineage_indexes()
 
 
+  def input_size(self):
+    """
+    @return compiled expression of the number of input rows
+    """
+    return "len(%s)" % self.bottom.v_rows
+
   def consume(self, ctx):
     """
     Sort buffered rows using special key function, then
     emit rows in sorted order.  
     """
-    v_irow = ctx.new_var("ord_irow")
     l_i = ctx.new_var("ord_l_i")
 
-    ctx.add_line("{rows}.sort(key={keyf})", 
-        rows=self.bottom.v_rows, keyf=self.bottom.v_keyf)
+    if self.bottom.external:
+      # the ExternalSort merges its sorted runs as it is iterated
+      v_vals = ctx.new_var("ord_vals")
+      v_irow = self.compile_new_tuple(ctx, self.op.schema, "ord_irow")
+      loop = "for ({vals}, {l_i}) in {rows}:"
+    else:
+      v_vals = None
+      v_irow = ctx.new_var("ord_irow")
+      ctx.add_line("{rows}.sort(key={keyf})", 
+          rows=self.bottom.v_rows, keyf=self.bottom.v_keyf)
+      loop = "for ({irow}, {l_i}) in {rows}:"
+
+    with ctx.loop(loop, irow=v_irow, vals=v_vals, l_i=l_i, 
+        rows=self.bottom.v_rows):
+      if v_vals:
+        ctx.add_line("{irow}.row = {vals}", irow=v_irow, vals=v_vals)
+      self.emit(ctx, v_irow, l_i)
+
+  def emit(self, ctx, v_irow, l_i):
+    """
+    Pass sorted row @v_irow, whose input rid is @l_i, to the parent
+    """
+    # lineage capture
+    if self.l_capture:
+      ctx.add_line("{l_o} += 1", l_o=self.l_o)
+      for lindex in self.lindexes:
+        lindex.fw.set_1(l_i, self.l_o)
+        lindex.bw.append_1(l_i)
+
+    ctx['row'] = v_irow
+    self.parent_translator.consume(ctx)
+
+
+class PyTopNBottomTranslator(PyOrderByBottomTranslator):
+  """
+  Same as ORDER BY, but buffers the rows in a BoundedHeap of offset+limit
+  rows, which only copies the rows that it keeps
+  """
+
+  def declare_rows(self, ctx):
+    ctx.set(self.v_rows, 
+        "BoundedHeap(%d, %s, copy=lambda arg: (arg[0].copy(), arg[1]))" % (
+          self.op.k, self.v_keyf))
+
+  def consume(self, ctx):
+    v_in = ctx['row']
+    ctx.pop_vars()
+    ctx.add_line("{rows}.push(({v_in}, {l_i}))", 
+        rows=self.v_rows, v_in=v_in, l_i=self.l_i)
+
 
-    with ctx.indent("for ({irow}, {l_i}) in {rows}:",
-        irow=v_irow, l_i=l_i, rows=self.bottom.v_rows):
+class PyTopNTopTranslator(PyOrderByTopTranslator):
 
-      # lineage capture
-      if self.l_capture:
-        ctx.add_line("{l_o} += 1", l_o=self.l_o)
-        for lindex in self.lindexes:
-          lindex.fw.set_1(l_i, self.l_o)
-          lindex.bw.append_1(l_i)
+  def input_size(self):
+    return "%s.n" % self.bottom.v_rows
 
-      ctx['row'] = v_irow
-      self.parent_translator.consume(ctx)
+  def consume(self, ctx):
+    """
+    Emit the heap's rows in sorted order, after the first offset rows
+    """
+    v_irow = ctx.new_var("ord_irow")
+    l_i = ctx.new_var("ord_l_i")
+    loop = "for ({irow}, {l_i}) in {rows}.sorted()[{offset}:]:"
+    with ctx.loop(loop, irow=v_irow, l_i=l_i, rows=self.bottom.v_rows,
+        offset=self.op.offset):
+      self.emit(ctx, v_irow, l_i)
 
@@ -2,6 +2,8 @@ from ...ops import *
 from ..pipeline import *
 from .translator import *
 from .hashjoin import *
+from .sortmergejoin import *
+from .indexjoin import *
 from .thetajoin import *
 from .agg import *
 from .project import *
@@ -168,6 +170,8 @@ class PyPipelines(Pipelines):
   def create_bottom(self, op, *args):
     if op.is_type(GroupBy):
       return PyGroupByBottomTranslator(op, *args)
+    if op.is_type(TopN):
+      return PyTopNBottomTranslator(op, *args)
     if op.is_type(OrderBy):
       return PyOrderByBottomTranslator(op, *args)
     raise Exception("No Bottom Translator for %s" % op)
@@ -175,6 +179,8 @@ class PyPipelines(Pipelines):
   def create_top(self, op, *args):
     if op.is_type(GroupBy):
       return PyGroupByTopTranslator(op, *args)
+    if op.is_type(TopN):
+      return PyTopNTopTranslator(op, *args)
     if op.is_type(OrderBy):
       return PyOrderByTopTranslator(op, *args)
     raise Exception("No Top Translator for %s" % op)
@@ -182,6 +188,8 @@ class PyPipelines(Pipelines):
   def create_left(self, op, *args):
     if op.is_type(HashJoin):
       return PyHashJoinLeftTranslator(op, *args)
+    if op.is_type(SortMergeJoin):
+      return PySortMergeJoinLeftTranslator(op, *args)
     if op.is_type(ThetaJoin):
       return PyThetaJoinLeftTranslator(op, *args)
     raise Exception("No Left Translator for %s" % op)
@@ -190,6 +198,8 @@ class PyPipelines(Pipelines):
   def create_right(self, op, *args):
     if op.is_type(HashJoin):
       return PyHashJoinRightTranslator(op, *args)
+    if op.is_type(SortMergeJoin):
+      return PySortMergeJoinRightTranslator(op, *args)
     if op.is_type(ThetaJoin):
       return PyThetaJoinRightTranslator(op, *args)
     raise Exception("No Right Translator for %s" % op)
@@ -203,9 +213,11 @@ class PyPipelines(Pipelines):
         (Print, PyPrintTranslator),
         (Collect, PyCollectTranslator),
         (SubQuerySource, PySubQueryTranslator),
+        (IndexScan, PyIndexScanTranslator),
         (Scan, PyScanTranslator),
         (DummyScan, PyDummyScanTranslator),
-        (Filter, PyFilterTranslator)
+        (Filter, PyFilterTranslator),
+        (IndexNestedLoopJoin, PyIndexNestedLoopJoinTranslator)
     ]
 
     for opklass, tklass in translators:
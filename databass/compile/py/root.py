@@ -33,10 +33,29 @@ class PySinkTranslator(SinkTranslator, PyTranslator):
       #     and that SinkTranslators are always 1-to-1
       pass
 
+  def decode_row(self, ctx, v_in):
+    """
+    Decode dictionary-encoded attributes that reach the sink 
+    without going through a Project
+
+    @return var name of the decoded tuple
+    """
+    encoded = [(i, a.dictionary) for i, a in enumerate(self.op.schema)
+        if a.dictionary is not None]
+    if not encoded:
+      return v_in
+
+    v_out = self.compile_new_tuple(ctx, self.op.schema, "sink_decoded")
+    ctx.set("{out}.row", "list({v_in}.row)", out=v_out, v_in=v_in)
+    for i, dictionary in encoded:
+      ctx.set("{out}.row[{i}]", "{d}[{out}.row[{i}]]", 
+          out=v_out, i=i, d=self.dictionary_var(ctx, dictionary))
+    return v_out
+
 
 class PyYieldTranslator(YieldTranslator, PySinkTranslator):
   def consume(self, ctx):
-    v_in = ctx['row']
+    v_in = self.decode_row(ctx, ctx['row'])
     self.populate_lineage_indexes(ctx)
     ctx.add_line("yield %s" % v_in)
 
@@ -52,7 +71,7 @@ class PyCollectTranslator(CollectTranslator, PySinkTranslator):
     ctx.returns("return {buf}", buf=self.v_buffer)
 
   def consume(self, ctx):
-    v_in = ctx['row']
+    v_in = self.decode_row(ctx, ctx['row'])
     self.populate_lineage_indexes(ctx)
 
     v_tmp = self.compile_new_tuple(ctx, self.op.schema, "collect_tmp")
@@ -64,7 +83,7 @@ class PyCollectTranslator(CollectTranslator, PySinkTranslator):
 
 class PyPrintTranslator(PrintTranslator, PySinkTranslator):
   def consume(self, ctx):
-    v_in = ctx['row']
+    v_in = self.decode_row(ctx, ctx['row'])
     self.populate_lineage_indexes(ctx)
     ctx.add_line("print(%s)" % v_in)
 
@@ -9,16 +9,33 @@ class PySubQueryTranslator(SubQueryTranslator):
 
 class PyScanTranslator(ScanTranslator, PyTranslator):
   def produce(self, ctx):
-    v_row = ctx.new_var("scan_row")
+    v_tup = ctx.new_var("scan_tup")
 
     ctx.add_line("# scan %s AS %s" % (self.op.tablename, self.op.alias))
-    with ctx.indent("for {row} in db['{tname}']:", 
-        row=v_row, tname=self.op.tablename):
+    # a single tuple wraps each row the table's iter_rows() emits
+    v_row = self.compile_new_tuple(ctx, self.op.schema, "scan_row")
+
+    # pushed-down predicates may skip rows, so lineage uses the table's
+    # row ids rather than counting the scanned rows
+    args = ["encoded=True"]
+    loop_vars = v_tup
+    rids = self.l_o is not None and bool(self.op.preds)
+    if self.op.preds:
+      args.append("preds=%r" % (self.op.preds,))
+    if self.op.partitions is not None:
+      args.append("partitions=%r" % (self.op.partitions,))
+    if rids:
+      args.append("rids=True")
+      loop_vars = "%s, %s" % (self.l_o, v_tup)
+
+    with ctx.loop("for {vars} in db['{tname}'].iter_rows({args}):", 
+        vars=loop_vars, tname=self.op.tablename, args=", ".join(args)):
+      ctx.set("{row}.row", v_tup, row=v_row)
 
       # give variable name for the scan row to parent operator
       ctx["row"] = v_row
 
-      if self.l_o is not None:
+      if self.l_o is not None and not rids:
         ctx.set(self.l_o, "{l_o}+1", l_o=self.l_o)
 
       if self.child_translator:
@@ -27,6 +44,33 @@ class PyScanTranslator(ScanTranslator, PyTranslator):
         self.parent_translator.consume(ctx)
 
 
+class PyIndexScanTranslator(ScanTranslator, PyTranslator):
+  def produce(self, ctx):
+    v_tup = ctx.new_var("scan_tup")
+    v_index = ctx.bind(("index", self.op.index), 
+        "db.index('%s')" % self.op.index, "index")
+
+    ctx.add_line("# index scan %s AS %s" % (self.op.tablename, self.op.alias))
+    v_row = self.compile_new_tuple(ctx, self.op.schema, "scan_row")
+
+    # rows are fetched in index order, so lineage uses their row ids
+    args = [repr(self.op.index_preds), repr(self.op.preds), "encoded=True"]
+    loop_vars = v_tup
+    if self.l_o is not None:
+      args.append("rids=True")
+      loop_vars = "%s, %s" % (self.l_o, v_tup)
+
+    with ctx.loop("for {vars} in {index}.iter_rows({args}):",
+        vars=loop_vars, index=v_index, args=", ".join(args)):
+      ctx.set("{row}.row", v_tup, row=v_row)
+      ctx["row"] = v_row
+
+      if self.child_translator:
+        self.child_translator.produce(ctx)
+      else:
+        self.parent_translator.consume(ctx)
+
+
 class PyDummyScanTranslator(ScanTranslator, PyTranslator):
   def produce(self, ctx):
     v_row = ctx.new_var("dummy_row")
@@ -0,0 +1,111 @@
+from ...ops import SortMergeJoin
+from ..sortmergejoin import *
+from .translator import *
+from .hashjoin import compile_join_key
+
+
+def compile_buffer_row(ctx, translator, v_rows, attrs, v_row):
+  """
+  Add (join key, row) of @v_row to the sort buffer @v_rows, unless the key
+  is NULL.  Rows are paired with their rids if @translator captures lineage
+  """
+  v_key = ctx.new_var("smj_key")
+  ctx.add_line("# sort key: %s" % ", ".join(map(str, attrs)))
+  ctx.set(v_key, compile_join_key(translator, ctx, attrs, v_row))
+  with ctx.indent("if SortMergeJoin.is_null_key({key}):", key=v_key):
+    ctx.add_line("continue")
+  if translator.l_capture:
+    ctx.add_line("{rows}.add(({key}, ({row}.row.copy(), {l_i})))",
+        rows=v_rows, key=v_key, row=v_row, l_i=translator.l_i)
+  else:
+    ctx.add_line("{rows}.add(({key}, {row}.row.copy()))",
+        rows=v_rows, key=v_key, row=v_row)
+
+
+class PySortMergeJoinLeftTranslator(SortMergeJoinLeftTranslator, PyTranslator):
+  """
+  The left translator buffers the left child's rows to be sorted
+  """
+  def produce(self, ctx):
+    self.v_rows = ctx.new_var("smj_lrows")
+    ctx.declare(self.v_rows, "SortMergeJoin.sort_buffer(%d)" %
+        len(self.op.l.schema.attrs))
+    ctx.request_vars(dict(row=None))
+    self.child_translator.produce(ctx)
+
+  def consume(self, ctx):
+    v_lrow = ctx['row']
+    ctx.pop_vars()
+    compile_buffer_row(ctx, self, self.v_rows, self.op.join_attrs[0], v_lrow)
+
+
+class PySortMergeJoinRightTranslator(SortMergeJoinRightTranslator, PyRightTranslator):
+  """
+  The right translator buffers the right child's rows to be sorted, and
+  then merges the sorted sides and passes each match to the parent's consume
+  """
+  def produce(self, ctx):
+    self.v_irow = self.compile_new_tuple(ctx, self.op.schema, "smj_row")
+    self.v_rows = ctx.new_var("smj_rrows")
+    ctx.declare(self.v_rows, "SortMergeJoin.sort_buffer(%d)" %
+        len(self.op.r.schema.attrs))
+
+    if self.l_capture:
+      size = "%s+1"%self.left.l_i if self.left.l_capture else None
+      self.initialize_lineage_indexes(ctx, left_size=size)
+
+    # the parents' variable requests are still on the stack, since their
+    # consume is only called by the merge
+    ctx.request_vars(dict(row=None))
+    self.child_translator.produce(ctx)
+    self.produce_merge(ctx)
+
+    if self.l_capture:
+      self.clean_prev_lineage_indexes()
+
+  def consume(self, ctx):
+    v_rrow = ctx['row']
+    ctx.pop_vars()
+    compile_buffer_row(ctx, self, self.v_rows, self.op.join_attrs[1], v_rrow)
+
+  def produce_merge(self, ctx):
+    """
+    Merge the sorted left and right rows with equal keys
+    (see SortMergeJoin.merge_groups)
+    """
+    v_lgroup = ctx.new_var("smj_lgroup")
+    v_rgroup = ctx.new_var("smj_rgroup")
+    v_lrow = ctx.new_var("smj_lrow")
+    v_rrow = ctx.new_var("smj_rrow")
+    l_lid = ctx.new_var("l_left_iid")
+    l_rid = ctx.new_var("l_right_iid")
+    nlattrs = len(self.op.l.schema.attrs)
+
+    # rows of sides that capture lineage are paired with their rids
+    lvars = "{lrow}, %s" % l_lid if self.left.l_capture else "{lrow}"
+    rvars = "{rrow}, %s" % l_rid if self.l_capture else "{rrow}"
+
+    ctx.add_line("# merge sorted inputs of %s" % self.op)
+    cond = "for {lgroup}, {rgroup} in SortMergeJoin.merge_groups({lrows}, {rrows}):"
+    with ctx.loop(cond, lgroup=v_lgroup, rgroup=v_rgroup,
+        lrows=self.left.v_rows, rrows=self.v_rows):
+      with ctx.loop("for %s in {rgroup}:" % rvars, rrow=v_rrow, rgroup=v_rgroup):
+        ctx.add_line("{irow}.row[{n}:] = {rrow}",
+            irow=self.v_irow, n=nlattrs, rrow=v_rrow)
+        with ctx.loop("for %s in {lgroup}:" % lvars, lrow=v_lrow, lgroup=v_lgroup):
+          ctx.add_line("{irow}.row[:{n}] = {lrow}",
+              irow=self.v_irow, n=nlattrs, lrow=v_lrow)
+
+          # capture lineage
+          if self.l_capture:
+            ctx.add_line("{l_o} += 1", l_o=self.l_o)
+            if self.left.l_capture:
+              for lindex in self.left.lindexes:
+                lindex.fw.add_1(l_lid, self.l_o)
+                lindex.bw.append_1(l_lid)
+            for lindex in self.lindexes:
+              lindex.fw.add_1(l_rid, self.l_o)
+              lindex.bw.append_1(l_rid)
+
+          ctx['row'] = self.v_irow
+          self.parent_translator.consume(ctx)
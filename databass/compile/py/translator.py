@@ -217,11 +217,21 @@ class PyTranslator(Translator):
 
   def attr(self, ctx, e, v_in):
     v_out = ctx.new_var("e_attr_out")
-    ctx.set(v_out, "{tup}[{idx}]", tup=v_in, idx=e.idx)
+    ctx.set(v_out, self.attr_inline(ctx, e, v_in))
     return v_out
 
   def attr_inline(self, ctx, e, v_in):
-    return "{tup}[{idx}]".format(tup=v_in, idx=e.idx)
+    val = "{tup}[{idx}]".format(tup=v_in, idx=e.idx)
+    if e.dictionary is None or e.raw:
+      return val
+    return "%s[%s]" % (self.dictionary_var(ctx, e.dictionary), val)
+
+  def dictionary_var(self, ctx, dictionary):
+    """
+    @return var name bound to the values array of a tables.Dictionary
+    """
+    key = ("dictionary", dictionary.table_id, dictionary.idx)
+    return ctx.bind(key, dictionary.codegen(), "dictionary")
 
 
 class PyRightTranslator(RightTranslator, PyTranslator):
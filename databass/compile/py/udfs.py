@@ -1,11 +1,14 @@
 from .translator import *
+from ...udfs import UDFRegistry
 
 """
 Incremental UDFs are useful in groupbys when building the hashtable
 
 We represent an incremental UDF translator using a dictionary of code snippets.
 The code snippets for init and finalize will be inlined, and the code for update 
-will be added to the compiler outside of the UDF translator
+will be added to the compiler outside of the UDF translator.  The compiled
+GROUP BY only keeps aggregate states if all of its aggregates have snippets
+(see PyGroupByBottomTranslator)
 
 The dictionary keys are:
 
@@ -21,6 +24,11 @@ be passed in:
   {s}    intermediate state
   {v}    value from current row
   {vari} i'th variable, where i rancges from 1 to nvars
+  {args} comma separated values of all of the arguments from current row
+
+User-registered IncAggUDFs don't have snippets.  Instead, agg_snippets()
+binds their init/update/finalize callables to variables declared at the top
+of the compiled function, and returns snippets that call them.
 
 """
 
@@ -55,11 +63,44 @@ pyudftranslatorregistry["std"] = dict(
 {var1} = {v} - {s}[1]
 {s}[1] += {var1} / {s}[0]
 {s}[2] += {var1} * ({v} - {s}[1])""",
-    finalize="float('nan') if {s}[0] < 2 else {s}[2] / ({s}[0] - 1)",
+    finalize="float('nan') if {s}[0] < 1 else ({s}[2] / {s}[0]) ** 0.5",
     nvars=1
     )
-pyudftranslatorregistry["stddev"] = registry["std"]
+pyudftranslatorregistry["stdev"] = pyudftranslatorregistry["std"]
+# NULL and NaN values are skipped (see udfs.agg_min)
+pyudftranslatorregistry["min"] = dict(
+    init="None",
+    update="if {v} is not None and {v} == {v} and ({s} is None or {v} < {s}): {s} = {v}",
+    finalize="float('nan') if {s} is None else {s}"
+    )
+pyudftranslatorregistry["max"] = dict(
+    init="None",
+    update="if {v} is not None and {v} == {v} and ({s} is None or {v} > {s}): {s} = {v}",
+    finalize="float('nan') if {s} is None else {s}"
+    )
 
 
+def agg_snippets(ctx, name):
+  """
+  @name   name of the aggregate function
+  @return code snippets of the aggregate, or None if it is not incremental
+  """
+  if name in pyudftranslatorregistry:
+    return pyudftranslatorregistry[name]
 
+  udf = UDFRegistry.registry().agg_udfs.get(name, None)
+  if udf is None or not udf.is_incremental:
+    return None
+  if None in (udf.init, udf.update, udf.finalize):
+    return None
 
+  # bind the callables once, rather than looking them up for every row
+  v_udf = "UDFRegistry.registry()['%s']" % name
+  v_init, v_update, v_finalize = [
+      ctx.bind(("udf", name, f), "%s.%s" % (v_udf, f), "udf_%s" % f)
+      for f in ("init", "update", "finalize")]
+  return dict(
+      init="%s()" % v_init,
+      update="{s} = %s({s}, {args})" % v_update,
+      finalize="%s({s})" % v_finalize
+      )
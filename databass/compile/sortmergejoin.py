@@ -0,0 +1,16 @@
+from ..ops import SortMergeJoin
+from .translator import *
+
+
+class SortMergeJoinLeftTranslator(LeftTranslator):
+  def __init__(self, *args, **kwargs):
+    super(SortMergeJoinLeftTranslator, self).__init__(*args, **kwargs)
+
+    self.v_rows = None  # (key, row) pairs to sort
+
+class SortMergeJoinRightTranslator(RightTranslator):
+  def __init__(self, *args, **kwargs):
+    super(SortMergeJoinRightTranslator, self).__init__(*args, **kwargs)
+
+    self.v_rows = None
+    self.v_irow = None
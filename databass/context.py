@@ -46,6 +46,13 @@ class Context(object):
     # Initialized with a dummy dict
     self.op_vars = [dict()]
 
+    # key -> name of a variable declared once for the compiled program.
+    # See bind()
+    self.bindings = dict()
+
+    # stop flags of each loop being compiled, innermost last.  
+    # See loop() and stop_loops()
+    self.loops = []
 
   def add_line(self, line, **formatargs):
     if formatargs:
@@ -73,6 +80,19 @@ class Context(object):
         rhs = rhs.format(**formatargs)
     self.compiler.declare(lhs, rhs)
 
+  def bind(self, key, rhs, prefix="bound"):
+    """
+    Declare a new variable set to @rhs, unless a variable was already
+    bound for @key, so values that are constant for the whole query 
+    (e.g., a dictionary of encoded values) are only looked up once.
+
+    @return name of the variable bound to @key
+    """
+    if key not in self.bindings:
+      self.bindings[key] = self.new_var(prefix)
+      self.declare(self.bindings[key], rhs)
+    return self.bindings[key]
+
   def returns(self, line, **formatargs):
     if formatargs:
       line = line.format(**formatargs)
@@ -89,6 +109,38 @@ class Context(object):
       cond = cond.format(**formatargs)
     return self.compiler.indent(cond)
 
+  @contextmanager
+  def loop(self, cond, **formatargs):
+    """
+    Like indent(), for a loop that rows of the pipeline flow through.
+    If code in its body calls stop_loops(), e.g., LIMIT, the enclosing
+    loop exits as soon as this one exits because the stop flag is set
+    """
+    stops = []
+    self.loops.append(stops)
+    try:
+      with self.indent(cond, **formatargs):
+        yield self
+    finally:
+      self.loops.pop()
+
+    for v_stop in stops:
+      if self.loops and v_stop in self.loops[-1]:
+        with self.indent("if %s:" % v_stop):
+          self.add_line("break")
+
+  def stop_loops(self, v_stop, depth=0):
+    """
+    Exit the loops that enclose the current code once variable @v_stop
+    is true, except for the outermost @depth loops
+
+    @return whether any loop will be exited
+    """
+    for stops in self.loops[depth:]:
+      if v_stop not in stops:
+        stops.append(v_stop)
+    return len(self.loops) > depth
+
   def add_io_vars(self, in_var, out_var):
     """
     Add an io variable request for expression compilation.
@@ -1,26 +1,30 @@
 from .util import guess_type
 from .schema import Schema
 from .tables import *
+from .tablecache import TableCache
+from .statscatalog import StatsCatalog
+from .stats import Stats
+from .index import SortedIndex
+from .hashcache import HashTableCache
+from .spill import SpillStats
 import pandas
 import numbers
 import os
+import threading
 
 openfile = open
 
 
 
 def infer_schema_from_df(df):
-  from .exprs import guess_type, Attr
-  attrs = list(df.columns)
+  """
+  Attribute types come from the column dtypes: boolean and numeric
+  columns are "num", everything else is "str"
+  """
+  from .exprs import Attr
   schema = Schema([])
-  row = None
-  if df.shape[0]:
-    row = df.iloc[0].to_dict()
-
-  for attr in attrs:
-    typ = "str"
-    if row:
-      typ = guess_type(row[attr])
+  for attr, dtype in zip(df.columns, df.dtypes):
+    typ = "num" if dtype.kind in "biuf" else "str"
     schema.attrs.append(Attr(attr, typ))
   return schema
 
@@ -32,46 +36,173 @@ class Database(object):
   """
   Manages all tables registered in the database
   """
-  def __init__(self):
+  def __init__(self, lazy=False, warmup=False, cache_dir=None,
+      stream_threshold=None, dict_encode=False, hash_cache_budget=64 << 20,
+      sample_size=None, persist_stats=False, join_memory_budget=None,
+      sort_memory_budget=None, spill_dir=None):
+    """
+    @lazy      only catalog the data files that setup() finds, and parse each
+               file the first time its table is accessed
+    @warmup    if lazy, load the cataloged tables in a background thread
+    @cache_dir directory of pre-parsed, memory-mapped copies of the data
+               files (see TableCache).  Cached tables are ColumnarTables,
+               encoded according to @dict_encode.
+    @stream_threshold  data files larger than this many bytes are streamed
+               from disk as FileTables instead of being loaded into memory
+    @dict_encode  dictionary encode the string attributes of the data files
+               (or the attributes named in this list).  See register_dataframe
+    @hash_cache_budget  bytes of join hash tables over base tables to keep 
+               cached between queries (see HashTableCache)
+    @sample_size  rows sampled to estimate each table's statistics, and the
+               size above which distinct values are counted with sketches.
+               Defaults to Stats.SAMPLE_SIZE
+    @persist_stats  save the stats computed by analyze() to a catalog file
+               next to the table's data file, and use them when the file is
+               loaded again (see StatsCatalog).  Off by default, since it
+               writes into the data directories
+    @join_memory_budget  estimated bytes of a hash join's build side to
+               hold in memory.  Larger build sides are partitioned to 
+               temporary files in @spill_dir (see spill.SpillingHashTable).
+               None means unlimited
+    @sort_memory_budget  estimated bytes of ORDER BY rows, or of each 
+               input of a sort-merge join, to hold in memory.  Larger 
+               inputs are sorted in runs that are spilled to @spill_dir and
+               merged (see spill.ExternalSort)
+    """
     self.registry = {}
     self.id2table = {}
     self._df_registry = {}
     self.function_registry = {}
     self.table_function_registry = {}
+
+    # tablename -> path of data files that have not been loaded yet
+    self.catalog = {}
+
+    # index name -> SortedIndex.  See create_index()
+    self.indexes = {}
+    self.hash_tables = HashTableCache(hash_cache_budget)
+    self.join_memory_budget = join_memory_budget
+    self.sort_memory_budget = sort_memory_budget
+    self.spill_dir = spill_dir
+    self.spill_stats = SpillStats()
+    self.lazy = lazy
+    self.table_cache = TableCache(cache_dir) if cache_dir else None
+    self.stream_threshold = stream_threshold
+    self.dict_encode = dict_encode
+    self.sample_size = sample_size
+    self.stats_catalog = StatsCatalog() if persist_stats else None
+
+    # tablename -> path of the data file the table was loaded from
+    self.table_paths = {}
+    self._lock = threading.RLock()
     self.setup()
+    if lazy and warmup:
+      self.start_warmup()
 
   @staticmethod
-  def db():
+  def db(**kwargs):
+    """
+    @kwargs passed to the constructor when the singleton is first created
+    """
     if not Database._db:
-      Database._db = Database()
+      Database._db = Database(**kwargs)
     return Database._db
 
   def setup(self):
     """
     Walks all CSV files in the current directory and registers
-    them in the database
+    them in the database.  In lazy mode, they are only cataloged.
     """
     for root, dirs, files in os.walk("."):
       for fname in files:
         if fname.lower().endswith(".csv"):
-          self.register_file_by_path(os.path.join(root, fname))
+          path = os.path.join(root, fname)
+          if self.lazy:
+            self.catalog_file_by_path(path)
+          else:
+            self.register_file_by_path(path)
+
+  @staticmethod
+  def tablename_from_path(path):
+    tablename, _ = os.path.splitext(os.path.basename(path))
+    return tablename
+
+  def catalog_file_by_path(self, path):
+    """
+    Record the data file for the table without reading it.
+    It is parsed on the table's first access (see load())
+    """
+    self.catalog[self.tablename_from_path(path)] = path
+
+  def load(self, tablename):
+    """
+    Parse and register a cataloged table if it hasn't been loaded yet.
+    Safe to call concurrently with the warmup thread.
+    """
+    with self._lock:
+      path = self.catalog.get(tablename, None)
+      if path is not None:
+        self.register_file_by_path(path)
+        self.catalog.pop(tablename, None)
+      return self.registry.get(tablename, None)
+
+  def warmup(self):
+    """
+    Load every table that is still only cataloged
+    """
+    for tablename in list(self.catalog.keys()):
+      self.load(tablename)
+
+  def start_warmup(self):
+    """
+    Run warmup() in a background daemon thread
+    """
+    thread = threading.Thread(target=self.warmup, daemon=True)
+    thread.start()
+    return thread
 
-  def register_file_by_path(self, path):
+  def register_file_by_path(self, path, streaming=None):
+    """
+    @streaming register the file as a FileTable that is read from disk on
+               every scan.  By default, only files larger than
+               stream_threshold are streamed.
+    """
     root, fname = os.path.split(path)
-    tablename, _ = os.path.splitext(fname)
+    tablename = self.tablename_from_path(path)
     fpath = os.path.join(root, fname)
+    if streaming is None:
+      streaming = (self.stream_threshold is not None and
+          os.path.getsize(fpath) > self.stream_threshold)
+
+    if self.table_cache and not streaming:
+      table = self.table_cache.load(fpath, self.dict_encode)
+      if table is not None:
+        self.register_table(tablename, table.schema, table)
+        self.restore_stats(tablename, fpath)
+        return
+
     loaded = False
     exception = None
     for sep in [',', '|', '\t']:
       df = None
       try:
         with openfile(fpath) as f:
-          df = pandas.read_csv(f, sep=sep)
+          # a streamed file's schema is inferred from its first rows
+          df = pandas.read_csv(f, sep=sep, nrows=100 if streaming else None)
       except Exception as e:
         exception = e
 
       if df is not None:
-        self.register_dataframe(tablename, df)
+        if streaming:
+          schema = infer_schema_from_df(df)
+          self.register_table(tablename, schema, FileTable(schema, fpath, sep))
+        elif self.table_cache:
+          self.register_dataframe(tablename, df, columnar=True,
+              dict_encode=self.dict_encode)
+          self.table_cache.store(fpath, self[tablename], self.dict_encode)
+        else:
+          self.register_dataframe(tablename, df, dict_encode=self.dict_encode)
+        self.restore_stats(tablename, fpath)
         loaded = True
         break
 
@@ -80,21 +211,151 @@ class Database(object):
       print(exception)
 
 
+  def restore_stats(self, tablename, path):
+    """
+    Record that the table was loaded from @path, and use the stats saved
+    in the stats catalog for the file, if they are up to date
+    """
+    self.table_paths[tablename] = path
+    if self.stats_catalog is None:
+      return
+    saved = self.stats_catalog.load(path)
+    if saved is not None:
+      table = self.registry[tablename]
+      table._stats = Stats(table, table.sample_size, saved=saved)
+
+  def analyze(self, tablename):
+    """
+    Compute the stats and distributions of every attribute of the table,
+    like ANALYZE tablename.  If the table was loaded from a data file and
+    hasn't been appended to since, the stats are saved to the stats catalog
+
+    @return the table's Stats
+    """
+    table = self[tablename]
+    if table is None:
+      raise Exception("Table does not exist: %s" % tablename)
+
+    stats = Stats(table, table.sample_size)
+    for attr in table.schema:
+      stats[attr]
+      stats.distribution(attr)
+    table._stats = stats
+
+    path = self.table_paths.get(tablename, None)
+    if self.stats_catalog and path and table.version == 0:
+      self.stats_catalog.store(path, stats.to_dict())
+    return stats
+
   def register_table(self, tablename, schema, table):
+    if tablename in self.registry:
+      self.hash_tables.evict(self.registry[tablename])
     self.registry[tablename] = table
     self.id2table[table.id] = table
+    self.table_paths.pop(tablename, None)
+    if self.sample_size:
+      for t in [table] + list(getattr(table, "partitions", [])):
+        t.sample_size = self.sample_size
+    self.catalog.pop(tablename, None)
+
+    # indexes over the table being replaced are stale
+    self.drop_table_indexes(tablename)
+
+  def unregister_table(self, tablename):
+    """
+    Remove the table, like DROP TABLE, along with its indexes and cached
+    hash tables
+    """
+    table = self.registry.pop(tablename, None)
+    self.catalog.pop(tablename, None)
+    self.table_paths.pop(tablename, None)
+    self._df_registry.pop(tablename, None)
+    self.drop_table_indexes(tablename)
+    if table is not None:
+      self.id2table.pop(table.id, None)
+      for t in [table] + list(getattr(table, "partitions", [])):
+        self.hash_tables.evict(t)
+
+  def drop_table_indexes(self, tablename):
+    for name, index in list(self.indexes.items()):
+      if index.tablename == tablename:
+        del self.indexes[name]
+
+  def create_index(self, tablename, anames, name=None):
+    """
+    Build a SortedIndex over the table's @anames attributes, like
+    CREATE INDEX name ON tablename(anames).  The optimizer uses it
+    for selective predicates on the attributes
+
+    @anames attribute name or list of names
+    @return the new index
+    """
+    if isinstance(anames, str):
+      anames = [anames]
+    table = self[tablename]
+    if table is None:
+      raise Exception("Table does not exist: %s" % tablename)
+    if getattr(table, "streaming", False):
+      raise Exception("Cannot index streaming table %s" % tablename)
 
-  def register_dataframe(self, tablename, df):
+    name = name or "%s_%s_idx" % (tablename, "_".join(anames))
+    self.indexes[name] = SortedIndex(name, tablename, table, anames)
+    return self.indexes[name]
+
+  def drop_index(self, name):
+    self.indexes.pop(name, None)
+
+  def table_indexes(self, tablename):
+    """
+    @return the table's indexes, rebuilt if the table was appended to
+    """
+    return [idx.refresh() for idx in self.indexes.values() 
+        if idx.tablename == tablename]
+
+  def index(self, name):
+    index = self.indexes.get(name, None)
+    return index.refresh() if index is not None else None
+
+  def register_dataframe(self, tablename, df, columnar=True, dict_encode=False):
+    """
+    @columnar     store the table as a ColumnarTable that references the
+                  DataFrame's column arrays, without converting any rows.
+                  Otherwise, copy the rows into a row-oriented InMemoryTable
+    @dict_encode  dictionary encode string attributes of a columnar table,
+                  or only those named in this list.  Equality filters,
+                  hash joins and GROUP BY then operate on the integer codes
+    """
+    self._df_registry[tablename] = df
+    schema = infer_schema_from_df(df)
+    if columnar:
+      table = ColumnarTable.from_dataframe(df, schema, dict_encode)
+    else:
+      rows = list(df.T.to_dict().values())
+      rows = [[row[attr.aname] for attr in schema] for row in rows]
+      table = InMemoryTable(schema, rows)
+    self.register_table(tablename, schema, table)
+
+  def register_partitioned(self, tablename, df, aname, scheme="hash", 
+      npartitions=4, bounds=None, columnar=False):
+    """
+    Register @df as a PartitionedTable, partitioned on attribute @aname
+    
+    @scheme       "hash" or "range"
+    @npartitions  number of hash partitions
+    @bounds       sorted boundaries between range partitions
+    @columnar     store each partition as a ColumnarTable
+    """
     self._df_registry[tablename] = df
     schema = infer_schema_from_df(df)
-    rows = list(df.T.to_dict().values())
-    rows = [[row[attr.aname] for attr in schema] for row in rows]
-    table = InMemoryTable(schema, rows)
+    table = PartitionedTable.from_dataframe(df, schema, aname, scheme, 
+        npartitions, bounds, columnar)
     self.register_table(tablename, schema, table)
 
   @property
   def tablenames(self):
-    return list(self.registry.keys())
+    names = list(self.registry.keys())
+    names.extend(t for t in list(self.catalog.keys()) if t not in self.registry)
+    return names
 
   def schema(self, tablename):
     return self[tablename].schema
@@ -103,8 +364,14 @@ class Database(object):
     return self.id2table.get(id, None)
 
   def __contains__(self, tablename):
-    return tablename in self.registry
+    # check the catalog first: the warmup thread only removes a table from
+    # it after registering the table
+    return tablename in self.catalog or tablename in self.registry
 
   def __getitem__(self, tablename):
-    return self.registry.get(tablename, None)
+    table = self.registry.get(tablename, None)
+    if table is None:
+      # load() waits for the warmup thread, which may be registering the table
+      table = self.load(tablename)
+    return table
 
@@ -11,6 +11,19 @@
 """
 from .baseops import *
 from .util import guess_type
+from .batch import column
+
+
+# vectorized implementations of the binary operators.  See Expr.eval_batch
+BATCH_BINARY_OPS = {
+  "+": np.add, "-": np.subtract, "*": np.multiply, "/": np.true_divide,
+  "=": np.equal, "==": np.equal, "<>": np.not_equal, "!=": np.not_equal,
+  "<": np.less, ">": np.greater, "<=": np.less_equal, ">=": np.greater_equal,
+  "and": np.logical_and, "or": np.logical_or
+}
+BATCH_UNARY_OPS = {
+  "-": np.negative
+}
 
 
 def unary(op, v):
@@ -101,6 +114,17 @@ class ExprBase(Op):
   def to_str(self, ctx):
     ctx.add_line(str(self))
 
+  def eval_batch(self, batch):
+    """
+    Evaluate the expression over every row of a batch.Batch.  By default, 
+    the expression is called on each active row.
+
+    @return numpy array with one value per row of @batch (only the active
+            rows' values are meaningful), or a scalar if the value doesn't
+            depend on the row
+    """
+    return batch.scatter(column([self(row) for row in batch.rows()]))
+
 class Expr(ExprBase):
   boolean_ops = ["and", "or"]
   numeric_ops = ["+", "/", "*", "-", "<", ">", "<=", ">="]
@@ -169,6 +193,31 @@ class Expr(ExprBase):
     r = self.r(row)
     return binary(self.op, l, r)
 
+  def eval_batch(self, batch):
+    op = self.op.lower()
+    if self.r is None:
+      if op == "+":
+        return self.l.eval_batch(batch)
+      if op == "not":
+        return np.logical_not(self.l.eval_batch(batch))
+      if op in BATCH_UNARY_OPS:
+        return BATCH_UNARY_OPS[op](self.l.eval_batch(batch))
+    elif op in BATCH_BINARY_OPS:
+      l = self.l.eval_batch(batch)
+      r = self.r.eval_batch(batch)
+      # python's and/or return an operand rather than a boolean, which only
+      # logical_and/logical_or match if both operands are booleans
+      if op in Expr.boolean_ops and not (
+          np.asarray(l).dtype == bool and np.asarray(r).dtype == bool):
+        return super(Expr, self).eval_batch(batch)
+      try:
+        with np.errstate(all="ignore"):
+          return BATCH_BINARY_OPS[op](l, r)
+      except TypeError:
+        # e.g., comparing numbers with strings
+        pass
+    return super(Expr, self).eval_batch(batch)
+
 class Paren(ExprBase):
   def __init__(self, c):
     super(Paren, self).__init__()
@@ -189,6 +238,9 @@ class Paren(ExprBase):
   def __call__(self, row, row2=None):
     return self.c(row)
 
+  def eval_batch(self, batch):
+    return self.c.eval_batch(batch)
+
 
 class Between(ExprBase):
   def __init__(self, expr, lower, upper):
@@ -229,6 +281,15 @@ class Between(ExprBase):
     u = self.upper(row, row2)
     return e >= l and e <= u
 
+  def eval_batch(self, batch):
+    e = self.expr.eval_batch(batch)
+    try:
+      return np.logical_and(
+          np.greater_equal(e, self.lower.eval_batch(batch)),
+          np.less_equal(e, self.upper.eval_batch(batch)))
+    except TypeError:
+      return super(Between, self).eval_batch(batch)
+
 
 class AggFunc(ExprBase):
   """
@@ -320,6 +381,9 @@ class Literal(ExprBase):
   def __call__(self, row, row2=None):
     return self.v
 
+  def eval_batch(self, batch):
+    return self.v
+
   def get_type(self):
     return guess_type(self.v)
 
@@ -403,6 +467,13 @@ class Attr(ExprBase):
     # It should be initialized in optimizer.__call__()
     self.idx = idx
 
+    # tables.Dictionary if the attribute's values are dictionary encoded
+    # in the tuples.  Calling the Attr decodes the value, unless raw is set
+    # because the expression only needs to compare codes.
+    # Set along with idx in optimizer.__call__()
+    self.dictionary = None
+    self.raw = False
+
     self.id = ExprBase.next_id()
 
   def get_type(self):
@@ -452,7 +523,15 @@ class Attr(ExprBase):
 
 
   def __call__(self, row, *args):
-    return row[self.idx]
+    if self.dictionary is None or self.raw:
+      return row[self.idx]
+    return self.dictionary.values[row[self.idx]]
+
+  def eval_batch(self, batch):
+    col = batch.cols[self.idx]
+    if self.dictionary is None or self.raw:
+      return col
+    return self.dictionary.values[col]
 
   def __str__(self):
     s = ".".join(filter(bool, [self.tablename, self.aname]))
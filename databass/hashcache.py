@@ -0,0 +1,126 @@
+"""
+Cache of join hash tables built over base tables, so that joins whose build
+side is an unfiltered table scan don't rebuild the same hash table on every
+execution.  See Database.hash_tables
+"""
+from collections import OrderedDict
+from .spill import is_null_key
+
+
+class HashTableCache(object):
+  """
+  LRU cache of hash tables keyed by (table id, key attribute idx, whether the
+  key is decoded, table version).  Each hash table maps a key value to the
+  list of the table's rows, as emitted by table.iter_rows(encoded=True),
+  that have that value.  Composite keys are tuples of attribute idxs, and
+  their values are tuples.
+
+  Hash tables are evicted least recently used first once their estimated
+  total size exceeds the budget.  Hash tables larger than the whole budget
+  are built but not cached.
+  """
+  # rough per-row and per-value overheads of Python lists, used to
+  # estimate a hash table's size without walking it
+  ROW_BYTES = 64
+  VALUE_BYTES = 16
+
+  def __init__(self, budget):
+    """
+    @budget maximum estimated bytes of cached hash tables.  0 disables caching
+    """
+    self.budget = budget
+    self.entries = OrderedDict()   # key -> (hash table, nbytes)
+    self.nbytes = 0
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, table, idx, decode=False):
+    """
+    @table  base table to build the hash table over
+    @idx    index of the key attribute, or tuple of indexes of a 
+            composite key
+    @decode key on the decoded values of a dictionary-encoded attribute
+            rather than on its codes.  Tuple of flags for a composite key
+    @return hash table of the table's rows
+    """
+    key = (table.id, idx, decode, table.version)
+    if key in self.entries:
+      self.entries.move_to_end(key)
+      self.hits += 1
+      return self.entries[key][0]
+
+    self.misses += 1
+    ht = self.build(table, idx, decode)
+    nbytes = self.table_bytes(table)
+    if nbytes <= self.budget:
+      self.evict(table, keep_version=table.version)
+      self.entries[key] = (ht, nbytes)
+      self.nbytes += nbytes
+      while self.nbytes > self.budget:
+        self.pop_lru()
+    return ht
+
+  @staticmethod
+  def row_bytes(nattrs):
+    return HashTableCache.ROW_BYTES + HashTableCache.VALUE_BYTES * nattrs
+
+  @staticmethod
+  def table_bytes(table):
+    """
+    @return estimated size of a hash table over @table
+    """
+    return len(table) * HashTableCache.row_bytes(len(table.schema.attrs))
+
+  @staticmethod
+  def build(table, idx, decode=False):
+    if isinstance(idx, tuple):
+      return HashTableCache.build_composite(table, idx, decode)
+    dictionary = table.schema.attrs[idx].dictionary if decode else None
+    ht = dict()
+    for row in table.iter_rows(encoded=True):
+      val = row[idx]
+      if dictionary is not None:
+        val = dictionary[val]
+      if is_null_key(val):
+        continue
+      if val in ht:
+        ht[val].append(row)
+      else:
+        ht[val] = [row]
+    return ht
+
+  @staticmethod
+  def build_composite(table, idxs, decodes):
+    dictionaries = [table.schema.attrs[idx].dictionary if decode else None
+        for idx, decode in zip(idxs, decodes)]
+    ht = dict()
+    for row in table.iter_rows(encoded=True):
+      val = tuple(row[idx] if d is None else d[row[idx]] 
+          for idx, d in zip(idxs, dictionaries))
+      if is_null_key(val):
+        continue
+      if val in ht:
+        ht[val].append(row)
+      else:
+        ht[val] = [row]
+    return ht
+
+  def evict(self, table, keep_version=None):
+    """
+    Remove the hash tables built over @table, except for those of 
+    its @keep_version version
+    """
+    for key in list(self.entries.keys()):
+      if key[0] == table.id and key[3] != keep_version:
+        self.nbytes -= self.entries.pop(key)[1]
+
+  def pop_lru(self):
+    _, (_, nbytes) = self.entries.popitem(last=False)
+    self.nbytes -= nbytes
+
+  def clear(self):
+    self.entries.clear()
+    self.nbytes = 0
+
+  def __len__(self):
+    return len(self.entries)
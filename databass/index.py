@@ -0,0 +1,120 @@
+"""
+Secondary indexes over registered tables.  See Database.create_index()
+"""
+import numpy as np
+import pandas
+from .exprs import Attr
+from .zonemap import match_row
+
+
+class SortedIndex(object):
+  """
+  Index that stores the table's row ids sorted by the key attributes, and
+  the sorted key values so that lookups are binary searches.
+
+  It serves equality predicates on a prefix of the key attributes, followed
+  by range predicates on the next key attribute.  For instance, an index
+  on (a, b) serves a = 1, a > 1, or a = 1 and b < 10, but not b < 10.
+  """
+  def __init__(self, name, tablename, table, anames):
+    """
+    @anames names of the key attributes, in sort order
+    """
+    self.name = name
+    self.tablename = tablename
+    self.table = table
+    self.anames = list(anames)
+    self.idxs = [table.schema.idx(Attr(aname)) for aname in anames]
+    self.build()
+
+  def build(self):
+    table = self.table
+    self.version = table.version
+    df = pandas.DataFrame({ i: np.asarray(table.col_values(table.schema.attrs[idx]))
+      for i, idx in enumerate(self.idxs) })
+    df = df.sort_values(list(range(len(self.idxs))), kind="mergesort")
+
+    # rids[i] is the row id of the i'th smallest key
+    self.rids = df.index.to_numpy()
+    self.keys = [df[i].to_numpy() for i in range(len(self.idxs))]
+
+  def refresh(self):
+    """
+    Rebuild the index if rows were appended to the table since it was built
+    """
+    if self.version != self.table.version:
+      self.build()
+    return self
+
+  def served_preds(self, preds):
+    """
+    @preds list of (attr idx, op, value) predicates
+    @return the subset of @preds that lookup() can evaluate
+    """
+    served = []
+    for idx in self.idxs:
+      col_preds = [p for p in preds if p[0] == idx]
+      eqs = [p for p in col_preds if p[1] == "="]
+      if eqs:
+        served.append(eqs[0])
+        continue
+      served.extend(p for p in col_preds if p[1] != "=")
+      break
+    return served
+
+  def lookup(self, preds):
+    """
+    @preds predicates returned by served_preds()
+    @return (start, end) positions in self.rids of the matching rows
+    """
+    start, end = 0, len(self.rids)
+    for idx, keys in zip(self.idxs, self.keys):
+      col_preds = [p for p in preds if p[0] == idx]
+      if not col_preds:
+        break
+
+      # nulls are sorted last, and fail every comparison
+      if keys.dtype.kind == "f":
+        end = start + np.searchsorted(keys[start:end], np.nan, "left")
+
+      for _, op, v in col_preds:
+        keyrange = keys[start:end]
+        if op in ("=", ">="):
+          start += np.searchsorted(keyrange, v, "left")
+        elif op == ">":
+          start += np.searchsorted(keyrange, v, "right")
+        keyrange = keys[start:end]
+        if op in ("=", "<="):
+          end = start + np.searchsorted(keyrange, v, "right")
+        elif op == "<":
+          end = start + np.searchsorted(keyrange, v, "left")
+        end = max(start, end)
+
+      if any(op != "=" for _, op, _ in col_preds):
+        break
+    return int(start), int(end)
+
+  def count(self, preds):
+    start, end = self.lookup(preds)
+    return end - start
+
+  def iter_rows(self, preds, residual=None, encoded=False, rids=False):
+    """
+    @preds     predicates served by the index
+    @residual  other pushed-down predicates, checked on each fetched row
+    @return iterator of the matching rows in key order (or of (rid, row)
+            pairs if @rids).  Same arguments as Table.iter_rows()
+    """
+    start, end = self.lookup(preds)
+    ids = self.rids[start:end]
+    rows = self.table.rows_at(ids, encoded=encoded)
+    for rid, row in zip(ids.tolist(), rows):
+      if residual and not match_row(row, residual):
+        continue
+      if rids:
+        yield rid, row
+      else:
+        yield row
+
+  def __str__(self):
+    return "%s ON %s(%s)" % (self.name, self.tablename, ", ".join(self.anames))
@@ -1,6 +1,8 @@
 from .scan import *
 from .join import *
 from .hashjoin import *
+from .sortmergejoin import *
+from .indexjoin import *
 from .agg import *
 from .project import *
 from .orderby import *
@@ -5,6 +5,7 @@ from ..schema import *
 from ..tuples import *
 from ..util import cache, OBTuple
 from ..udfs import *
+from ..batch import Batch, BATCHSIZE, as_column, column, group_codes
 from itertools import chain
 
 
@@ -16,6 +17,26 @@ from itertools import chain
 
 
 
+def reduce_std(vals, starts, ends):
+  counts = ends - starts
+  means = np.add.reduceat(vals, starts) / counts
+  devs = vals - np.repeat(means, counts)
+  return np.sqrt(np.add.reduceat(devs * devs, starts) / counts)
+
+# vectorized segmented reductions for the builtin aggregate functions, 
+# keyed by the function that the AggUDF wraps.  Each takes a numeric array
+# sorted by group, and the start and end of each group's values
+AGG_REDUCERS = {
+  len: lambda vals, starts, ends: ends - starts,
+  np.sum: lambda vals, starts, ends: np.add.reduceat(vals, starts),
+  np.mean: lambda vals, starts, ends: np.add.reduceat(vals, starts) / (ends - starts),
+  np.std: reduce_std,
+  # fmin/fmax skip NaNs, like agg_min/agg_max
+  agg_min: lambda vals, starts, ends: np.fmin.reduceat(vals, starts),
+  agg_max: lambda vals, starts, ends: np.fmax.reduceat(vals, starts)
+}
+
+
 class GroupBy(UnaryOp):
   def __init__(self, c, group_exprs, project_exprs=None, aliases=None):
     """
@@ -79,6 +100,16 @@ class GroupBy(UnaryOp):
     self.group_term_schema = Schema(self.group_attrs)
     return self.schema
 
+  @property
+  def is_incremental(self):
+    """
+    @return whether every aggregate in the project_exprs is an IncAggFunc,
+            so that each group only needs its aggregates' states rather
+            than its rows
+    """
+    return all(e.is_type(IncAggFunc) for e in self.project_exprs 
+        if e.is_type(AggFunc))
+
   def __iter__(self):
     """
     GroupBy works as follows:
@@ -87,12 +118,52 @@ class GroupBy(UnaryOp):
       * key is defined by the group_exprs expressions  
       * Track the values of the attributes from the most recent tuple that is
         referenced in the grouping expressions
-      * Track the tuples in each bucket
+      * Track the state of each incremental aggregate, or if any aggregate 
+        is not incremental, the tuples in each bucket
     * Iterate through each bucket, compose and populate a tuple that conforms to 
       this operator's output schema (see self.init_schema)
     """
+    if self.is_incremental:
+      return self.iter_incremental()
+    return self.iter_buffered()
+
+  def iter_incremental(self):
+    """
+    Update the init/update/finalize state of each aggregate as rows arrive,
+    so memory is proportional to the number of groups
+    """
+    aggs = [e for e in self.project_exprs if e.is_type(AggFunc)]
+    hashtable = dict()
+
+    for row in self.c:
+      attrvals = [attr(row) for attr in self.group_attrs]
+      key = tuple([e(row) for e in self.group_exprs])
+      bucket = hashtable.get(key, None)
+      if bucket is None:
+        bucket = hashtable[key] = [None, [agg.init() for agg in aggs]]
+      bucket[0] = attrvals
+      states = bucket[1]
+      for i, agg in enumerate(aggs):
+        states[i] = agg.update(states[i], row)
+
+    irow = ListTuple(self.schema, [])
+    termrow = ListTuple(self.group_term_schema)
+    for attrvals, states in hashtable.values():
+      states = iter(states)
+      for i, e in enumerate(self.project_exprs):
+        if e.is_type(AggFunc):
+          irow.row[i] = e.finalize(next(states))
+        else:
+          termrow.row = attrvals
+          irow.row[i] = e(termrow)
+      yield irow
 
-    hashtable = defaultdict(lambda: [None, None, []])
+  def iter_buffered(self):
+    """
+    Collect each group's rows, and call the aggregates on them.  Needed
+    for holistic aggregates
+    """
+    hashtable = defaultdict(lambda: [None, []])
 
     # initialize output row passed to parent operator
     irow = ListTuple(self.schema, [])
@@ -102,13 +173,11 @@ class GroupBy(UnaryOp):
 
     for row in self.c:
       attrvals = [attr(row) for attr in self.group_attrs]
-      groupvals = tuple([e(row) for e in self.group_exprs])
-      key = hash(groupvals)
-      hashtable[key][0] = key
-      hashtable[key][1] = attrvals
-      hashtable[key][2].append(row.copy())
+      key = tuple([e(row) for e in self.group_exprs])
+      hashtable[key][0] = attrvals
+      hashtable[key][1].append(row.copy())
 
-    for _, (key, attrvals, group) in list(hashtable.items()):
+    for attrvals, group in list(hashtable.values()):
       for i, e in enumerate(self.project_exprs):
         if e.is_type(AggFunc):
           irow.row[i] = e(group)
@@ -117,6 +186,58 @@ class GroupBy(UnaryOp):
           irow.row[i] = e(termrow)
       yield irow
 
+  def iter_batches(self):
+    """
+    Assigns each row of the child's batches a group id, then computes each
+    output column for all of the groups at once:
+
+    * common aggregates over numeric columns are segmented reductions
+      (see agg_batch)
+    * other aggregates are called on each group's rows
+    * other project expressions are evaluated over a batch of each group's
+      last group_attrs values, like __iter__ does
+    """
+    batch = Batch.concat(list(self.c.iter_batches()), len(self.c.schema.attrs))
+    n = batch.n
+    keys = [as_column(e.eval_batch(batch), n) for e in self.group_exprs]
+    codes, ngroups = group_codes(keys, n)
+    if not ngroups:
+      return
+
+    # rows sorted by group, and the start of each group's rows
+    order = np.argsort(codes, kind="stable")
+    starts = np.searchsorted(codes[order], np.arange(ngroups))
+    ends = np.append(starts[1:], n)
+    last = order[ends - 1]
+
+    termbatch = Batch([as_column(a.eval_batch(batch), n)[last] 
+      for a in self.group_attrs])
+    cols = []
+    for e in self.project_exprs:
+      if e.is_type(AggFunc):
+        cols.append(self.agg_batch(e, batch, order, starts, ends))
+      else:
+        cols.append(as_column(e.eval_batch(termbatch), ngroups))
+
+    for start in range(0, ngroups, BATCHSIZE):
+      yield Batch([col[start:start + BATCHSIZE] for col in cols])
+
+  def agg_batch(self, e, batch, order, starts, ends):
+    """
+    @e      AggFunc
+    @order  positions of the batch's rows, sorted by group
+    @starts, ends  each group's range in @order
+    @return array of the aggregate's value for each group
+    """
+    args = [as_column(arg.eval_batch(batch), batch.n)[order] for arg in e.args]
+    f = getattr(e.f, "f", None)
+    if len(args) == 1 and args[0].dtype.kind in "biuf" and f in AGG_REDUCERS:
+      with np.errstate(all="ignore"):
+        return AGG_REDUCERS[f](args[0], starts, ends)
+
+    return column([e.f(*[tuple(arg[s:t].tolist()) for arg in args]) 
+      for s, t in zip(starts, ends)])
+
   def __str__(self):
     args = list(map(str, self.group_exprs))
     args.append("|")
@@ -5,71 +5,252 @@ from ..schema import *
 from ..tuples import *
 from ..util import cache, OBTuple
 from .join import *
+from .scan import Scan, IndexScan
+from ..batch import Batch, as_column, join_pairs
+from ..hashcache import HashTableCache
+from ..spill import SpillingHashTable, is_null_key
 from itertools import chain
 
    
 class HashJoin(Join):
   """
-  Hash Join
+  Hash Join.  The hash table is built over the left input and probed with
+  the rows of the right input, in both the interpreted and compiled 
+  engines, so the optimizer places the smaller input on the left
   """
   def __init__(self, l, r, join_attrs):
     """
-    @l    left table of the join
-    @r    right table of the join
-    @join_attrs two attributes to join on, hash join checks if the 
-                attribute values from the left and right tables are
-                the same.  Suppose:
+    @l    left (build) side of the join
+    @r    right (probe) side of the join
+    @join_attrs the left and right join keys.  Each key is an attribute, 
+                or a list of attributes for a composite key.  Hash join
+                checks if the key values from the left and right tables 
+                are the same.  Suppose:
                 
                   l = iowa, r = iowa, join_attrs = ["STORE", "storee"]
 
                 then we return all pairs of (l, r) where 
-                l.STORE = r.storee
+                l.STORE = r.storee.  And for 
+                join_attrs = [["STORE", "DATE"], ["storee", "datee"]],
+                where l.STORE = r.storee and l.DATE = r.datee
     """
     super(HashJoin, self).__init__(l, r)
-    self.join_attrs = join_attrs
+    lattrs, rattrs = join_attrs
+    if not isinstance(lattrs, list): lattrs = [lattrs]
+    if not isinstance(rattrs, list): rattrs = [rattrs]
+    assert(len(lattrs) == len(rattrs))
+    self.join_attrs = [lattrs, rattrs]
 
+  @staticmethod
+  def key_func(attrs):
+    """
+    @return function that computes a row's join key: the attribute's value,
+            or the tuple of values of a composite key
+    """
+    if len(attrs) == 1:
+      return attrs[0]
+    return lambda row: tuple(attr(row) for attr in attrs)
+
+  is_null_key = staticmethod(is_null_key)
 
+  @staticmethod
+  def cache_key(attrs):
+    """
+    @return (attribute idx, whether to decode) arguments of 
+            HashTableCache.get() for the key @attrs.  Composite keys 
+            pass tuples of both
+    """
+    decodes = [attr.dictionary is not None and not attr.raw for attr in attrs]
+    if len(attrs) == 1:
+      return attrs[0].idx, decodes[0]
+    return tuple(attr.idx for attr in attrs), tuple(decodes)
 
   def __iter__(self):
     """
-    Build an index on the inner (right) source, then probe the index
-    for each row in the outer (left) source.  
+    Build an index on the left source, then probe the index
+    for each row in the right source.  
     
     Yields each join result
     """
     # initialize intermediate row to populate and pass to parent operators
     irow = ListTuple(self.schema)
-    lidx = self.join_attrs[0].idx
-    ridx = self.join_attrs[1].idx
+    lattrs, rattrs = self.join_attrs
 
-    index = self.build_hash_index(self.r, ridx)
+    if self.is_partition_wise():
+      for row in self.iter_partition_wise():
+        irow.row = row
+        yield irow
+      return
 
-    for lrow in self.l:
+    if self.spills():
+      for lrow, rrow in self.iter_spilling():
+        irow.row[:len(lrow)] = lrow
+        irow.row[len(lrow):] = rrow
+        yield irow
+      return
+
+    if self.is_base_table(self.l):
+      # reuse the hash table of an unfiltered base table
+      table = self.l.db[self.l.tablename]
+      index = self.l.db.hash_tables.get(table, *self.cache_key(lattrs))
+    else:
+      index = self.build_hash_index(self.l, lattrs)
+
+    nlattrs = len(self.l.schema.attrs)
+    rkey = self.key_func(rattrs)
+    is_null_key = self.is_null_key
+    for rrow in self.r:
       # probe the hash index
-      lval = lrow[lidx]
-      key = hash(lval)
-      matches = index[key]
+      key = rkey(rrow)
+      if is_null_key(key):
+        continue
+      matches = index.get(key, ())
 
       # generate outputs for all matching tuples
-      irow.row[:len(lrow.row)] = lrow.row
-      for rrow in matches:
-        irow.row[len(lrow.row):] = rrow.row
-        # TODO: typically, check join condition again
+      irow.row[nlattrs:] = rrow.row
+      for lrow in matches:
+        irow.row[:nlattrs] = lrow
         yield irow
 
-  def build_hash_index(self, child_iter, idx):
+  def spills(self):
+    """
+    @return whether the build side should be limited to the database's
+            join_memory_budget.  Cached hash tables of base tables that 
+            fit in the budget are used as is
+    """
+    db = Database.db()
+    budget = db.join_memory_budget
+    if budget is None or self.is_partition_wise():
+      return False
+    if self.is_base_table(self.l):
+      return HashTableCache.table_bytes(db[self.l.tablename]) > budget
+    return True
+
+  def iter_spilling(self):
+    """
+    Grace hash join whose build side holds at most join_memory_budget
+    bytes in memory (see SpillingHashTable).  
+
+    @return iterator of (left row, right row) lists
+    """
+    db = Database.db()
+    lattrs, rattrs = self.join_attrs
+    lkey, rkey = self.key_func(lattrs), self.key_func(rattrs)
+    row_bytes = HashTableCache.row_bytes(len(self.l.schema.attrs))
+    ht = SpillingHashTable(db.join_memory_budget, row_bytes, 
+        db.spill_stats, db.spill_dir)
+    for lrow in self.l:
+      ht.add(lkey(lrow), list(lrow.row))
+    for rrow in self.r:
+      for lrow in ht.probe(rkey(rrow), rrow.row):
+        yield lrow, rrow.row
+    for pair in ht.spilled_pairs():
+      yield pair
+
+  def iter_batches(self):
+    """
+    Collect the left child's batches, then join them with each right batch
+    using vectorized equijoins of the key columns (see batch.join_pairs).
+    Joins under a memory budget batch the rows of the grace hash join
+    """
+    if self.spills():
+      for batch in super(HashJoin, self).iter_batches():
+        yield batch
+      return
+    lattrs, rattrs = self.join_attrs
+    left = Batch.concat(list(self.l.iter_batches()), len(self.l.schema.attrs))
+    if not len(left):
+      return
+    lkeys = [as_column(attr.eval_batch(left), left.n) for attr in lattrs]
+
+    for batch in self.r.iter_batches():
+      batch = batch.compact()
+      rkeys = [as_column(attr.eval_batch(batch), batch.n) for attr in rattrs]
+      ridxs, lidxs = join_pairs(rkeys, lkeys)
+      if not len(lidxs):
+        continue
+      yield Batch(left.take(lidxs).cols + batch.take(ridxs).cols)
+
+  def is_partition_wise(self):
+    """
+    @return whether both children scan tables that are partitioned the same 
+            way on the join attributes, so each partition of the left table
+            only needs to be joined with the same partition of the right 
+    """
+    from ..tables import PartitionedTable
+    l, r = self.l, self.r
+    if not (l.is_type(Scan) and r.is_type(Scan)):
+      return False
+    if l.is_type(IndexScan) or r.is_type(IndexScan):
+      return False
+    ltable, rtable = l.db[l.tablename], r.db[r.tablename]
+    if not (isinstance(ltable, PartitionedTable) and 
+        ltable.same_partitioning(rtable)):
+      return False
+    # any component of the key may be the partitioning attribute
+    return any(lattr.idx == ltable.part_idx and rattr.idx == rtable.part_idx
+        for lattr, rattr in zip(*self.join_attrs))
+
+  def iter_partition_wise(self):
+    """
+    Join the matching partitions of the left and right tables one pair at
+    a time, so that the hash table only holds one right partition
+    """
+    lattrs, rattrs = self.join_attrs
+    ltable = self.l.db[self.l.tablename]
+    rtable = self.r.db[self.r.tablename]
+    lparts = self.l.partitions
+    rparts = self.r.partitions
+    pids = range(len(ltable.partitions))
+    pids = [pid for pid in pids 
+        if (lparts is None or pid in lparts) and (rparts is None or pid in rparts)]
+
+    lkey, rkey = self.key_func(lattrs), self.key_func(rattrs)
+    for pid in pids:
+      if not self.l.preds:
+        index = self.l.db.hash_tables.get(ltable.partitions[pid], 
+            *self.cache_key(lattrs))
+      else:
+        index = defaultdict(list)
+        for lrow in self.l.iter_rows([pid]):
+          key = lkey(lrow)
+          if not self.is_null_key(key):
+            index[key].append(lrow)
+
+      for rrow in self.r.iter_rows([pid]):
+        key = rkey(rrow)
+        if self.is_null_key(key):
+          continue
+        for lrow in index.get(key, ()):
+          yield lrow + rrow
+
+  @staticmethod
+  def is_base_table(op):
+    """
+    @return whether @op scans a whole base table, so that a hash table 
+            over it can be cached (see HashTableCache)
+    """
+    return (op.is_type(Scan) and not op.is_type(IndexScan) and 
+        not op.preds)
+
+  def build_hash_index(self, child_iter, attrs):
     """
     @child_iter tuple iterator to construct an index over
-    @attr attribute name to build index on
+    @attrs list of Attrs that make up the key
 
-    Loops through a tuple iterator and creates an index based on
-    the attr value
+    Loops through a tuple iterator and creates an index from 
+    the key value to the list of rows with that value.  
+    Rows with NULL keys are left out
     """
     index = defaultdict(list)
+    key_func = self.key_func(attrs)
     for row in child_iter:
-      val = row[idx]
-      key = hash(val)
-      index[key].append(row.copy())
+      key = key_func(row)
+      if not self.is_null_key(key):
+        index[key].append(list(row.row))
     return index
 
+  def __str__(self):
+    conds = ["%s = %s" % (lattr, rattr) for lattr, rattr in zip(*self.join_attrs)]
+    return "HASHJOIN(ON %s)" % " AND ".join(conds)
 
@@ -0,0 +1,79 @@
+from ..baseops import *
+from ..exprs import *
+from ..db import Database
+from ..schema import *
+from ..tuples import *
+from .join import *
+from .scan import Scan, IndexScan
+from ..spill import is_null_key
+
+
+class IndexNestedLoopJoin(Join):
+  """
+  Index Nested Loop Join.  For each row of the left (outer) input, the
+  right (inner) table's index is probed for the rows with the same join
+  key, so the inner table is never scanned and only its matching rows
+  are fetched.
+  """
+  def __init__(self, l, r, join_attrs, index):
+    """
+    @l    left (outer) subplan of the join
+    @r    Scan of the indexed table.  Its pushed-down preds are checked
+          on each fetched row
+    @join_attrs the left and right join keys, as in HashJoin.  The right
+          attributes are a prefix of the index's attributes
+    @index name of the index in the Database (see Database.create_index)
+    """
+    super(IndexNestedLoopJoin, self).__init__(l, r)
+    lattrs, rattrs = join_attrs
+    if not isinstance(lattrs, list): lattrs = [lattrs]
+    if not isinstance(rattrs, list): rattrs = [rattrs]
+    assert(len(lattrs) == len(rattrs))
+    assert(r.is_type(Scan) and not r.is_type(IndexScan))
+    self.join_attrs = [lattrs, rattrs]
+    self.index = index
+
+  is_null_key = staticmethod(is_null_key)
+
+  @staticmethod
+  def probe_attrs(index, attrs):
+    """
+    @index SortedIndex over the inner table
+    @attrs the inner table's join attributes
+    @return positions in @attrs of the longest prefix of @index's
+            attributes that are join attributes, which the index can probe
+    """
+    keys = []
+    for aname in index.anames:
+      found = [i for i, attr in enumerate(attrs)
+          if attr.aname == aname and i not in keys]
+      if not found:
+        break
+      keys.append(found[0])
+    return keys
+
+  def __iter__(self):
+    """
+    Probe the index with each left row's join key.
+    Yields each join result
+    """
+    irow = ListTuple(self.schema)
+    lattrs, rattrs = self.join_attrs
+    nlattrs = len(self.l.schema.attrs)
+    index = Database.db().index(self.index)
+    idxs = [attr.idx for attr in rattrs]
+    is_null_key = self.is_null_key
+
+    for lrow in self.l:
+      key = tuple(attr(lrow) for attr in lattrs)
+      if is_null_key(key):
+        continue
+      preds = [(idx, "=", v) for idx, v in zip(idxs, key)]
+      irow.row[:nlattrs] = lrow.row
+      for rrow in index.iter_rows(preds, self.r.preds, encoded=True):
+        irow.row[nlattrs:] = rrow
+        yield irow
+
+  def __str__(self):
+    conds = ["%s = %s" % (lattr, rattr) for lattr, rattr in zip(*self.join_attrs)]
+    return "INDEXJOIN(ON %s USING %s)" % (" AND ".join(conds), self.index)
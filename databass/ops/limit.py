@@ -4,6 +4,7 @@ from ..db import Database
 from ..schema import *
 from ..tuples import *
 from ..util import cache, OBTuple
+from ..batch import Batch
 from itertools import chain
 
 class Limit(UnaryOp):
@@ -44,6 +45,23 @@ class Limit(UnaryOp):
       nyielded += 1
       yield row
 
+  def iter_batches(self):
+    skip, remaining = self._offset, self._limit
+    if not remaining:
+      return
+    for batch in self.c.iter_batches():
+      sel = batch.active()
+      if skip:
+        n = min(skip, len(sel))
+        sel, skip = sel[n:], skip - n
+      sel = sel[:remaining]
+      if not len(sel):
+        continue
+      remaining -= len(sel)
+      yield Batch(batch.cols, sel)
+      if not remaining:
+        break
+
   def __str__(self):
     return "LIMIT(%s OFFSET %s)" % (self.limit, self.offset)
 
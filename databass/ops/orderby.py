@@ -3,7 +3,10 @@ from ..exprs import *
 from ..db import Database
 from ..schema import *
 from ..tuples import *
-from ..util import cache, OBTuple
+from ..util import cache, OBTuple, BoundedHeap
+from ..batch import Batch, BATCHSIZE, as_column
+from ..hashcache import HashTableCache
+from ..spill import ExternalSort
 from itertools import chain
 
 class OrderBy(UnaryOp):
@@ -33,14 +36,99 @@ class OrderBy(UnaryOp):
       vals = tuple(expr(row) for expr in self.order_exprs)
       return OBTuple(vals, order)
 
+    db = Database.db()
+    if db.sort_memory_budget is not None:
+      for row in self.iter_external(keyf):
+        yield row
+      return
+
     rows = [row.copy() for row in self.c]
     rows.sort(key=keyf)
     for row in rows:
       yield row
 
+  def iter_external(self, keyf):
+    """
+    Sort with at most sort_memory_budget bytes of rows in memory 
+    (see ExternalSort)
+    """
+    db = Database.db()
+    row_bytes = HashTableCache.row_bytes(len(self.schema.attrs))
+    rows = ExternalSort(keyf, db.sort_memory_budget, row_bytes, 
+        db.spill_stats, db.spill_dir)
+    for row in self.c:
+      rows.add(list(row.row))
+
+    irow = ListTuple(self.schema)
+    for row in rows:
+      irow.row = row
+      yield irow
+
+  def iter_batches(self):
+    """
+    Sorts all of the child's batches at once with a stable multi-key sort.
+    Sorts under a memory budget batch the rows of the external sort
+    """
+    if Database.db().sort_memory_budget is not None:
+      for batch in super(OrderBy, self).iter_batches():
+        yield batch
+      return
+    batch = Batch.concat(list(self.c.iter_batches()), len(self.schema.attrs))
+    if not len(batch):
+      return
+    keys = pandas.DataFrame({ i: as_column(e.eval_batch(batch), batch.n)
+      for i, e in enumerate(self.order_exprs) })
+    keys = keys.sort_values(list(keys.columns), 
+        ascending=[ad == "asc" for ad in self.ascdescs], kind="mergesort")
+    order = keys.index.to_numpy()
+    for start in range(0, len(order), BATCHSIZE):
+      yield batch.take(order[start:start + BATCHSIZE])
+
   def __str__(self):
     args = ", ".join(["%s %s" % (e, ad) 
       for (e, ad) in  zip(self.order_exprs, self.ascdescs)])
     return "ORDERBY(%s)" % args
 
 
+class TopN(OrderBy):
+  """
+  ORDER BY ... LIMIT fused into one operator that only keeps the first
+  offset+limit rows in a bounded heap, rather than sorting all of its 
+  input.  The optimizer rewrites Limit(OrderBy) into TopN
+  """
+
+  def __init__(self, c, order_exprs, ascdescs, limit, offset=0):
+    """
+    @limit  number of tuples to return
+    @offset number of tuples to skip first
+    """
+    super(TopN, self).__init__(c, order_exprs, ascdescs)
+    self.limit = limit
+    self.offset = offset
+
+  @property
+  def k(self):
+    return self.offset + self.limit
+
+  def keyf(self):
+    order = [1 if x == "asc" else -1 for x in self.ascdescs]
+    def keyf(row):
+      vals = tuple(expr(row) for expr in self.order_exprs)
+      return OBTuple(vals, order)
+    return keyf
+
+  def __iter__(self):
+    heap = BoundedHeap(self.k, self.keyf(), copy=lambda row: row.copy())
+    for row in self.c:
+      heap.push(row)
+    for row in heap.sorted()[self.offset:]:
+      yield row
+
+  def iter_batches(self):
+    return UnaryOp.iter_batches(self)
+
+  def __str__(self):
+    args = ", ".join(["%s %s" % (e, ad) 
+      for (e, ad) in  zip(self.order_exprs, self.ascdescs)])
+    return "TOPN(%s LIMIT %s OFFSET %s)" % (args, self.limit, self.offset)
+
@@ -4,6 +4,7 @@ from ..db import Database
 from ..schema import *
 from ..tuples import *
 from ..util import cache, OBTuple
+from ..batch import Batch, as_column
 from itertools import chain
 
 ########################################################
@@ -49,6 +50,18 @@ class Project(UnaryOp):
         irow.row[i] = exp(row)
       yield irow
 
+  def iter_batches(self):
+    if self.c == None:
+      for batch in super(Project, self).iter_batches():
+        yield batch
+      return
+
+    # the output columns are aligned with the child's, so the 
+    # selection vector carries over
+    for batch in self.c.iter_batches():
+      cols = [as_column(e.eval_batch(batch), batch.n) for e in self.exprs]
+      yield Batch(cols, batch.sel)
+
   def __str__(self):
     args = ", ".join(["%s AS %s" % (e, a) 
       for (e, a) in  zip(self.exprs, self.aliases)])
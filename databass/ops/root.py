@@ -1,22 +1,66 @@
 from ..baseops import *
+from ..tuples import ListTuple
 
 class Sink(UnaryOp):
+  def __init__(self, c=None, batched=False):
+    """
+    @batched run the plan batch-at-a-time (see Op.iter_batches), and only
+             convert the sink's input batches to rows
+    """
+    super(Sink, self).__init__(c)
+    self.batched = batched
+
   def init_schema(self):
     self.schema = self.c.schema
     return self.schema
 
+  def iter_decoded(self):
+    """
+    Iterate over the child's rows, decoding any dictionary-encoded
+    attributes that reach the sink without going through a Project
+    """
+    encoded = [(i, a.dictionary) for i, a in enumerate(self.schema)
+        if a.dictionary is not None]
+    if self.batched:
+      for row in self.iter_batch_rows(encoded):
+        yield row
+      return
+
+    if not encoded:
+      for row in self.c:
+        yield row
+      return
+
+    irow = ListTuple(self.schema)
+    for row in self.c:
+      irow.row = list(row.row)
+      for i, dictionary in encoded:
+        irow.row[i] = dictionary[irow.row[i]]
+      yield irow
+
+
+  def iter_batch_rows(self, encoded):
+    irow = ListTuple(self.schema)
+    for batch in self.c.iter_batches():
+      cols = list(batch.compact().cols)
+      for i, dictionary in encoded:
+        cols[i] = dictionary.values[cols[i]]
+      for row in zip(*[col.tolist() for col in cols]):
+        irow.row = list(row)
+        yield irow
+
 
 class Yield(Sink):
   def __iter__(self):
-    return iter(self.c)
+    return iter(self.iter_decoded())
 
 class Collect(Sink):
   def __iter__(self):
-    return [row for row in self.c]
+    return [row for row in self.iter_decoded()]
 
 class Print(Sink):
   def __iter__(self):
-    for row in self.c:
+    for row in self.iter_decoded():
       print(row)
     yield 
 
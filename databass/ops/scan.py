@@ -57,10 +57,20 @@ class Scan(Source):
   """
   A scan operator over a table in the Database singleton.
   """
-  def __init__(self, tablename, alias=None):
+  def __init__(self, tablename, alias=None, preds=None):
+    """
+    @preds list of (attr idx, op, value) predicates that the table
+           evaluates during the scan (see zonemap.py).  
+           Set by the optimizer's predicate pushdown
+    """
     super(Scan, self).__init__()
     self.tablename = tablename
     self.alias = alias or tablename
+    self.preds = preds or []
+
+    # ids of the partitions of a PartitionedTable that the scan reads, 
+    # or None to read all of them.  Set by the optimizer's partition pruning
+    self.partitions = None
 
     from ..db import Database
     self.db = Database.db()
@@ -79,13 +89,77 @@ class Scan(Source):
     # initialize a single intermediate tuple
     irow = ListTuple(self.schema, [])
 
-    for row in self.db[self.tablename]:
-      irow.row = row.row
+    # dictionary-encoded attributes are decoded by the Attrs that read them
+    for row in self.iter_rows():
+      irow.row = row
       yield irow
 
+  def iter_rows(self, partitions=None):
+    """
+    @partitions if set, only read these partitions of a PartitionedTable
+    @return iterator over the table's row lists that the scan emits
+    """
+    kwargs = dict(encoded=True, preds=self.preds)
+    if partitions is None:
+      partitions = self.partitions
+    if partitions is not None:
+      kwargs['partitions'] = partitions
+    return self.db[self.tablename].iter_rows(**kwargs)
+
+  def iter_batches(self):
+    kwargs = dict(encoded=True, preds=self.preds)
+    if self.partitions is not None:
+      kwargs['partitions'] = self.partitions
+    return self.db[self.tablename].iter_batches(**kwargs)
+
+  def preds_str(self):
+    attrs = self.schema.attrs if self.schema else None
+    return " and ".join("%s %s %s" % (
+      attrs[idx].aname if attrs else idx, op, v) for idx, op, v in self.preds)
 
   def __str__(self):
-    return "Scan(%s AS %s)" % (self.tablename, self.alias)
+    s = "Scan(%s AS %s" % (self.tablename, self.alias)
+    if self.partitions is not None:
+      s += " PARTITIONS %s" % self.partitions
+    if self.preds:
+      s += " WHERE %s" % self.preds_str()
+    return s + ")"
+
+class IndexScan(Scan):
+  """
+  Scan that fetches the rows satisfying index_preds through a secondary
+  index (see index.py) rather than reading the whole table.  The remaining
+  pushed-down preds are checked on each fetched row.
+  """
+  def __init__(self, tablename, alias=None, index=None, index_preds=None, 
+      preds=None):
+    """
+    @index        name of the index in the Database
+    @index_preds  (attr idx, op, value) predicates that the index serves
+    """
+    super(IndexScan, self).__init__(tablename, alias, preds)
+    self.index = index
+    self.index_preds = index_preds or []
+
+  def __iter__(self):
+    irow = ListTuple(self.schema, [])
+    index = self.db.index(self.index)
+    for row in index.iter_rows(self.index_preds, self.preds, encoded=True):
+      irow.row = row
+      yield irow
+
+  def iter_batches(self):
+    # index lookups fetch rows, so batch them
+    return Op.iter_batches(self)
+
+  def __str__(self):
+    args = [self.index] + ["%s %s %s" % p for p in self.index_preds]
+    s = "IndexScan(%s AS %s USING %s" % (self.tablename, self.alias, 
+        " ".join(args))
+    if self.preds:
+      s += " WHERE %s" % self.preds_str()
+    return s + ")"
+
 
 class TableFunctionSource(UnaryOp):
   """
@@ -0,0 +1,162 @@
+from ..baseops import *
+from ..exprs import *
+from ..db import Database
+from ..schema import *
+from ..tuples import *
+from .join import *
+from .hashjoin import HashJoin
+from .orderby import OrderBy
+from .scan import IndexScan, SubQuerySource
+from .project import Project
+from .where import Filter
+from ..hashcache import HashTableCache
+from ..spill import ExternalSort, is_null_key
+from operator import itemgetter
+
+
+class SortMergeJoin(Join):
+  """
+  Sort-Merge Join.  Both inputs are sorted on their join keys, and then
+  merged, so the output is sorted on the join key.  Inputs that are already
+  sorted on their keys (see sorted_on) are merged as they stream in, and
+  the others are sorted under the database's sort_memory_budget
+  (see spill.ExternalSort), so neither side needs to fit in memory.
+  """
+  def __init__(self, l, r, join_attrs):
+    """
+    @l    left side of the join
+    @r    right side of the join
+    @join_attrs the left and right join keys, as in HashJoin
+    """
+    super(SortMergeJoin, self).__init__(l, r)
+    lattrs, rattrs = join_attrs
+    if not isinstance(lattrs, list): lattrs = [lattrs]
+    if not isinstance(rattrs, list): rattrs = [rattrs]
+    assert(len(lattrs) == len(rattrs))
+    self.join_attrs = [lattrs, rattrs]
+
+  key_func = staticmethod(HashJoin.key_func)
+
+  # NULL keys, including NaNs, don't match anything and can't be sorted
+  is_null_key = staticmethod(is_null_key)
+
+  @staticmethod
+  def sorted_on(op, attrs):
+    """
+    @return whether @op's output is known to be sorted ascending on @attrs.
+            Dictionary-encoded attributes are never considered sorted,
+            since their codes may not be in the order of their values
+    """
+    if any(attr.dictionary is not None for attr in attrs):
+      return False
+    def matches(keys):
+      return len(keys) == len(attrs) and all(
+          a.aname == attr.aname and 
+          (a.tablename is None or attr.tablename is None or 
+            a.tablename == attr.tablename)
+          for a, attr in zip(keys, attrs))
+
+    if op.is_type(Filter):
+      return SortMergeJoin.sorted_on(op.c, attrs)
+    if op.is_type(SubQuerySource):
+      if any(attr.tablename not in (None, op.alias) for attr in attrs):
+        return False
+      return SortMergeJoin.sorted_on(op.c, [Attr(attr.aname) for attr in attrs])
+    if op.is_type(Project):
+      # follow attributes that are projected under a new name
+      exprs = []
+      for attr in attrs:
+        found = [e for e, alias in zip(op.exprs, op.aliases) if alias == attr.aname]
+        if len(found) != 1 or not found[0].is_type(Attr):
+          return False
+        exprs.append(found[0])
+      return SortMergeJoin.sorted_on(op.c, exprs)
+    if op.is_type(SortMergeJoin):
+      return any(map(matches, op.join_attrs))
+    if op.is_type(OrderBy):
+      n = len(attrs)
+      keys = op.order_exprs[:n]
+      return (all(e.is_type(Attr) for e in keys) and
+          all(ad == "asc" for ad in op.ascdescs[:n]) and matches(keys))
+    if op.is_type(IndexScan):
+      index = Database.db().index(op.index)
+      return (index is not None and
+          index.anames[:len(attrs)] == [attr.aname for attr in attrs] and
+          all(attr.tablename in (None, op.alias) for attr in attrs))
+    return False
+
+  @staticmethod
+  def sort_buffer(nattrs):
+    """
+    @return ExternalSort of (key, row) pairs of rows with @nattrs attributes,
+            limited to the database's sort_memory_budget if it is set
+    """
+    db = Database.db()
+    budget = db.sort_memory_budget
+    if budget is None:
+      budget = float("inf")
+    return ExternalSort(itemgetter(0), budget, HashTableCache.row_bytes(nattrs),
+        db.spill_stats, db.spill_dir)
+
+  def sorted_rows(self, child, attrs):
+    """
+    @return iterator of (key, row list) pairs of @child's rows whose keys
+            aren't NULL, in key order
+    """
+    keyf = self.key_func(attrs)
+    is_null_key = self.is_null_key
+    if self.sorted_on(child, attrs):
+      return ((key, list(row.row)) for row in child
+          for key in [keyf(row)] if not is_null_key(key))
+
+    rows = self.sort_buffer(len(child.schema.attrs))
+    for row in child:
+      key = keyf(row)
+      if not is_null_key(key):
+        rows.add((key, list(row.row)))
+    return iter(rows)
+
+  @staticmethod
+  def merge_groups(lrows, rrows):
+    """
+    @lrows, rrows iterators of (key, row) pairs in key order
+    @return iterator of (left rows, right rows) lists of each key that
+            both sides contain, in key order
+    """
+    lrows, rrows = iter(lrows), iter(rrows)
+    l, r = next(lrows, None), next(rrows, None)
+    while l is not None and r is not None:
+      if l[0] < r[0]:
+        l = next(lrows, None)
+      elif r[0] < l[0]:
+        r = next(rrows, None)
+      else:
+        key, lgroup, rgroup = l[0], [], []
+        while l is not None and l[0] == key:
+          lgroup.append(l[1])
+          l = next(lrows, None)
+        while r is not None and r[0] == key:
+          rgroup.append(r[1])
+          r = next(rrows, None)
+        yield lgroup, rgroup
+
+  def __iter__(self):
+    """
+    Sort both inputs, and merge them.  Yields each join result
+    """
+    irow = ListTuple(self.schema)
+    lattrs, rattrs = self.join_attrs
+    nlattrs = len(self.l.schema.attrs)
+    lrows = self.sorted_rows(self.l, lattrs)
+    rrows = self.sorted_rows(self.r, rattrs)
+
+    for lgroup, rgroup in self.merge_groups(lrows, rrows):
+      for rrow in rgroup:
+        irow.row[nlattrs:] = rrow
+        for lrow in lgroup:
+          irow.row[:nlattrs] = lrow
+          yield irow
+
+  def __str__(self):
+    conds = ["%s = %s" % (lattr, rattr) for lattr, rattr in zip(*self.join_attrs)]
+    return "SORTMERGEJOIN(ON %s)" % " AND ".join(conds)
@@ -4,6 +4,7 @@ from ..db import Database
 from ..schema import *
 from ..tuples import *
 from ..util import cache, OBTuple
+from ..batch import as_column
 from itertools import chain
 
 class Filter(UnaryOp):
@@ -20,4 +21,11 @@ class Filter(UnaryOp):
       if self.cond(row):
         yield row
 
+  def iter_batches(self):
+    for batch in self.c.iter_batches():
+      mask = as_column(self.cond.eval_batch(batch), batch.n).astype(bool)
+      batch = batch.select(mask)
+      if len(batch):
+        yield batch
+
 
@@ -1,7 +1,11 @@
 from ..ops import *
 from ..db import Database
+from ..hashcache import HashTableCache
 from ..util import *
 from itertools import *
+import math
+import numbers
+from ..zonemap import FLIPPED_OPS
 from collections import *
 
 
@@ -16,6 +20,15 @@ class Estimator(object):
     self.cards = dict()
     self.DEFAULT_SELECTIVITY = 0.05
 
+    # cost of fetching a row through an index, relative to reading 
+    # the next row in a scan
+    self.RANDOM_ACCESS_COST = 4.0
+
+    # cost of a comparison while sorting, and of writing a row to a
+    # temporary file and reading it back
+    self.SORT_COST = 0.05
+    self.SPILL_COST = 1.0
+
   def cost(self, op):
     """
     Recursively estimate cost of query plan
@@ -23,19 +36,78 @@ class Estimator(object):
     if op in self.costs:
       return self.costs[op]
 
-    if op.is_type(Scan):
+    if op.is_type(IndexScan):
+      index = self.db.index(op.index)
+      cost = math.log(self.db[op.tablename].stats.card + 1, 2)
+      cost += index.count(op.index_preds) * self.RANDOM_ACCESS_COST
+    elif op.is_type(Scan):
       cost = self.db[op.tablename].stats.card
+      if op.partitions is not None:
+        cost = self.db[op.tablename].partition_card(op.partitions)
     elif op.is_type(HashJoin):
       cost = self.cost(op.l) + self.cost(op.r)
       cost += 0.05 * self.card(op)
+      # a grace hash join writes and reads both inputs once
+      if self.exceeds_budget(op.l, self.db.join_memory_budget):
+        cost += self.SPILL_COST * (self.card(op.l) + self.card(op.r))
+    elif op.is_type(SortMergeJoin):
+      cost = self.cost(op.l) + self.cost(op.r)
+      cost += self.sort_cost(op.l, op.join_attrs[0])
+      cost += self.sort_cost(op.r, op.join_attrs[1])
+      cost += 0.05 * self.card(op)
+    elif op.is_type(IndexNestedLoopJoin):
+      # each left row looks up and fetches its matches in the right table
+      ncard = self.db[op.r.tablename].stats.card
+      matches = ncard
+      for lattr, rattr in zip(*op.join_attrs):
+        matches *= self.selectivity_equijoin(lattr, rattr, op)
+      probe = math.log(ncard + 1, 2) + matches * self.RANDOM_ACCESS_COST
+      cost = self.cost(op.l) + self.card(op.l) * probe
+      cost += 0.05 * self.card(op)
     elif op.is_type(ThetaJoin):
       cost = self.cost(op.l) + self.card(op.l) * self.cost(op.r)
       cost += 0.05 * self.card(op)
     else:
       cost = sum(map(self.cost, op.children()))
 
-    self.costs[join] = cost
+    self.costs[op] = cost
     return cost
+
+  def sort_cost(self, op, attrs):
+    """
+    @return cost of sorting @op's output on @attrs for a sort-merge join
+    """
+    if SortMergeJoin.sorted_on(op, attrs):
+      return 0
+    card = self.card(op)
+    cost = self.SORT_COST * card * math.log(card + 1, 2)
+    if self.exceeds_budget(op, self.db.sort_memory_budget):
+      cost += self.SPILL_COST * card
+    return cost
+
+  def exceeds_budget(self, op, budget):
+    """
+    @return whether the estimated bytes of @op's output exceed @budget
+    """
+    if budget is None:
+      return False
+    nbytes = self.card(op) * HashTableCache.row_bytes(self.nattrs(op))
+    return nbytes > budget
+
+  def nattrs(self, op):
+    """
+    @return number of attributes in @op's output.  Candidate join plans
+            haven't initialized their schemas yet
+    """
+    if op.is_type(Join):
+      return self.nattrs(op.l) + self.nattrs(op.r)
+    if getattr(op, "schema", None) is not None:
+      return len(op.schema.attrs)
+    if op.is_type(Scan):
+      return len(self.db[op.tablename].schema.attrs)
+    if op.children():
+      return self.nattrs(op.children()[0])
+    return 1
     
 
   def card(self, op):
@@ -44,6 +116,7 @@ class Estimator(object):
 
     if op.is_type(Scan):
       card = self.db[op.tablename].stats.card
+      card *= self.selectivity_preds(op)
     elif op.is_type(Join):
       card = self.card(op.l) * self.card(op.r)
       card *= self.selectivity(op)
@@ -62,19 +135,35 @@ class Estimator(object):
     """
     if op.is_type(Scan):
       return 1.0
-    if op.is_type(HashJoin):
-      lsel = self.selectivity_cond(op.join_attrs[0])
-      rsel = self.selectivity_cond(op.join_attrs[1])
-      return min([lsel, rsel, 1.0])
+    if op.is_type([HashJoin, SortMergeJoin, IndexNestedLoopJoin]):
+      # components of a composite key are assumed to be independent
+      sel = 1.0
+      for lattr, rattr in zip(*op.join_attrs):
+        sel *= self.selectivity_equijoin(lattr, rattr, op)
+      return sel
     if op.is_type(ThetaJoin):
-      return self.selectivity_cond(op.cond)
+      return self.selectivity_cond(op.cond, op)
     if op.is_type(Filter):
-      return self.selectivity_cond(op.cond)
+      return self.selectivity_cond(op.cond, op)
     return self.DEFAULT_SELECTIVITY
 
-  def selectivity_cond(self, cond):
+  def selectivity_equijoin(self, lattr, rattr, scope):
+    ldist = self.distribution(lattr, scope)
+    rdist = self.distribution(rattr, scope)
+    if ldist and rdist:
+      return ldist.selectivity_join(rdist)
+    lsel = self.selectivity_cond(lattr, scope)
+    rsel = self.selectivity_cond(rattr, scope)
+    return min([lsel, rsel, 1.0])
+
+  def selectivity_cond(self, cond, scope=None):
     """
-    Estimate the selectivity of a predicate condition
+    Estimate the selectivity of a predicate condition.  Comparisons 
+    between a base table attribute and literals use the attribute's 
+    most common values and histogram (see ColStats).
+
+    @scope operator whose input the condition is evaluated over.  Used to
+           find the base tables of the attributes in @cond
     """
     if cond.is_type(Bool):
       return cond(None) * 1.0
@@ -82,19 +171,126 @@ class Estimator(object):
     if cond.is_type(Attr):
       return self.selectivity_attr(cond)
 
+    if cond.is_type(Paren):
+      return self.selectivity_cond(cond.c, scope)
+
+    if cond.is_type(Between):
+      dist = self.distribution(cond.expr, scope)
+      if dist and self.is_value(cond.lower) and self.is_value(cond.upper):
+        return dist.selectivity_between(cond.lower.v, cond.upper.v)
+      return self.DEFAULT_SELECTIVITY
+
+    if not cond.is_type(Expr):
+      return self.DEFAULT_SELECTIVITY
+
     if cond.op == "and":
-      lsel = self.selectivity_cond(cond.l)
-      rsel = self.selectivity_cond(cond.r)
+      lsel = self.selectivity_cond(cond.l, scope)
+      rsel = self.selectivity_cond(cond.r, scope)
       return lsel * rsel
 
-    if cond.op == "=":
-      if cond.r.is_type(Literal):
-        return self.selectivity_cond(cond.l)
-      elif cond.l.is_type(Literal):
-        return self.selectivity_cond(cond.r)
+    if cond.op == "or":
+      lsel = self.selectivity_cond(cond.l, scope)
+      rsel = self.selectivity_cond(cond.r, scope)
+      return lsel + rsel - lsel * rsel
+
+    if cond.op == "in":
+      dist = self.distribution(cond.l, scope)
+      if dist and cond.r.is_type(List):
+        return dist.selectivity_in([unquote(e.v) for e in cond.r.v 
+          if e.is_type(Literal)])
+      return self.DEFAULT_SELECTIVITY
+
+    if cond.op in ("=", "<>", "!=", "<", "<=", ">", ">="):
+      attr, lit, op = cond.l, cond.r, cond.op
+      if lit.is_type(Attr) and not attr.is_type(Attr):
+        attr, lit, op = lit, attr, FLIPPED_OPS.get(op, op)
+
+      if attr.is_type(Attr) and lit.is_type(Attr) and op == "=":
+        ldist, rdist = self.distribution(attr, scope), self.distribution(lit, scope)
+        if ldist and rdist:
+          return ldist.selectivity_join(rdist)
+
+      dist = self.distribution(attr, scope)
+      if dist and self.is_value(lit):
+        v = unquote(lit.v)
+        if op == "=":
+          return dist.selectivity_eq(v)
+        if op in ("<>", "!="):
+          return max(0.0, 1.0 - dist.frac_null - dist.selectivity_eq(v))
+        if isinstance(v, numbers.Number):
+          return dist.selectivity_range(op, v)
+
+      if op == "=" and lit.is_type(Literal):
+        return self.selectivity_cond(attr, scope)
 
     return self.DEFAULT_SELECTIVITY
 
+  def selectivity_preds(self, scan):
+    """
+    @return selectivity of the predicates pushed down into @scan
+    """
+    sel = 1.0
+    if not scan.preds:
+      return sel
+    table = self.db[scan.tablename]
+    for idx in set(p[0] for p in scan.preds):
+      dist = table.stats.distribution(table.schema.attrs[idx])
+      preds = [(op, v) for i, op, v in scan.preds if i == idx]
+      eqs = [v for op, v in preds if op == "="]
+      lows = [v for op, v in preds if op in (">", ">=")]
+      highs = [v for op, v in preds if op in ("<", "<=")]
+
+      # range predicates on the same attribute are estimated together
+      if eqs:
+        sel *= dist.selectivity_eq(eqs[0])
+      elif lows and highs:
+        sel *= dist.selectivity_between(max(lows), min(highs))
+      elif lows:
+        sel *= dist.selectivity_range(">=", max(lows))
+      else:
+        sel *= dist.selectivity_range("<=", min(highs))
+    return sel
+
+  @staticmethod
+  def is_value(e):
+    return e.is_type(Literal) and not e.is_type(List)
+
+  def distribution(self, attr, scope=None):
+    """
+    @attr  attribute referenced in an expression
+    @scope operator whose input @attr is evaluated over.  @attr's
+           tablename is an alias that is only resolved within a scope
+    @return ColStats of the base table column that @attr references, 
+            or None if it isn't known
+    """
+    if not attr.is_type(Attr) or attr.raw or scope is None:
+      return None
+
+    tablename = self.scan_tablename(attr, scope)
+    table = self.db[tablename] if tablename else None
+    if table is None or not hasattr(table, "attr_to_idx"):
+      return None
+    if attr.aname not in table.attr_to_idx:
+      return None
+    return table.stats.distribution(attr)
+
+  def scan_tablename(self, attr, scope):
+    """
+    @return name of the table that @attr references among the tables 
+            scanned in the @scope subplan, or None if it is ambiguous
+    """
+    def references(scan):
+      if attr.tablename:
+        return scan.alias == attr.tablename
+      table = self.db[scan.tablename]
+      return table is not None and attr.aname in table.attr_to_idx
+
+    until = lambda n: n.is_type(SubQuerySource)
+    scans = [s for s in scope.collect(Scan, until) if references(s)]
+    if len(scans) != 1:
+      return None
+    return scans[0].tablename
+
 
   def selectivity_attr(self, attr):
     """
@@ -128,30 +128,102 @@ class JoinOpt(object):
     cond = cnf_to_predicate(preds)
     ret.extend([ThetaJoin(l, r, cond), ThetaJoin(r, l, cond)])
 
-    # # hash joins only uses one predicate, so the rest need to be
-    # # applied as post-join filters
-    for i, pred in enumerate(preds):
-      if not (hasattr(pred, "op") and pred.op == "="): continue
-      if not (pred.l.is_type(Attr) and pred.r.is_type(Attr)): continue
-      if pred.l.tablename in lji.aliases and pred.r.tablename in rji.aliases:
-        p1 = HashJoin(l, r, [pred.l, pred.r])
-        p2 = HashJoin(r, l, [pred.r, pred.l])
-      elif pred.l.tablename in rji.aliases and pred.r.tablename in lji.aliases:
-        p1 = HashJoin(l, r, [pred.r, pred.l])
-        p2 = HashJoin(r, l, [pred.l, pred.r])
+    # hash joins fold every equality predicate between the two sides into
+    # a composite key, and apply the rest as a post-join filter
+    lattrs, rattrs, eqs, rest = [], [], [], []
+    for pred in preds:
+      lattr, rattr = self.equijoin_attrs(pred, lji, rji)
+      if lattr is None:
+        rest.append(pred)
       else:
-        continue
-
-      cond = cnf_to_predicate(preds[:i] + preds[i+1:])
-      if cond:
-        p1 = Filter(p1, cond)
-        p2 = Filter(p2, cond)
-      ret.extend([p1, p2])
+        lattrs.append(lattr)
+        rattrs.append(rattr)
+        eqs.append(pred)
+
+    if lattrs:
+      # the hash table is built over the left input, so put the smaller
+      # side there
+      if self.estimator.card(r) < self.estimator.card(l):
+        plan = HashJoin(r, l, [rattrs, lattrs])
+      else:
+        plan = HashJoin(l, r, [lattrs, rattrs])
+      if rest:
+        plan = Filter(plan, cnf_to_predicate(rest))
+      ret.append(plan)
+
+      # sort-merge joins are only worth costing if an input is already 
+      # sorted on its key, or if neither input fits in the join memory
+      if self.consider_sort_merge(l, r, lattrs, rattrs):
+        plan = SortMergeJoin(l, r, [lattrs, rattrs])
+        if rest:
+          plan = Filter(plan, cnf_to_predicate(rest))
+        ret.append(plan)
+
+      # index joins are only possible if either side scans a base table 
+      # with an index on its join attributes
+      for outer, inner, oattrs, iattrs in [
+          (l, r, lattrs, rattrs), (r, l, rattrs, lattrs)]:
+        plan = self.index_join(outer, inner, oattrs, iattrs, eqs, rest)
+        if plan is not None:
+          ret.append(plan)
 
     # reset parent pointers
     l.p, r.p = lp, rp
     return ret
 
+  def consider_sort_merge(self, l, r, lattrs, rattrs):
+    """
+    Without a sort_memory_budget, a sort-merge join would sort inputs that
+    exceed the join memory budget in memory, so it isn't an alternative
+    """
+    if SortMergeJoin.sorted_on(l, lattrs) or SortMergeJoin.sorted_on(r, rattrs):
+      return True
+    budget = self.db.join_memory_budget
+    return (self.db.sort_memory_budget is not None and 
+        self.estimator.exceeds_budget(l, budget) and 
+        self.estimator.exceeds_budget(r, budget))
+
+  def index_join(self, outer, inner, oattrs, iattrs, eqs, rest):
+    """
+    @eqs  the equality predicates that @oattrs and @iattrs come from
+    @rest the other join predicates
+    @return IndexNestedLoopJoin that probes the index over @inner's table 
+            that covers the most join attributes, or None.  Predicates
+            that the index doesn't probe are applied as a post-join filter
+    """
+    if not inner.is_type(Scan) or inner.is_type(IndexScan):
+      return None
+    best, best_keys = None, []
+    for index in self.db.table_indexes(inner.tablename):
+      keys = IndexNestedLoopJoin.probe_attrs(index, iattrs)
+      if len(keys) > len(best_keys):
+        best, best_keys = index, keys
+    if best is None:
+      return None
+
+    join_attrs = [[oattrs[i] for i in best_keys], [iattrs[i] for i in best_keys]]
+    plan = IndexNestedLoopJoin(outer, inner, join_attrs, best.name)
+    others = rest + [pred for i, pred in enumerate(eqs) if i not in best_keys]
+    if others:
+      plan = Filter(plan, cnf_to_predicate(others))
+    return plan
+
+  @staticmethod
+  def equijoin_attrs(pred, lji, rji):
+    """
+    @return (left attr, right attr) if @pred is an equality between an
+            attribute of @lji and an attribute of @rji, else (None, None)
+    """
+    if not (hasattr(pred, "op") and pred.op == "="): 
+      return None, None
+    if not (pred.l.is_type(Attr) and pred.r.is_type(Attr)): 
+      return None, None
+    if pred.l.tablename in lji.aliases and pred.r.tablename in rji.aliases:
+      return pred.l, pred.r
+    if pred.l.tablename in rji.aliases and pred.r.tablename in lji.aliases:
+      return pred.r, pred.l
+    return None, None
+
   def build_predicate_index(self, preds):
     """
     @preds list of join predicates to index
@@ -2,6 +2,8 @@ from ..ops import *
 from ..parseops import *
 from ..db import Database
 from ..util import *
+from ..zonemap import OPS, FLIPPED_OPS
+from ..tables import PartitionedTable
 from .joinopt import *
 from .selinger import *
 from itertools import *
@@ -34,10 +36,17 @@ class Optimizer(object):
     while op.collectone("From"):
       op = self.expand_from_clause(op)
 
+    op = self.fuse_top_n(op)
+
     # Join may have added new nodes, need to update
     # operator schemas and Attr index references
     op = self.initialize_and_resolve(op)
     self.verify_attr_refs(op)
+    op = self.push_down_predicates(op)
+    self.prune_partitions(op)
+    op = self.revisit_index_joins(op)
+    op = self.choose_access_paths(op)
+    self.use_dictionary_codes(op)
     return op
 
   def collect_from_clauses(self, op, froms=None):
@@ -70,7 +79,7 @@ class Optimizer(object):
       # ThetaJoin internally concats the left and right tuples into an
       # intermediate tuple.  Its schema is also op.schema
       self.resolve_attr_idxs(op.schema, op.cond)
-    elif op.is_type(HashJoin):
+    elif op.is_type([HashJoin, SortMergeJoin, IndexNestedLoopJoin]):
       self.resolve_attr_idxs(op.l.schema, op.join_attrs[0])
       self.resolve_attr_idxs(op.r.schema, op.join_attrs[1])
     elif op.is_type(OrderBy):
@@ -112,6 +121,206 @@ class Optimizer(object):
     else:
       for a in exprs.referenced_attrs:
         a.idx = self.find_idx(schema, a)
+        a.dictionary = schema.attrs[a.idx].dictionary
+
+  def fuse_top_n(self, root):
+    """
+    Rewrite each Limit whose child is an OrderBy into a TopN, which keeps
+    a bounded heap of offset+limit rows instead of sorting its whole input
+    """
+    for limit in root.collect(Limit):
+      orderby = limit.c
+      if not orderby.is_type(OrderBy) or orderby.is_type(TopN):
+        continue
+      topn = TopN(orderby.c, orderby.order_exprs, orderby.ascdescs, 
+          limit._limit, limit._offset)
+      if limit == root:
+        root = topn
+        root.p = None
+      else:
+        limit.replace(topn)
+    return root
+
+  def push_down_predicates(self, root):
+    """
+    Move each Filter that compares a numeric attribute of a base table with
+    a literal into that table's Scan (see Scan.preds), so the table can
+    skip the blocks that its zone maps rule out.
+    """
+    for f in root.collect(Filter):
+      preds = self.scan_predicates(f.cond)
+      if not preds:
+        continue
+
+      attr = preds[0][0]
+      until = lambda n: n.is_type(SubQuerySource)
+      scans = [s for s in f.collect(Scan, until) if s.alias == attr.tablename]
+      if len(scans) != 1:
+        continue
+      scan = scans[0]
+      idx = self.find_idx(scan.schema, attr)
+      if scan.schema.attrs[idx].typ != "num":
+        continue
+
+      scan.preds.extend((idx, op, v) for _, op, v in preds)
+      if f == root:
+        root = f.c
+        root.p = None
+      else:
+        f.remove()
+    return root
+
+  def prune_partitions(self, root):
+    """
+    Restrict scans of PartitionedTables to the partitions that 
+    their pushed-down predicates don't rule out
+    """
+    for scan in root.collect(Scan):
+      table = self.db[scan.tablename]
+      if isinstance(table, PartitionedTable) and scan.preds:
+        scan.partitions = table.prune(scan.preds)
+
+  def choose_access_paths(self, root):
+    """
+    Replace each Scan with pushed-down predicates with an IndexScan over
+    one of the table's indexes, if the Estimator expects it to be cheaper.
+    The inner tables of index joins are already accessed through an index
+    """
+    estimator = Estimator(self.db)
+    for scan in root.collect(Scan):
+      if scan.is_type(IndexScan) or not scan.preds:
+        continue
+      if scan.p and scan.p.is_type(IndexNestedLoopJoin) and scan.p.r == scan:
+        continue
+
+      best, best_cost = self.best_access_path(scan, estimator)
+      if best is not scan:
+        if scan == root:
+          root = best
+        else:
+          scan.replace(best)
+    return root
+
+  def best_access_path(self, scan, estimator):
+    """
+    @return (@scan or an IndexScan that replaces it, its estimated cost)
+    """
+    best, best_cost = scan, estimator.cost(scan)
+    for index in self.db.table_indexes(scan.tablename):
+      served = index.served_preds(scan.preds)
+      if not served:
+        continue
+      residual = [p for p in scan.preds if p not in served]
+      iscan = IndexScan(scan.tablename, scan.alias, index.name, served, residual)
+      cost = estimator.cost(iscan)
+      if cost < best_cost:
+        best, best_cost = iscan, cost
+    if best is not scan:
+      best.init_schema()
+    return best, best_cost
+
+  def revisit_index_joins(self, root):
+    """
+    Joins are ordered before predicates are pushed down into the scans.
+    Replace each index join whose inner table has pushed-down predicates
+    with a hash join over the table's best access path, if the predicates
+    make that cheaper.  The hash table is built over the left input, which
+    is usually the smaller one, since it was the outer side.
+    """
+    estimator = Estimator(self.db)
+    for op in root.collect(IndexNestedLoopJoin):
+      if not op.r.preds:
+        continue
+      scan = op.r
+      inner, _ = self.best_access_path(scan, estimator)
+      hj = HashJoin(op.l, inner, op.join_attrs)
+      hj.init_schema()
+      if estimator.cost(hj) < estimator.cost(op):
+        if op == root:
+          root = hj
+        else:
+          op.replace(hj)
+      else:
+        # constructing the HashJoin reassigned the children's parents
+        op.l.p, scan.p = op, op
+    return root
+
+  def scan_predicates(self, cond):
+    """
+    @return list of (Attr, op, value) that is equivalent to @cond, or None 
+            if @cond isn't a comparison or BETWEEN of an attr and literals
+    """
+    is_lit = lambda e: (e.is_type(Literal) and not e.is_type(List) and
+        isinstance(e.v, numbers.Number))
+
+    if cond.is_type(Paren):
+      return self.scan_predicates(cond.c)
+
+    if cond.is_type(Between):
+      if (cond.expr.is_type(Attr) and 
+          is_lit(cond.lower) and is_lit(cond.upper)):
+        return [(cond.expr, ">=", cond.lower.v), (cond.expr, "<=", cond.upper.v)]
+      return None
+
+    if not (cond.is_type(Expr) and cond.op in OPS and cond.r):
+      return None
+    if cond.l.is_type(Attr) and is_lit(cond.r):
+      return [(cond.l, cond.op, cond.r.v)]
+    if cond.r.is_type(Attr) and is_lit(cond.l):
+      return [(cond.r, FLIPPED_OPS[cond.op], cond.l.v)]
+    return None
+
+  def use_dictionary_codes(self, root):
+    """
+    Let expressions over dictionary-encoded attributes compare codes
+    instead of decoding every value:
+
+    * equality filters between an attribute and a literal compare the
+      attribute's code with the literal's code
+    * hash and sort-merge join key attributes that share a dictionary 
+      hash or sort the codes
+    * GROUP BY attributes hash the codes, and are decoded when the group's
+      output tuple is computed
+    """
+    for op in root.collect(Filter):
+      op.cond = self.encode_equality(op.cond)
+
+    for op in root.collect([HashJoin, SortMergeJoin]):
+      lattrs, rattrs = [], []
+      for lattr, rattr in zip(*op.join_attrs):
+        if lattr.dictionary and lattr.dictionary.same(rattr.dictionary):
+          lattr, rattr = self.raw_attr(lattr), self.raw_attr(rattr)
+        lattrs.append(lattr)
+        rattrs.append(rattr)
+      op.join_attrs = [lattrs, rattrs]
+
+    for op in root.collect(GroupBy):
+      op.group_exprs = [
+          self.raw_attr(e) if e.is_type(Attr) and e.dictionary else e
+          for e in op.group_exprs]
+      for a in op.group_attrs:
+        a.raw = a.dictionary is not None
+
+  def encode_equality(self, cond):
+    """
+    @return cond rewritten to compare codes if it is of the form
+            attr = literal or attr <> literal
+    """
+    if not (cond.is_type(Expr) and cond.op in ("=", "<>")):
+      return cond
+    attr, lit = cond.l, cond.r
+    if lit.is_type(Attr):
+      attr, lit = lit, attr
+    if not (attr.is_type(Attr) and attr.dictionary and lit.is_type(Literal)):
+      return cond
+
+    code = attr.dictionary.code(unquote(lit.v))
+    return Expr(cond.op, self.raw_attr(attr), Literal(code))
+
+  def raw_attr(self, attr):
+    attr = attr.copy()
+    attr.raw = True
+    return attr
 
   def verify_attr_refs(self, root):
     """Verify that all attributes are bound"""
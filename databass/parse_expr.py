@@ -108,6 +108,8 @@ class Visitor(NodeVisitor):
     if not f:
       raise Exception("Function %s not found" % fname)
     if f.is_agg: 
+      if f.is_incremental:
+        return IncAggFunc(f, arglist)
       return AggFunc(f, arglist)
     return ScalarFunc(f, arglist)
 
@@ -1,3 +1,4 @@
+import re
 import time
 import traceback
 import readline
@@ -18,6 +19,9 @@ PARSE [query or expression str]   parse and print AST for expression or query
 TRACE                             print stack trace of last error
 SHOW TABLES                       print list of database tables
 SHOW <tablename>                  print schema for <tablename>
+CREATE INDEX <name> ON <tablename>(<attr>, ...)
+                                  build a sorted index over the attributes
+ANALYZE <tablename>               compute and save the table's statistics
 """
 
 def write_code(compiled_q, fname="./_code.py"):
@@ -101,6 +105,29 @@ if __name__ == "__main__":
       else:
           print("%s not in database" % tname)
 
+    elif cmd.upper().startswith("CREATE INDEX "):
+      m = re.match(r"CREATE INDEX\s+(\w+)\s+ON\s+([\w-]+)\s*\((.+)\)\s*;?$", 
+          cmd, re.IGNORECASE)
+      if m:
+        name, tname, anames = m.groups()
+        try:
+          index = _db.create_index(tname, [a.strip() for a in anames.split(",")], name)
+          print("Created index %s" % index)
+        except Exception as err:
+          print("ERROR:", err)
+      else:
+        print("ERROR: expected CREATE INDEX <name> ON <tablename>(<attr>, ...)")
+
+    elif cmd.upper().startswith("ANALYZE "):
+      tname = cmd[len("ANALYZE "):].strip().rstrip(";").strip()
+      try:
+        stats = _db.analyze(tname)
+        print("Analyzed %s: %d rows" % (tname, stats.card))
+        for attr in _db[tname].schema:
+          print(attr.aname, "\t", stats[attr])
+      except Exception as err:
+        print("ERROR:", err)
+
     elif cmd.upper().startswith("COMPILE "):
       cmd = cmd[len("COMPILE "):].strip()
       b_run = False
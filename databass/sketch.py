@@ -0,0 +1,89 @@
+"""
+Sketches used to maintain statistics incrementally
+"""
+import numpy as np
+import pandas
+
+
+def bit_length(arr):
+  """
+  @arr numpy array of uint64
+  @return number of bits needed to represent each value
+  """
+  arr = arr.copy()
+  n = np.zeros(len(arr), dtype=np.int64)
+  for shift in (32, 16, 8, 4, 2, 1):
+    big = arr >= np.uint64(1 << shift)
+    n[big] += shift
+    arr[big] >>= np.uint64(shift)
+  return n + (arr > 0)
+
+
+class HyperLogLog(object):
+  """
+  HyperLogLog sketch of the number of distinct values in a column.
+  Sketches of disjoint parts of a column (e.g., appended batches or
+  partitions) can be merged.
+
+  Values are hashed with pandas' stable 64-bit hash, so sketches built in
+  different processes agree.
+  """
+  def __init__(self, p=12):
+    """
+    @p the sketch has 2^p registers, and a standard error of ~1.04/sqrt(2^p)
+    """
+    self.p = p
+    self.m = 1 << p
+    self.registers = np.zeros(self.m, dtype=np.uint8)
+
+  @staticmethod
+  def hash_values(values):
+    arr = np.asarray(values)
+    if arr.dtype.kind not in "biuf":
+      arr = arr.astype(object)
+      # NaN and None are both nulls
+      arr = arr[~pandas.isnull(arr)]
+    else:
+      arr = arr[~np.isnan(arr)] if arr.dtype.kind == "f" else arr
+      # hash integral floats the same as ints, as the engine compares them
+      arr = arr.astype(np.float64)
+    return pandas.util.hash_array(arr, categorize=False)
+
+  def add(self, values):
+    """
+    @values list or numpy array of column values.  Nulls are ignored
+    """
+    hashes = self.hash_values(values)
+    if not len(hashes):
+      return
+    nbits = 64 - self.p
+    idxs = (hashes >> np.uint64(nbits)).astype(np.int64)
+    rest = hashes & np.uint64((1 << nbits) - 1)
+
+    # rank is the position of the leftmost 1 bit in the remaining bits
+    ranks = (nbits + 1 - bit_length(rest)).astype(np.uint8)
+    np.maximum.at(self.registers, idxs, ranks)
+
+  def merge(self, other):
+    """
+    Update this sketch to also count the values added to @other
+    """
+    if other.p != self.p:
+      raise Exception("Cannot merge HyperLogLogs with different precisions")
+    np.maximum(self.registers, other.registers, out=self.registers)
+    return self
+
+  def copy(self):
+    hll = HyperLogLog(self.p)
+    hll.registers = self.registers.copy()
+    return hll
+
+  def estimate(self):
+    m = float(self.m)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    est = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(float)))
+    zeros = int(np.sum(self.registers == 0))
+    if est <= 2.5 * m and zeros:
+      # linear counting is more accurate for small cardinalities
+      est = m * np.log(m / zeros)
+    return int(round(est))
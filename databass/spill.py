@@ -0,0 +1,309 @@
+"""
+Operator state that is limited to a memory budget, and spills to 
+temporary files.
+
+SpillingHashTable holds the build side of a hash join.  Once it outgrows
+the budget, partitions of it are spilled to temporary files, and the probe
+rows that hash to spilled partitions are spilled alongside them.  The 
+spilled partitions are then joined pairwise, recursively partitioning
+those that still don't fit (grace hash join).
+See Database.join_memory_budget
+
+ExternalSort sorts the rows of ORDER BY in runs that fit in the budget,
+and lazily merges the spilled runs.  See Database.sort_memory_budget
+"""
+import heapq
+import pickle
+import tempfile
+
+
+class SpillStats(object):
+  """
+  Counters of the data that hash joins and sorts spilled, to help tune 
+  budgets.
+  See Database.spill_stats
+  """
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self.bytes_written = 0
+    self.files = 0
+    self.partitions = 0
+    self.runs = 0
+
+  def __str__(self):
+    return "spilled %d bytes to %d files (%d partitions, %d runs)" % (
+        self.bytes_written, self.files, self.partitions, self.runs)
+
+
+class SpillFile(object):
+  """
+  Append-only temporary file of items, e.g., rows or (key, row) pairs,
+  written in pickled chunks
+  """
+  CHUNKSIZE = 1024
+
+  def __init__(self, stats, dirname=None):
+    self.stats = stats
+    self.f = tempfile.TemporaryFile(dir=dirname)
+    self.buf = []
+    self.nrows = 0
+    stats.files += 1
+
+  def append(self, item):
+    self.buf.append(item)
+    self.nrows += 1
+    if len(self.buf) >= self.CHUNKSIZE:
+      self.flush()
+
+  def flush(self):
+    if self.buf:
+      data = pickle.dumps(self.buf, pickle.HIGHEST_PROTOCOL)
+      self.f.write(data)
+      self.stats.bytes_written += len(data)
+      self.buf = []
+
+  def __iter__(self):
+    self.flush()
+    self.f.seek(0)
+    while True:
+      try:
+        chunk = pickle.load(self.f)
+      except EOFError:
+        break
+      for item in chunk:
+        yield item
+
+  def close(self):
+    self.f.close()
+
+
+def is_null_key(key):
+  """
+  NULL keys don't match anything, including other NULLs.  A key is NULL
+  if it, or any value of a composite (tuple) key, is None or NaN
+  """
+  if type(key) is tuple:
+    return any(v is None or v != v for v in key)
+  return key is None or key != key
+
+
+class SpillingHashTable(object):
+  """
+  Hash table of the build side of a join that holds at most @budget bytes
+  of rows in memory.  The keys are hash partitioned; when the resident
+  partitions outgrow the budget, the largest one is spilled to a file.
+
+  Usage:
+
+    ht = SpillingHashTable(budget, row_bytes, stats)
+    for each build row:  ht.add(key, row)
+    for each probe row:  for lrow in ht.probe(key, row): ...
+    for lrow, rrow in ht.spilled_pairs(): ...
+
+  probe() only returns matches from resident partitions, and spills the
+  probe rows of spilled partitions, which spilled_pairs() then joins.
+  """
+  NPARTITIONS = 16
+
+  # partitions that are still too large at this depth are joined in memory,
+  # e.g., if most rows have the same key
+  MAX_DEPTH = 4
+
+  def __init__(self, budget, row_bytes, stats, dirname=None, depth=0):
+    """
+    @budget    bytes of build rows to hold in memory
+    @row_bytes estimated bytes per build row
+    @stats     SpillStats to add to
+    @dirname   directory for the temporary files.  Defaults to the system's
+    @depth     recursion depth of the grace hash join
+    """
+    self.budget = budget
+    self.row_bytes = row_bytes
+    self.stats = stats
+    self.dirname = dirname
+    self.depth = depth
+    self.parts = [dict() for _ in range(self.NPARTITIONS)]
+    self.part_bytes = [0] * self.NPARTITIONS
+    self.lfiles = [None] * self.NPARTITIONS
+    self.rfiles = [None] * self.NPARTITIONS
+    self.nbytes = 0
+
+  def partition(self, key):
+    # salt the hash with the depth, so that recursive partitioning splits
+    # the keys of a spilled partition differently
+    return hash((self.depth, key)) % self.NPARTITIONS
+
+  def add(self, key, row):
+    """
+    Add a build @row, which must not be modified afterwards
+    """
+    if is_null_key(key):
+      return
+    pid = self.partition(key)
+    if self.lfiles[pid] is not None:
+      self.lfiles[pid].append((key, row))
+      return
+
+    part = self.parts[pid]
+    if key in part:
+      part[key].append(row)
+    else:
+      part[key] = [row]
+    self.part_bytes[pid] += self.row_bytes
+    self.nbytes += self.row_bytes
+    if self.nbytes > self.budget and self.depth < self.MAX_DEPTH:
+      self.spill_largest()
+
+  def spill_largest(self):
+    # spilled partitions have 0 bytes in memory
+    pid = max(range(self.NPARTITIONS), key=self.part_bytes.__getitem__)
+    if self.parts[pid] is None:
+      return
+    lfile = SpillFile(self.stats, self.dirname)
+    for key, rows in self.parts[pid].items():
+      for row in rows:
+        lfile.append((key, row))
+    self.lfiles[pid] = lfile
+    self.rfiles[pid] = SpillFile(self.stats, self.dirname)
+    self.parts[pid] = None
+    self.nbytes -= self.part_bytes[pid]
+    self.part_bytes[pid] = 0
+    self.stats.partitions += 1
+
+  @property
+  def spilled(self):
+    return any(f is not None for f in self.lfiles)
+
+  def probe(self, key, row):
+    """
+    @row probe row.  It is copied if it needs to be spilled
+    @return build rows in memory whose key is @key
+    """
+    if is_null_key(key):
+      return ()
+    pid = self.partition(key)
+    if self.lfiles[pid] is not None:
+      self.rfiles[pid].append((key, list(row)))
+      return ()
+    return self.parts[pid].get(key, ())
+
+  def spilled_pairs(self):
+    """
+    Join the spilled build and probe rows of each spilled partition.
+    Call after all rows have been probed.
+
+    @return iterator of matching (build row, probe row) pairs
+    """
+    for pid in range(self.NPARTITIONS):
+      lfile, rfile = self.lfiles[pid], self.rfiles[pid]
+      if lfile is None:
+        continue
+      if lfile.nrows and rfile.nrows:
+        ht = SpillingHashTable(self.budget, self.row_bytes, self.stats,
+            self.dirname, self.depth + 1)
+        for key, row in lfile:
+          ht.add(key, row)
+        lfile.close()
+        for key, rrow in rfile:
+          for lrow in ht.probe(key, rrow):
+            yield lrow, rrow
+        rfile.close()
+        for pair in ht.spilled_pairs():
+          yield pair
+      else:
+        lfile.close()
+        rfile.close()
+      self.lfiles[pid] = self.rfiles[pid] = None
+
+
+class ExternalSort(object):
+  """
+  Sorts rows with at most @budget bytes of them in memory.  Rows are 
+  buffered until they outgrow the budget, and the buffer is then sorted 
+  into a run that is spilled to a temporary file.  Iterating merges the 
+  runs lazily, so the first rows are emitted as soon as each run's first 
+  chunk has been read.  Like list.sort(), the sort is stable.
+
+  Usage:
+
+    rows = ExternalSort(key, budget, row_bytes, stats)
+    for each row:  rows.add(row)
+    for row in rows: ...
+  """
+  # maximum number of runs to merge at once.  More runs are first merged
+  # into longer runs, so that there aren't too many open files
+  FANIN = 64
+
+  def __init__(self, key, budget, row_bytes, stats, dirname=None):
+    """
+    @key       sort key function, as in list.sort()
+    @budget    bytes of rows to hold in memory
+    @row_bytes estimated bytes per row
+    @stats     SpillStats to add to
+    @dirname   directory for the temporary files.  Defaults to the system's
+    """
+    self.key = key
+    self.budget = budget
+    self.row_bytes = row_bytes
+    self.stats = stats
+    self.dirname = dirname
+    self.buf = []
+    self.runs = []
+    self.nbytes = 0
+    self.nrows = 0
+
+  def add(self, row):
+    """
+    Add a @row, which must not be modified afterwards
+    """
+    self.buf.append(row)
+    self.nrows += 1
+    self.nbytes += self.row_bytes
+    if self.nbytes > self.budget:
+      self.spill_run()
+
+  def spill_run(self):
+    self.buf.sort(key=self.key)
+    self.runs.append(self.write_run(self.buf))
+    self.buf = []
+    self.nbytes = 0
+
+  def write_run(self, rows):
+    run = SpillFile(self.stats, self.dirname)
+    for row in rows:
+      run.append(row)
+    run.flush()
+    self.stats.runs += 1
+    return run
+
+  def merge_runs(self, runs):
+    """
+    @return iterator over the rows of @runs, which are files or lists, 
+            in sorted order.  Files are closed once merged
+    """
+    for row in heapq.merge(*map(iter, runs), key=self.key):
+      yield row
+    for run in runs:
+      if isinstance(run, SpillFile):
+        run.close()
+
+  def __len__(self):
+    return self.nrows
+
+  def __iter__(self):
+    self.buf.sort(key=self.key)
+    if not self.runs:
+      return iter(self.buf)
+
+    while len(self.runs) >= self.FANIN:
+      runs, self.runs = self.runs, []
+      for i in range(0, len(runs), self.FANIN):
+        self.runs.append(self.write_run(self.merge_runs(runs[i:i+self.FANIN])))
+
+    # the last run is still in memory
+    runs, self.runs = self.runs + [self.buf], []
+    self.buf = []
+    return self.merge_runs(runs)
+
@@ -1,35 +1,350 @@
+import random
+import numpy as np
+import pandas
+from .sketch import HyperLogLog
+from .zonemap import OPS
+
 class ColStats(object):
-  def __init__(self, table_id, col_idx, 
-      nrows, card, frac_null, 
-      common_vals, common_freqs,
-      histogram_bounds, is_base_table):
+  """
+  Distribution of a column's values, estimated from a sample of its rows.
+
+  The most common values (MCVs) and their frequencies are kept exactly, and
+  the remaining non-null values of numeric columns are summarized by an
+  equi-depth histogram: each of the buckets between consecutive
+  histogram_bounds holds the same fraction of those values.
+  """
+  # maximum number of MCVs and histogram buckets per column
+  NMCV = 20
+  NBUCKETS = 50
+
+  def __init__(self, nrows, card, frac_null, 
+      common_vals, common_freqs, histogram_bounds):
+    """
+    @nrows  number of rows in the table
+    @card   number of distinct values in the column
+    @common_freqs fraction of the table's rows that have each common value
+    @histogram_bounds sorted bucket boundaries, or None for
+            non-numeric columns
+    """
     self.nrows = nrows
     self.card = card
     self.frac_null = frac_null
     self.common_vals = common_vals
     self.common_freqs = common_freqs
     self.histogram_bounds = histogram_bounds
-    self.is_base_table = is_base_table
+
+    # fraction of the rows, and number of distinct values, not 
+    # covered by the MCVs or nulls
+    self.frac_rest = max(0.0, 1.0 - frac_null - sum(common_freqs))
+    self.card_rest = max(1, card - len(common_vals))
+    self._freqs = dict(zip(common_vals, common_freqs))
+
+  @staticmethod
+  def build(vals, nrows, card, numeric):
+    """
+    @vals    list of the sampled column values
+    @card    estimated number of distinct values in the column
+    @numeric whether to build a histogram
+    """
+    n = len(vals)
+    counts = pandas.Series(vals, dtype=object).value_counts(dropna=True)
+    frac_null = (n - int(counts.sum())) / float(max(1, n))
+
+    # a value is common if it appears more often in the sample than an 
+    # average value.  A sample of the whole table has no common values
+    # if all of its values are distinct
+    avg = float(counts.sum()) / max(1, len(counts))
+    common = counts[(counts > 1) & (counts > 1.25 * avg)][:ColStats.NMCV]
+    common_vals = common.index.tolist()
+    common_freqs = (common / float(max(1, n))).tolist()
+
+    bounds = None
+    if numeric:
+      rest = np.asarray([v for v in vals if v is not None and v == v], dtype=float)
+      rest = np.sort(rest[~np.isin(rest, common_vals)])
+      if len(rest):
+        pos = np.linspace(0, len(rest) - 1, min(ColStats.NBUCKETS, len(rest)) + 1)
+        bounds = rest[pos.astype(int)]
+    return ColStats(nrows, card, frac_null, common_vals, common_freqs, bounds)
+
+  def to_dict(self):
+    bounds = self.histogram_bounds
+    return dict(
+        nrows=self.nrows, card=self.card, frac_null=self.frac_null,
+        common_vals=self.common_vals, common_freqs=self.common_freqs,
+        histogram_bounds=None if bounds is None else bounds.tolist())
+
+  @staticmethod
+  def from_dict(d):
+    bounds = d['histogram_bounds']
+    return ColStats(d['nrows'], d['card'], d['frac_null'], 
+        d['common_vals'], d['common_freqs'],
+        None if bounds is None else np.asarray(bounds, dtype=float))
+
+  def frac_below(self, v):
+    """
+    @return estimated fraction of the histogram's values that are < @v,
+            interpolating linearly within v's bucket
+    """
+    bounds = self.histogram_bounds
+    if bounds is None or not len(bounds):
+      return 0.5
+    if v <= bounds[0]:
+      return 0.0
+    if v > bounds[-1]:
+      return 1.0
+    nbuckets = len(bounds) - 1
+    if not nbuckets:
+      return 0.5
+    i = int(np.searchsorted(bounds, v, "left")) - 1
+    lo, hi = bounds[i], bounds[i + 1]
+    within = (v - lo) / float(hi - lo) if hi > lo else 0.5
+    return (i + within) / nbuckets
+
+  def selectivity_eq(self, v):
+    if v in self._freqs:
+      return self._freqs[v]
+    bounds = self.histogram_bounds
+    if bounds is not None and len(bounds) and not (bounds[0] <= v <= bounds[-1]):
+      return 0.0
+    return self.frac_rest / self.card_rest
+
+  def selectivity_range(self, op, v):
+    """
+    @op one of <, <=, >, >=
+    """
+    cmp = OPS[op]
+    sel = sum(f for cv, f in zip(self.common_vals, self.common_freqs) 
+        if cmp(cv, v))
+    below = self.frac_below(v)
+    sel += self.frac_rest * (below if op in ("<", "<=") else 1.0 - below)
+    return min(1.0, sel)
+
+  def selectivity_between(self, lo, hi):
+    sel = sum(f for cv, f in zip(self.common_vals, self.common_freqs) 
+        if lo <= cv <= hi)
+    sel += self.frac_rest * max(0.0, self.frac_below(hi) - self.frac_below(lo))
+    return min(1.0, sel)
+
+  def selectivity_in(self, vals):
+    return min(1.0, sum(self.selectivity_eq(v) for v in set(vals)))
+
+  def selectivity_join(self, other):
+    """
+    @return estimated selectivity of an equijoin between this column and
+            @other, over the cross product of their tables.  Matching MCVs
+            are joined exactly; the remaining values are assumed to be
+            uniformly distributed.
+    """
+    sel = 0.0
+    lmatched = rmatched = 0.0
+    for v, f in zip(self.common_vals, self.common_freqs):
+      if v in other._freqs:
+        sel += f * other._freqs[v]
+        lmatched += f
+        rmatched += other._freqs[v]
+    lrest = max(0.0, 1.0 - self.frac_null - lmatched)
+    rrest = max(0.0, 1.0 - other.frac_null - rmatched)
+    sel += lrest * rrest / max(self.card_rest, other.card_rest)
+    return min(1.0, sel)
+
 
 class Stats(object):
-  
-  def __init__(self, table):
+  """
+  Table and column statistics for the Estimator.
+
+  The number of distinct values of a column is counted exactly if the
+  table has at most sample_size rows, and otherwise estimated with a
+  HyperLogLog sketch in a single pass that doesn't materialize the column.
+  Sketches of PartitionedTables are merged from their partitions' sketches.
+  Distributions (see ColStats) are built from a uniform sample of at most
+  sample_size rows, which appends maintain as a reservoir sample.
+  """
+  # default sample size.  See Database(sample_size=)
+  SAMPLE_SIZE = 10000
+
+  # number of values sketched at a time
+  CHUNKSIZE = 1 << 16
+
+  def __init__(self, table, sample_size=None, saved=None):
+    """
+    @saved stats serialized by to_dict(), e.g., from the StatsCatalog
+    """
     self.table = table
-    self.card = len(table.rows)
+    self.sample_size = sample_size or self.SAMPLE_SIZE
+    self.rand = random.Random(0)
+    self.streaming = getattr(table, "streaming", False)
+    self._sample = None
+    if saved is not None:
+      self.card = saved['card']
+    elif self.streaming:
+      self._sample, self.card = table.sample(self.sample_size)
+    else:
+      self.card = len(table)
 
+    # attribute name -> column stats
     self.col_stats = dict()
 
+    # attribute name -> HyperLogLog of the column's values, maintained
+    # by appends
+    self.sketches = dict()
+
+    # attribute name -> ColStats
+    self.distributions = dict()
+
+    if saved is not None:
+      self.col_stats = dict(saved['col_stats'])
+      self.distributions = { aname: ColStats.from_dict(d) 
+          for aname, d in saved['distributions'].items() }
+
+  def to_dict(self):
+    """
+    @return JSON-serializable copy of the stats computed so far
+    """
+    return dict(
+        card=self.card,
+        col_stats=self.col_stats,
+        distributions={ aname: dist.to_dict() 
+          for aname, dist in self.distributions.items() })
+
   def __getitem__(self, attr):
-    if attr not in self.col_stats:
-      self.col_stats[attr] = self.compute_col_stats(attr)
-    return self.col_stats[attr]
+    if attr.aname not in self.col_stats:
+      self.col_stats[attr.aname] = self.compute_col_stats(attr)
+    return self.col_stats[attr.aname]
+
+  @property
+  def sample(self):
+    """
+    @return list of at most sample_size rows sampled uniformly from the table
+    """
+    if self._sample is None and self.streaming:
+      self._sample, _ = self.table.sample(self.sample_size)
+    elif self._sample is None:
+      n, k = self.card, self.sample_size
+      rids = range(n) if n <= k else sorted(self.rand.sample(range(n), k))
+      self._sample = self.table.rows_at(list(rids))
+    return self._sample
+
+  def sample_values(self, attr):
+    """
+    @return list of @attr's values in the sampled rows
+    """
+    from .exprs import Attr
+    idx = self.table.schema.idx(Attr(attr.aname))
+    return [row[idx] for row in self.sample]
+
+  def distribution(self, attr):
+    """
+    @return ColStats of the @attr column, built from the sampled rows
+    """
+    if attr.aname not in self.distributions:
+      numeric = self.table.schema.get_type(attr) == "num"
+      self.distributions[attr.aname] = ColStats.build(
+          self.sample_values(attr), self.card, self[attr]['ndistinct'], numeric)
+    return self.distributions[attr.aname]
+
+  def sketch(self, attr):
+    """
+    @return HyperLogLog of the @attr column's values
+    """
+    if attr.aname not in self.sketches:
+      parts = getattr(self.table, "partitions", None)
+      if parts is not None:
+        sketch = HyperLogLog()
+        for part in parts:
+          sketch.merge(part.stats.sketch(attr))
+      else:
+        sketch = self.scan_column(attr)[0]
+      self.sketches[attr.aname] = sketch
+    return self.sketches[attr.aname]
+
+  def scan_column(self, attr):
+    """
+    Sketch the @attr column and compute its range in one pass over the 
+    table's value_chunks()
+
+    @return (HyperLogLog, min, max).  min and max are None for
+            non-numeric columns
+    """
+    from .exprs import Attr
+    idx = self.table.schema.idx(Attr(attr.aname))
+    numeric = self.table.schema.get_type(attr) == "num"
+    sketch = HyperLogLog()
+    lo = hi = None
+    for chunk in self.table.value_chunks(idx, self.CHUNKSIZE):
+      sketch.add(chunk)
+      if not numeric:
+        continue
+      nums = np.asarray(chunk, dtype=float)
+      nums = nums[~np.isnan(nums)]
+      if len(nums):
+        clo, chi = nums.min().tolist(), nums.max().tolist()
+        lo = clo if lo is None else min(lo, clo)
+        hi = chi if hi is None else max(hi, chi)
+    return sketch, lo, hi
+
+  def append(self, cols):
+    """
+    Incrementally update the stats for rows about to be appended to the 
+    table.  Must be called before the table's rows change, since the first 
+    append sketches the existing column values.
+
+    @cols list of the appended values of each attribute, in schema order
+    """
+    from .exprs import Attr
+    n = len(cols[0]) if cols else 0
+    if self.streaming:
+      self.card += n
+      return
+
+    for aname, stat in self.col_stats.items():
+      attr = Attr(aname)
+      vals = cols[self.table.schema.idx(attr)]
+      sketch = self.sketch(attr)
+      sketch.add(vals)
+
+      # the sketch's estimate is approximate, but the new values add at 
+      # most n distinct values
+      ndistinct = stat['ndistinct']
+      stat['ndistinct'] = min(ndistinct + n, max(ndistinct, sketch.estimate()))
+
+      if self.table.schema.get_type(attr) == "num":
+        # nulls are NaN or None
+        nums = [v for v in np.asarray(vals).tolist() if v is not None and v == v]
+        if nums:
+          lo, hi = min(nums), max(nums)
+          stat['min'] = lo if stat['min'] is None else min(stat['min'], lo)
+          stat['max'] = hi if stat['max'] is None else max(stat['max'], hi)
+
+    # reservoir sampling keeps the sample uniform over all of the rows
+    if self._sample is not None:
+      for i, row in enumerate(zip(*cols)):
+        if len(self._sample) < self.sample_size:
+          self._sample.append(list(row))
+          continue
+        j = self.rand.randint(0, self.card + i)
+        if j < self.sample_size:
+          self._sample[j] = list(row)
+    self.card += n
+
+    # distributions are rebuilt from the sample on next use
+    self.distributions.clear()
 
   def compute_col_stats(self, attr):
     """
     @return the domain of the @attr as a dictionary with keys:
             min, max, and distinct
     """
+    if self.streaming:
+      return self.compute_col_stats_sampled(attr)
+
+    if self.card > self.sample_size:
+      return self.compute_col_stats_sketched(attr)
+
     col = self.table.col_values(attr)
+    if isinstance(col, np.ndarray):
+      return self.compute_col_stats_vectorized(attr, col)
+
     if self.table.schema.get_type(attr) == "num":
       return dict(
           min=min(col), 
@@ -40,4 +355,54 @@ class Stats(object):
         max=None,
         ndistinct=len(set(col)))
 
+  def compute_col_stats_sketched(self, attr):
+    """
+    Same as compute_col_stats, with the number of distinct values 
+    estimated from the column's sketch
+    """
+    parts = getattr(self.table, "partitions", None)
+    if parts is not None:
+      lo = hi = None
+      for part in parts:
+        stat = part.stats[attr]
+        if stat['min'] is not None:
+          lo = stat['min'] if lo is None else min(lo, stat['min'])
+          hi = stat['max'] if hi is None else max(hi, stat['max'])
+    else:
+      self.sketches[attr.aname], lo, hi = self.scan_column(attr)
+    return dict(min=lo, max=hi, ndistinct=self.sketch(attr).estimate())
+
+  def compute_col_stats_vectorized(self, attr, col):
+    """
+    Same as compute_col_stats, for columns stored as numpy arrays
+    """
+    ndistinct = len(pandas.unique(col))
+    if self.table.schema.get_type(attr) == "num" and len(col):
+      return dict(
+          min=np.asarray(col.min()).tolist(),
+          max=np.asarray(col.max()).tolist(),
+          ndistinct=ndistinct)
+    return dict(
+        min=None,
+        max=None,
+        ndistinct=ndistinct)
+
+  def compute_col_stats_sampled(self, attr):
+    """
+    Same as compute_col_stats, estimated from the sampled rows.
+    The number of distinct values is scaled up to the full table with the
+    GEE estimator: sqrt(N/n) * f1 + sum_{j>1} fj, where fj is the number of
+    values that appear j times in the sample.
+    """
+    col = self.sample_values(attr)
+    counts = pandas.Series(col).value_counts(dropna=False)
+    if len(col) >= self.card:
+      ndistinct = len(counts)
+    else:
+      f1 = int((counts == 1).sum())
+      scale = np.sqrt(self.card / float(max(1, len(col))))
+      ndistinct = int(round(scale * f1 + (len(counts) - f1)))
 
+    if self.table.schema.get_type(attr) == "num" and col:
+      return dict(min=min(col), max=max(col), ndistinct=ndistinct)
+    return dict(min=None, max=None, ndistinct=ndistinct)
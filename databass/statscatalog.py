@@ -0,0 +1,73 @@
+"""
+Catalog of table statistics persisted next to the data files, so that
+restarting the database, or starting a new worker process, doesn't
+recompute them.  See Database.analyze()
+"""
+import json
+import os
+import tempfile
+from .tablecache import TableCache
+
+
+def to_json(v):
+  # numpy scalars and arrays
+  if hasattr(v, "tolist"):
+    return v.tolist()
+  raise TypeError("%s is not JSON serializable" % type(v).__name__)
+
+
+class StatsCatalog(object):
+  """
+  Each data directory has a catalog file that maps the absolute path of
+  each of its analyzed data files to the file's size and mtime when it was
+  analyzed, and the table's serialized Stats (see Stats.to_dict()).
+  An entry whose file has since changed is ignored, and replaced the next
+  time the table is analyzed.
+  """
+  FNAME = ".databass_stats.json"
+
+  def catalog_path(self, path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), self.FNAME)
+
+  def read(self, path):
+    try:
+      with open(self.catalog_path(path)) as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return {}
+
+  def load(self, path):
+    """
+    @return the serialized stats of the data file at @path, or None if
+            there are none or they are stale
+    """
+    try:
+      state = TableCache.file_state(path)
+    except OSError:
+      return None
+    entry = self.read(path).get(state['path'], None)
+    if entry is None or any(entry.get(k) != v for k, v in state.items()):
+      return None
+    return entry['stats']
+
+  def store(self, path, stats):
+    """
+    Add or replace the entry for the data file at @path.  The catalog is
+    written to a temporary file and renamed into place, so concurrent
+    readers never see a partial catalog.  Failures to write, e.g., to a
+    read-only data directory, are ignored.
+
+    @stats serialized Stats
+    """
+    state = TableCache.file_state(path)
+    catalog = self.read(path)
+    catalog[state['path']] = dict(state, stats=stats)
+
+    dirname = os.path.dirname(self.catalog_path(path))
+    try:
+      fd, tmp = tempfile.mkstemp(dir=dirname, prefix=".tmp-stats-")
+      with os.fdopen(fd, "w") as f:
+        json.dump(catalog, f, default=to_json)
+      os.replace(tmp, self.catalog_path(path))
+    except OSError:
+      pass
@@ -0,0 +1,148 @@
+"""
+On-disk cache of parsed data files.
+
+Each cached file is stored as a directory of typed numpy column files that
+are memory-mapped when loaded, so restarting the database doesn't re-parse
+its CSVs, and worker processes that load the same table share its pages.
+"""
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+from .schema import Schema
+from .exprs import Attr
+from .tables import ColumnarTable, DictColumn
+
+
+class TableCache(object):
+  """
+  Cache entries are keyed by the data file's absolute path, size and mtime.
+  Changing the file changes its key, so a stale entry is never read, and it is
+  removed the next time the file is cached.
+
+    <cache_dir>/<path hash>-<state hash>/
+      meta.json       source path, size, mtime, dict_encode setting, and
+                      the table schema
+      <i>.npy         numeric column i
+      <i>.codes.npy   codes of dictionary-encoded column i
+      <i>.pkl         dictionary values of column i, or an object column
+  """
+  def __init__(self, cache_dir):
+    self.cache_dir = cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+
+  @staticmethod
+  def file_state(path):
+    st = os.stat(path)
+    return dict(path=os.path.abspath(path), size=st.st_size, mtime=st.st_mtime_ns)
+
+  @staticmethod
+  def path_key(path):
+    return hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+
+  def entry_dir(self, state):
+    key = "%s:%s:%s" % (state['path'], state['size'], state['mtime'])
+    statekey = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    name = "%s-%s" % (self.path_key(state['path']), statekey)
+    return os.path.join(self.cache_dir, name)
+
+  @staticmethod
+  def encode_key(dict_encode):
+    """
+    JSON-comparable form of a register_dataframe dict_encode argument
+    """
+    if isinstance(dict_encode, (list, tuple, set)):
+      return sorted(dict_encode)
+    return bool(dict_encode)
+
+  def load(self, path, dict_encode=False):
+    """
+    @dict_encode the encoding the table should have.  Entries stored with a
+            different setting are not used
+    @return ColumnarTable with memory-mapped columns, or None if @path
+            has no up-to-date cache entry
+    """
+    try:
+      state = self.file_state(path)
+    except OSError:
+      return None
+    state['dict_encode'] = self.encode_key(dict_encode)
+    entry = self.entry_dir(state)
+    try:
+      with open(os.path.join(entry, "meta.json")) as f:
+        meta = json.load(f)
+    except (OSError, ValueError):
+      return None
+    if any(meta.get(k) != v for k, v in state.items()):
+      return None
+
+    schema = Schema([Attr(aname, typ) for aname, typ in meta['schema']])
+    cols = []
+    for i, kind in enumerate(meta['kinds']):
+      fname = os.path.join(entry, str(i))
+      if kind == "num":
+        cols.append(np.load(fname + ".npy", mmap_mode='r'))
+      elif kind == "dict":
+        codes = np.load(fname + ".codes.npy", mmap_mode='r')
+        with open(fname + ".pkl", "rb") as f:
+          cols.append(DictColumn(codes, pickle.load(f)))
+      else:
+        with open(fname + ".pkl", "rb") as f:
+          cols.append(pickle.load(f))
+    return ColumnarTable(schema, cols)
+
+  def store(self, path, table, dict_encode=False):
+    """
+    Write @table as the cache entry for @path, and remove older entries
+    for the same path.  The entry is written to a temporary directory and
+    renamed into place, so concurrent readers never see a partial entry.
+
+    @table ColumnarTable parsed from @path
+    @dict_encode the dict_encode setting @table was registered with
+    """
+    state = self.file_state(path)
+    entry = self.entry_dir(state)
+    tmp = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-")
+    try:
+      kinds = []
+      for i, col in enumerate(table.cols):
+        fname = os.path.join(tmp, str(i))
+        if isinstance(col, DictColumn):
+          kinds.append("dict")
+          np.save(fname + ".codes.npy", np.asarray(col.codes))
+          with open(fname + ".pkl", "wb") as f:
+            pickle.dump(col.values, f)
+        elif col.dtype == object:
+          kinds.append("obj")
+          with open(fname + ".pkl", "wb") as f:
+            pickle.dump(col, f)
+        else:
+          kinds.append("num")
+          np.save(fname + ".npy", col)
+
+      meta = dict(state)
+      meta['dict_encode'] = self.encode_key(dict_encode)
+      meta['schema'] = [(a.aname, a.typ) for a in table.schema]
+      meta['kinds'] = kinds
+      with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+      try:
+        os.rename(tmp, entry)
+      except OSError:
+        # another process cached the same file first
+        pass
+    finally:
+      shutil.rmtree(tmp, ignore_errors=True)
+
+    self.evict_stale(path, keep=entry)
+
+  def evict_stale(self, path, keep=None):
+    prefix = self.path_key(path) + "-"
+    for name in os.listdir(self.cache_dir):
+      fpath = os.path.join(self.cache_dir, name)
+      if name.startswith(prefix) and fpath != keep:
+        shutil.rmtree(fpath, ignore_errors=True)
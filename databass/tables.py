@@ -1,10 +1,22 @@
 import pandas
 import numbers
 import os
+import random
+import numpy as np
 from .stats import Stats
+from .zonemap import ZoneMap, filter_rows, block_mask
+from .batch import Batch, BATCHSIZE
 from .tuples import *
 from .exprs import Attr
 
+def cols_from_rows(rows, nattrs):
+  rows = list(rows)
+  return [[row[i] for row in rows] for i in range(nattrs)]
+
+def rows_from_cols(cols):
+  return [list(row) for row in zip(*cols)]
+
+
 class Table(object):
   """
   A table consists of a schema, and a way to iterate over the rows.
@@ -18,6 +30,12 @@ class Table(object):
     self.id = Table.id
     Table.id += 1
 
+    # incremented whenever the table's rows change, so that state derived
+    # from the rows (e.g., cached join hash tables) can be invalidated
+    self.version = 0
+
+    # rows sampled by the table's Stats, or None for Stats.SAMPLE_SIZE
+    self.sample_size = None
     self._stats = None
 
 
@@ -31,13 +49,94 @@ class Table(object):
   @property
   def stats(self):
     if self._stats is None:
-      self._stats = Stats(self)
+      self._stats = Stats(self, self.sample_size)
     return self._stats
 
 
   def col_values(self, field):
     idx = self.schema.idx(Attr(field.aname))
-    return [row[idx] for row in self]
+    return [row[idx] for row in self.iter_rows()]
+
+  def value_chunks(self, idx, chunksize):
+    """
+    Iterate over the values of the @idx'th attribute in chunks, without
+    materializing the whole column.  Used to sketch the column, so the
+    chunks may omit duplicate values.
+
+    @return iterator of lists or numpy arrays of at most @chunksize values
+    """
+    chunk = []
+    for row in self.iter_rows():
+      chunk.append(row[idx])
+      if len(chunk) >= chunksize:
+        yield chunk
+        chunk = []
+    if chunk:
+      yield chunk
+
+  def append(self, rows):
+    """
+    Append @rows, lists of attribute values in schema order, to the table
+    """
+    raise Exception("%s does not support appends" % type(self).__name__)
+
+  def append_dataframe(self, df):
+    """
+    @df pandas DataFrame whose columns are in the same order as the schema
+    """
+    self.append(rows_from_cols([df.iloc[:, i].tolist() 
+      for i in range(len(self.schema.attrs))]))
+
+  def on_append(self, cols):
+    """
+    Called by append() before the rows change.  Updates the stats 
+    incrementally and bumps the table version.
+
+    @cols list of the appended values of each attribute, in schema order
+    """
+    if self._stats is not None:
+      self._stats.append(cols)
+    self.version += 1
+
+  def iter_rows(self, encoded=False, preds=None, rids=False):
+    """
+    Iterate over the rows as lists of attribute values.  Scans use this
+    rather than __iter__ so they don't allocate a ListTuple per row.
+
+    @encoded emit the codes rather than the values of dictionary-encoded
+             attributes (those whose schema Attr has a dictionary)
+    @preds   only emit the rows that satisfy these pushed-down
+             (attr idx, op, value) predicates.  See zonemap.py
+    @rids    emit (row id, row) pairs, where the row id is the row's
+             position in the table
+    """
+    return filter_rows((tup.row for tup in self), preds, rids)
+
+  def iter_batches(self, encoded=False, preds=None):
+    """
+    Same as iter_rows(), but emits batch.Batch objects of at most 
+    BATCHSIZE rows
+    """
+    ncols = len(self.schema.attrs)
+    rows = []
+    for row in self.iter_rows(encoded=encoded, preds=preds):
+      rows.append(row)
+      if len(rows) >= BATCHSIZE:
+        yield Batch.from_rows(rows, ncols)
+        rows = []
+    if rows:
+      yield Batch.from_rows(rows, ncols)
+
+  def rows_at(self, rids, encoded=False):
+    """
+    @rids row ids (positions in the table) to fetch, e.g., from an index
+    @return list of the rows, in the same order as @rids
+    """
+    rows = list(self.iter_rows(encoded=encoded))
+    return [rows[rid] for rid in rids]
+
+  def __len__(self):
+    return sum(1 for _ in self.iter_rows())
 
   def __iter__(self):
     yield
@@ -53,7 +152,559 @@ class InMemoryTable(Table):
     self.attr_to_idx = { a.aname: i 
         for i,a in enumerate(self.schema)}
 
+  def iter_rows(self, encoded=False, preds=None, rids=False):
+    return filter_rows(iter(self.rows), preds, rids)
+
+  def append(self, rows):
+    rows = [list(row) for row in rows]
+    self.on_append(cols_from_rows(rows, len(self.schema.attrs)))
+    self.rows.extend(rows)
+
+  def rows_at(self, rids, encoded=False):
+    return [self.rows[rid] for rid in rids]
+
+  def __len__(self):
+    return len(self.rows)
+
   def __iter__(self):
     for row in self.rows:
       yield ListTuple(self.schema, row)
 
+
+class DictColumn(object):
+  """
+  Dictionary-encoded column.  Each row stores a small integer code that
+  indexes into the array of the column's distinct values.
+  """
+  def __init__(self, codes, values):
+    """
+    @codes  integer numpy array, one code per row
+    @values object numpy array of distinct values
+    """
+    self.codes = codes
+    self.values = values
+
+  @staticmethod
+  def encode(arr):
+    codes, uniques = pandas.factorize(arr)
+    values = np.asarray(uniques, dtype=object)
+
+    # missing values are given their own code at the end of the dictionary
+    missing = codes < 0
+    if missing.any():
+      codes[missing] = len(values)
+      values = np.append(values, np.array([np.nan], dtype=object))
+    return DictColumn(codes.astype(np.int32), values)
+
+  def extend(self, vals):
+    """
+    Append @vals to the column, adding the values that aren't in the 
+    dictionary to the end of the dictionary so existing codes don't change
+    """
+    lookup = {}
+    for code, v in enumerate(self.values.tolist()):
+      # NaN != NaN, so nulls are keyed by None
+      lookup[v if v == v else None] = code
+    newvals = []
+    codes = np.empty(len(vals), dtype=np.int32)
+    for i, v in enumerate(vals):
+      if v is None or v != v:
+        v = None
+      if v not in lookup:
+        lookup[v] = len(self.values) + len(newvals)
+        newvals.append(np.nan if v is None else v)
+      codes[i] = lookup[v]
+
+    if newvals:
+      newvals_arr = np.empty(len(newvals), dtype=object)
+      newvals_arr[:] = newvals
+      self.values = np.concatenate([self.values, newvals_arr])
+    self.codes = np.concatenate([self.codes, codes])
+
+  def decode(self, start=0, end=None):
+    """
+    @return object numpy array of the values for rows [start, end)
+    """
+    return self.values[self.codes[start:end]]
+
+  def __len__(self):
+    return len(self.codes)
+
+
+class Dictionary(object):
+  """
+  The value dictionary of a dictionary-encoded table column.  It is set as
+  the .dictionary of the column's schema Attr, and of the Attrs that
+  reference it in expressions, so they can decode the column's codes.
+  """
+  def __init__(self, table, idx):
+    self.table_id = table.id
+    self.idx = idx
+    self.values = table.cols[idx].values
+    self._codes = None
+
+  def refresh(self, col):
+    """
+    Called when the column's values change, e.g., after DictColumn.extend()
+    """
+    self.values = col.values
+    self._codes = None
+
+  def code(self, v):
+    """
+    @return the code of value @v, or -1 if @v is not in the dictionary
+    """
+    if self._codes is None:
+      self._codes = { v: i for i, v in enumerate(self.values.tolist()) }
+    return self._codes.get(v, -1)
+
+  def same(self, other):
+    return (other is not None and
+        self.table_id == other.table_id and self.idx == other.idx)
+
+  def codegen(self):
+    """
+    @return compiled code that evaluates to the dictionary's values array
+    """
+    return "db.table_by_id(%d).cols[%d].values" % (self.table_id, self.idx)
+
+  def __getitem__(self, code):
+    return self.values[code]
+
+
+class ColumnarTable(Table):
+  """
+  Column-oriented table that stores each attribute as a typed numpy array,
+  or as a DictColumn for dictionary-encoded string attributes.
+
+  Rows are only materialized, BLOCKSIZE rows at a time, when the table
+  is scanned.
+  """
+  BLOCKSIZE = 4096
+
+  def __init__(self, schema, cols):
+    """
+    @cols list of numpy arrays or DictColumns, in the same order as @schema
+
+    The table annotates the Attrs of encoded columns with their Dictionary,
+    so it keeps a copy of @schema rather than modifying the caller's
+    """
+    super(ColumnarTable, self).__init__(schema.copy())
+    self.cols = cols
+    self.zonemaps = {}
+    self.attr_to_idx = { a.aname: i
+        for i,a in enumerate(self.schema)}
+
+    for i, col in enumerate(cols):
+      if isinstance(col, DictColumn):
+        self.schema.attrs[i].dictionary = Dictionary(self, i)
+
+  @staticmethod
+  def from_dataframe(df, schema, dict_encode=False):
+    """
+    @df          pandas DataFrame whose columns are in the same order as @schema
+    @dict_encode dictionary encode the string attributes, or only the ones
+                 named in this list
+    """
+    cols = []
+    for i, attr in enumerate(schema):
+      arr = df.iloc[:, i].to_numpy()
+      if attr.typ == "str":
+        if dict_encode is True or (dict_encode and attr.aname in dict_encode):
+          arr = DictColumn.encode(arr)
+        else:
+          arr = arr.astype(object, copy=False)
+      cols.append(arr)
+    return ColumnarTable(schema, cols)
+
+  def append(self, rows):
+    self.append_columns(cols_from_rows(rows, len(self.schema.attrs)))
+
+  def append_dataframe(self, df):
+    self.append_columns([df.iloc[:, i].to_numpy() 
+      for i in range(len(self.schema.attrs))])
+
+  def append_columns(self, vals):
+    """
+    @vals list of the appended values of each attribute, in schema order
+    """
+    if not self.cols or not len(vals[0]):
+      return
+    self.on_append(vals)
+    for i, (attr, col) in enumerate(zip(self.schema.attrs, self.cols)):
+      if isinstance(col, DictColumn):
+        col.extend(np.asarray(vals[i], dtype=object).tolist())
+        attr.dictionary.refresh(col)
+        continue
+
+      arr = np.asarray(vals[i])
+      if col.dtype == object:
+        arr = arr.astype(object)
+      elif arr.dtype == object:
+        # numeric column with None for nulls
+        arr = arr.astype(float)
+      self.cols[i] = np.concatenate([col, arr])
+
+    # zone maps are rebuilt on next use
+    self.zonemaps = {}
+
+  def column(self, idx, start=0, end=None):
+    """
+    @return numpy array of the decoded values of the @idx'th attribute
+            for rows [start, end)
+    """
+    col = self.cols[idx]
+    if isinstance(col, DictColumn):
+      return col.decode(start, end)
+    return col[start:end]
+
+  def col_values(self, field):
+    return self.column(self.schema.idx(Attr(field.aname)))
+
+  def raw_column(self, idx, start=0, end=None):
+    """
+    Same as column(), but returns codes for dictionary encoded attributes
+    """
+    col = self.cols[idx]
+    if isinstance(col, DictColumn):
+      return col.codes[start:end]
+    return col[start:end]
+
+  def rows_at(self, rids, encoded=False):
+    rids = np.asarray(rids, dtype=np.int64)
+    getcol = self.raw_column if encoded else self.column
+    cols = [getcol(i)[rids].tolist() for i in range(len(self.cols))]
+    return [list(row) for row in zip(*cols)]
+
+  def value_chunks(self, idx, chunksize):
+    col = self.cols[idx]
+    if isinstance(col, DictColumn):
+      # the dictionary holds each distinct value once
+      yield col.values
+      return
+    for start in range(0, len(col), chunksize):
+      yield col[start:start + chunksize]
+
+  def zonemap(self, idx):
+    """
+    @return ZoneMap of the @idx'th attribute, or None if it isn't numeric.
+            Built on first use so that tables loaded from memory-mapped 
+            files aren't read in full at load time
+    """
+    if idx not in self.zonemaps:
+      col = self.cols[idx]
+      zonemap = None
+      if not isinstance(col, DictColumn) and col.dtype.kind in "biuf":
+        zonemap = ZoneMap.build(col, self.BLOCKSIZE)
+      self.zonemaps[idx] = zonemap
+    return self.zonemaps[idx]
+
+  def may_match(self, block, preds):
+    """
+    @return False if the zone maps rule out the @block'th block for @preds
+    """
+    for idx, op, v in preds:
+      zonemap = self.zonemap(idx)
+      if zonemap is not None and not zonemap.may_match(block, op, v):
+        return False
+    return True
+
+  def iter_rows(self, encoded=False, preds=None, rids=False):
+    """
+    Blocks that the zone maps rule out for any of the @preds are skipped.
+    The rows of the remaining blocks are filtered with vectorized comparisons.
+    """
+    getcol = self.raw_column if encoded else self.column
+    preds = preds or []
+    n = len(self)
+    for block, start in enumerate(range(0, n, self.BLOCKSIZE)):
+      end = min(n, start + self.BLOCKSIZE)
+      if preds and not self.may_match(block, preds):
+        continue
+
+      cols = [getcol(i, start, end) for i in range(len(self.cols))]
+      ids = range(start, end)
+      if preds:
+        sel = np.flatnonzero(block_mask(cols, preds))
+        if not len(sel):
+          continue
+        cols = [col[sel] for col in cols]
+        ids = (sel + start).tolist()
+
+      block = [col.tolist() for col in cols]
+      if rids:
+        for rid, row in zip(ids, zip(*block)):
+          yield rid, list(row)
+      else:
+        for row in zip(*block):
+          yield list(row)
+
+  def iter_batches(self, encoded=False, preds=None):
+    """
+    Each block is emitted as a Batch of slices of the columns, without
+    materializing its rows.  Pushed-down predicates set the selection vector
+    """
+    getcol = self.raw_column if encoded else self.column
+    n = len(self)
+    for block, start in enumerate(range(0, n, self.BLOCKSIZE)):
+      end = min(n, start + self.BLOCKSIZE)
+      if preds and not self.may_match(block, preds):
+        continue
+      batch = Batch([getcol(i, start, end) for i in range(len(self.cols))])
+      if preds:
+        batch = batch.select(block_mask(batch.cols, preds))
+        if not len(batch):
+          continue
+      yield batch
+
+  def __len__(self):
+    if not self.cols:
+      return 0
+    return len(self.cols[0])
+
+  def __iter__(self):
+    for row in self.iter_rows():
+      yield ListTuple(self.schema, row)
+
+
+class FileTable(Table):
+  """
+  Table that streams its rows from a delimited data file, CHUNKSIZE rows
+  at a time, rather than loading it into memory.  Scans re-read the file.
+
+  Stats are estimated from a sample (see sample()) since the
+  table's column values are never all in memory.
+  """
+  CHUNKSIZE = 4096
+  streaming = True
+
+  def __init__(self, schema, path, sep=',', chunksize=None):
+    """
+    @path       path of the data file, whose header row names the attributes
+                in the same order as @schema
+    @sep        field separator
+    """
+    super(FileTable, self).__init__(schema)
+    self.path = path
+    self.sep = sep
+    self.chunksize = chunksize or self.CHUNKSIZE
+    self.attr_to_idx = { a.aname: i
+        for i,a in enumerate(self.schema)}
+    self._nrows = None
+
+  def iter_chunks(self):
+    """
+    @return iterator of pandas DataFrames of at most chunksize rows
+    """
+    reader = pandas.read_csv(self.path, sep=self.sep, chunksize=self.chunksize)
+    with reader:
+      for chunk in reader:
+        yield chunk
+
+  def iter_rows(self, encoded=False, preds=None, rids=False):
+    return filter_rows(self.iter_chunk_rows(), preds, rids)
+
+  def iter_chunk_rows(self):
+    for chunk in self.iter_chunks():
+      block = [chunk.iloc[:, i].tolist() for i in range(len(self.schema.attrs))]
+      for row in zip(*block):
+        yield list(row)
+
+  def sample(self, n, seed=0):
+    """
+    Reservoir sample of the table's rows, in a single pass over the file.
+
+    @return (list of at most @n rows, number of rows in the table)
+    """
+    rand = random.Random(seed)
+    rows = []
+    nrows = 0
+    for row in self.iter_rows():
+      if nrows < n:
+        rows.append(row)
+      else:
+        i = rand.randint(0, nrows)
+        if i < n:
+          rows[i] = row
+      nrows += 1
+    self._nrows = nrows
+    return rows, nrows
+
+  def col_values(self, field):
+    raise Exception("FileTable %s does not materialize its columns" % self.path)
+
+  def __len__(self):
+    if self._nrows is None:
+      self._nrows = sum(len(chunk) for chunk in self.iter_chunks())
+    return self._nrows
+
+  def __iter__(self):
+    for row in self.iter_rows():
+      yield ListTuple(self.schema, row)
+
+
+class PartitionedTable(Table):
+  """
+  Table whose rows are split across partition tables by the value of its
+  partitioning attribute, either by hash or by range.  Scans can skip the
+  partitions that the pushed-down predicates rule out (see prune()).
+  """
+  HASH = "hash"
+  RANGE = "range"
+
+  def __init__(self, schema, aname, partitions, scheme=HASH, bounds=None):
+    """
+    @aname      name of the partitioning attribute
+    @partitions list of tables with the same schema
+    @scheme     HASH: a row with value v is in partition hash(v) % len(partitions)
+                RANGE: a row with value v is in partition i, where i is the 
+                number of @bounds that are <= v.  
+    @bounds     sorted list of len(partitions)-1 range boundaries
+    """
+    super(PartitionedTable, self).__init__(schema)
+    self.aname = aname
+    self.part_idx = schema.idx(Attr(aname))
+    self.partitions = partitions
+    self.scheme = scheme
+    self.bounds = list(bounds or [])
+    self.attr_to_idx = { a.aname: i
+        for i,a in enumerate(self.schema)}
+
+  @staticmethod
+  def from_dataframe(df, schema, aname, scheme=HASH, npartitions=4, 
+      bounds=None, columnar=False):
+    """
+    @npartitions number of hash partitions.  Range partitioned tables have
+                 len(@bounds)+1 partitions
+    @columnar    store each partition as a ColumnarTable, otherwise as an 
+                 InMemoryTable
+    """
+    idx = schema.idx(Attr(aname))
+    vals = df.iloc[:, idx]
+    if scheme == PartitionedTable.RANGE:
+      bounds = sorted(bounds)
+      npartitions = len(bounds) + 1
+      pids = np.searchsorted(np.asarray(bounds), vals.to_numpy(), "right")
+    else:
+      pids = np.array([PartitionedTable.hash_value(v, npartitions) 
+        for v in vals.tolist()], dtype=int)
+
+    partitions = []
+    for pid in range(npartitions):
+      part = df[pids == pid]
+      if columnar:
+        partitions.append(ColumnarTable.from_dataframe(part, schema.copy()))
+      else:
+        rows = [list(row) for row in zip(*[
+          part.iloc[:, i].tolist() for i in range(len(schema.attrs))])]
+        partitions.append(InMemoryTable(schema.copy(), rows))
+    return PartitionedTable(schema, aname, partitions, scheme, bounds)
+
+  @staticmethod
+  def hash_value(v, npartitions):
+    return hash(v) % npartitions
+
+  def same_partitioning(self, other):
+    """
+    @return whether rows of @other with the same partitioning attribute
+            value are in the same partition as in this table
+    """
+    return (isinstance(other, PartitionedTable) and
+        self.scheme == other.scheme and
+        len(self.partitions) == len(other.partitions) and
+        self.bounds == other.bounds)
+
+  def prune(self, preds):
+    """
+    @preds pushed-down (attr idx, op, value) predicates
+    @return sorted list of the partitions that can contain rows 
+            satisfying @preds
+    """
+    pids = set(range(len(self.partitions)))
+    for idx, op, v in preds:
+      if idx != self.part_idx:
+        continue
+      if self.scheme == self.HASH:
+        if op == "=":
+          pids &= set([self.hash_value(v, len(self.partitions))])
+        continue
+
+      # partition i holds values in [bounds[i-1], bounds[i])
+      left = int(np.searchsorted(self.bounds, v, "left"))
+      right = int(np.searchsorted(self.bounds, v, "right"))
+      if op == "=":
+        pids &= set([right])
+      elif op == "<":
+        pids &= set(range(left + 1))
+      elif op == "<=":
+        pids &= set(range(right + 1))
+      elif op in (">", ">="):
+        pids &= set(range(right, len(self.partitions)))
+    return sorted(pids)
+
+  def partition_of(self, v):
+    if self.scheme == self.RANGE:
+      return int(np.searchsorted(self.bounds, v, "right"))
+    return self.hash_value(v, len(self.partitions))
+
+  def append(self, rows):
+    rows = [list(row) for row in rows]
+    self.on_append(cols_from_rows(rows, len(self.schema.attrs)))
+    parts = [[] for _ in self.partitions]
+    for row in rows:
+      parts[self.partition_of(row[self.part_idx])].append(row)
+    for part, prows in zip(self.partitions, parts):
+      if prows:
+        part.append(prows)
+
+  def col_values(self, field):
+    vals = []
+    for part in self.partitions:
+      vals.extend(part.col_values(field))
+    return vals
+
+  def iter_rows(self, encoded=False, preds=None, rids=False, partitions=None):
+    """
+    @partitions ids of the partitions to scan.  By default, all of them
+    @rids       row ids are positions in the concatenation of the partitions
+    """
+    offsets = self.offsets()
+    for pid in (range(len(self.partitions)) if partitions is None else partitions):
+      rows = self.partitions[pid].iter_rows(encoded, preds, rids)
+      if rids:
+        for rid, row in rows:
+          yield offsets[pid] + rid, row
+      else:
+        for row in rows:
+          yield row
+
+  def iter_batches(self, encoded=False, preds=None, partitions=None):
+    for pid in (range(len(self.partitions)) if partitions is None else partitions):
+      for batch in self.partitions[pid].iter_batches(encoded, preds):
+        yield batch
+
+  def offsets(self):
+    offsets = [0]
+    for part in self.partitions:
+      offsets.append(offsets[-1] + len(part))
+    return offsets
+
+  def rows_at(self, rids, encoded=False):
+    offsets = self.offsets()
+    rows = []
+    for rid in rids:
+      pid = int(np.searchsorted(offsets, rid, "right")) - 1
+      rows.extend(self.partitions[pid].rows_at([rid - offsets[pid]], encoded))
+    return rows
+
+  def partition_card(self, partitions=None):
+    if partitions is None:
+      return len(self)
+    return sum(len(self.partitions[pid]) for pid in partitions)
+
+  def __len__(self):
+    return sum(len(part) for part in self.partitions)
+
+  def __iter__(self):
+    for row in self.iter_rows():
+      yield ListTuple(self.schema, row)
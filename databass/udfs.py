@@ -126,7 +126,27 @@ registry.add(IncAggUDF("avg", 1, np.mean,
   lambda s: (s[0] / s[1]) if s[1] else float('nan')))
 registry.add(IncAggUDF("sum", 1, np.sum, lambda: 0, lambda s, v: s+v, lambda s: s))
 
-# Welford's algorithm for online std
+# min and max skip NULL and NaN values, like SQL, so the result doesn't 
+# depend on the order of the rows.  Like avg, they are NaN if there are no
+# values
+def agg_min(vals):
+  vals = [v for v in vals if v is not None and v == v]
+  return min(vals) if vals else float('nan')
+def agg_max(vals):
+  vals = [v for v in vals if v is not None and v == v]
+  return max(vals) if vals else float('nan')
+
+registry.add(IncAggUDF("min", 1, agg_min, 
+  lambda: None,
+  lambda s, v: v if v is not None and v == v and (s is None or v < s) else s,
+  lambda s: float('nan') if s is None else s))
+registry.add(IncAggUDF("max", 1, agg_max, 
+  lambda: None,
+  lambda s, v: v if v is not None and v == v and (s is None or v > s) else s,
+  lambda s: float('nan') if s is None else s))
+
+# Welford's algorithm for online std.  Like np.std, it is the population
+# standard deviation
 std_init = lambda: [0, 0., 0]
 def std_update(s, v):
   s[0] += 1
@@ -135,8 +155,8 @@ def std_update(s, v):
   s[2] += d * (v - s[1])
   return s
 def std_finalize(s):
-  if s[0] < 2: return float('nan')
-  return s[2] / (s[0] - 1)
+  if s[0] < 1: return float('nan')
+  return (s[2] / s[0]) ** 0.5
 
 registry.add(IncAggUDF("std", 1, np.std, std_init, std_update, std_finalize))
 registry.add(IncAggUDF("stdev", 1, np.std, std_init, std_update, std_finalize))
@@ -1,3 +1,4 @@
+import heapq
 import numbers
 from functools import partial
 
@@ -17,6 +18,15 @@ def deduplicate(iterable, keyf=None):
     yield i
     seen.add(key)
 
+def unquote(v):
+  """
+  String literals from the SQL parser keep their quotes
+  @return the literal value @v without its quotes
+  """
+  if isinstance(v, str) and len(v) > 1 and v[0] == v[-1] and v[0] in "'\"":
+    return v[1:-1]
+  return v
+
 def cond_to_func(expr_or_func):
   """
   Helper function to help automatically interpret string expressions 
@@ -83,3 +93,64 @@ class OBTuple(object):
         continue
 
     return 0
+
+
+class HeapEntry(object):
+  """
+  Entry of a BoundedHeap.  Its order is reversed, so that heapq's min-heap
+  keeps the largest entry at the top
+  """
+  __slots__ = ("key", "seq", "item")
+
+  def __init__(self, key, seq, item):
+    self.key = key
+    self.seq = seq
+    self.item = item
+
+  def precedes(self, key, seq):
+    return self.key < key or (self.key == key and self.seq < seq)
+
+  def __lt__(self, o):
+    return o.precedes(self.key, self.seq)
+
+
+class BoundedHeap(object):
+  """
+  Keeps the @k smallest items by @key with a heap of at most @k entries,
+  so that finding them among n items takes O(n log k) time.  Ties are 
+  broken by insertion order, so sorted() is the same as the first @k 
+  items of a stable sort.
+  """
+  def __init__(self, k, key, copy=None):
+    """
+    @copy function that copies an item before it is kept, for items that
+          the caller reuses, such as the rows of an iterator
+    """
+    self.k = k
+    self.key = key
+    self.copy = copy
+    self.heap = []
+    self.n = 0
+
+  def push(self, item):
+    if not self.k:
+      return
+    key = self.key(item)
+    self.n += 1
+    if len(self.heap) >= self.k:
+      if not self.heap[0].precedes(key, self.n):
+        heapq.heapreplace(self.heap, HeapEntry(key, self.n, 
+          self.copy(item) if self.copy else item))
+      return
+    if self.copy:
+      item = self.copy(item)
+    heapq.heappush(self.heap, HeapEntry(key, self.n, item))
+
+  def sorted(self):
+    """
+    @return the kept items in ascending order of key
+    """
+    return [e.item for e in sorted(self.heap, reverse=True)]
+
+  def __len__(self):
+    return len(self.heap)
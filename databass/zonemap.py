@@ -0,0 +1,113 @@
+"""
+Zone maps summarize each fixed-size block of a column with its min, max and
+number of nulls, so that scans can skip the blocks that cannot satisfy a
+pushed-down predicate.
+
+Pushed-down predicates are (attribute idx, op, value) triples, where op is
+one of the comparisons in OPS.  See Scan.preds
+"""
+import operator
+import numpy as np
+
+OPS = {
+  "=": operator.eq,
+  "<": operator.lt,
+  "<=": operator.le,
+  ">": operator.gt,
+  ">=": operator.ge
+}
+
+# op to use when the value is on the left of the comparison
+FLIPPED_OPS = { "=": "=", "<": ">", "<=": ">=", ">": "<", ">=": "<=" }
+
+
+def match_row(row, preds):
+  """
+  @return whether @row satisfies all of the pushed-down @preds
+  """
+  for idx, op, v in preds:
+    if not OPS[op](row[idx], v):
+      return False
+  return True
+
+def filter_rows(rows, preds, rids=False):
+  """
+  Filter an iterator of rows by the pushed-down @preds.  Used by tables
+  that don't maintain zone maps.
+
+  @rids emit (row id, row) pairs, where row id is the row's position in @rows
+  """
+  if rids:
+    rows = enumerate(rows)
+    if not preds:
+      return rows
+    return (pair for pair in rows if match_row(pair[1], preds))
+
+  if not preds:
+    return rows
+  return (row for row in rows if match_row(row, preds))
+
+def block_mask(cols, preds):
+  """
+  @cols  numpy arrays of the block's values, indexed by attribute
+  @return boolean numpy array of the block's rows that satisfy @preds
+  """
+  mask = None
+  for idx, op, v in preds:
+    m = OPS[op](cols[idx], v)
+    mask = m if mask is None else (mask & m)
+  return mask
+
+
+class ZoneMap(object):
+  """
+  Per-block min, max and null count of a numeric column.
+  Blocks that only contain nulls have NaN min and max.
+  """
+  def __init__(self, mins, maxs, nulls, blocksize):
+    self.mins = mins
+    self.maxs = maxs
+    self.nulls = nulls
+    self.blocksize = blocksize
+
+  @staticmethod
+  def build(col, blocksize):
+    """
+    @col numeric numpy array
+    """
+    starts = np.arange(0, len(col), blocksize)
+    if not len(starts):
+      empty = np.array([], dtype=float)
+      return ZoneMap(empty, empty, empty, blocksize)
+
+    if col.dtype.kind == "f":
+      nulls = np.add.reduceat(np.isnan(col), starts)
+    else:
+      nulls = np.zeros(len(starts), dtype=int)
+    # fmin/fmax ignore NaNs unless the whole block is NaN
+    mins = np.fmin.reduceat(col, starts)
+    maxs = np.fmax.reduceat(col, starts)
+    return ZoneMap(mins, maxs, nulls, blocksize)
+
+  def may_match(self, block, op, v):
+    """
+    @return False if no row in the @block'th block can satisfy `col op v`
+    """
+    lo, hi = self.mins[block], self.maxs[block]
+    if lo != lo:
+      # only nulls, which fail every comparison
+      return False
+    if op == "=":
+      return lo <= v <= hi
+    if op == "<":
+      return lo < v
+    if op == "<=":
+      return lo <= v
+    if op == ">":
+      return hi > v
+    if op == ">=":
+      return hi >= v
+    return True
+
+  def __len__(self):
+    return len(self.mins)
@@ -0,0 +1,186 @@
+from .conftest import *
+from databass import *
+from databass.ops import *
+from databass.tables import *
+from databass.zonemap import *
+
+
+@pytest.fixture(scope="module")
+@pytest.mark.usefixtures("context")
+def ordered(context):
+  """
+  Register a time-ordered table that spans several zone map blocks
+  """
+  n = ColumnarTable.BLOCKSIZE * 5
+  df = pd.DataFrame(dict(
+    t=np.arange(n),
+    v=np.random.randint(0, 100, size=n),
+    s=np.random.choice(["x", "y", "z"], size=n)))
+  context['db'].register_dataframe("ordered", df, dict_encode=True)
+  df.to_sql("ordered", context['sqlite'], index=False)
+  return context['db']["ordered"]
+
+
+pushdown_qs = [
+  "SELECT count(1) FROM ordered WHERE t > 19000",
+  "SELECT t, v FROM ordered WHERE 100 >= t",
+  "SELECT sum(v) FROM ordered WHERE t BETWEEN 5000 AND 9000 AND v < 50",
+  "SELECT s, count(1) FROM ordered WHERE t = 8192 GROUP BY s",
+  "SELECT o1.t, o2.b FROM ordered AS o1, data AS o2 WHERE o1.t = o2.a AND o1.t < 10"
+]
+
+@pytest.mark.parametrize("q", pushdown_qs)
+def test_pushdown(context, ordered, q):
+  run_query(context, q)
+
+  rows1 = run_sqlite_query(context, q)
+  compiled_q = PyCompiledQuery(q)
+  rows2 = [tup.row for tup in compiled_q(context['db'])]
+  compare_results(context, rows1, rows2, False)
+
+
+def test_pushdown_plan(context, ordered):
+  plan = parse("SELECT v FROM ordered WHERE t >= 100 AND v > 5").to_plan()
+  plan = context['opt'](plan)
+  assert(not plan.collect("Filter"))
+  assert(sorted(plan.collectone("Scan").preds) == [(0, ">=", 100.0), (1, ">", 5.0)])
+
+
+def test_zonemap_skipping(context, ordered):
+  bs = ColumnarTable.BLOCKSIZE
+  zonemap = ordered.zonemap(0)
+  assert(len(zonemap) == 5)
+  assert(zonemap.mins[1] == bs and zonemap.maxs[1] == 2*bs - 1)
+
+  preds = [(0, ">=", 3*bs + 10)]
+  blocks = [b for b in range(len(zonemap)) if ordered.may_match(b, preds)]
+  assert(blocks == [3, 4])
+
+  pairs = list(ordered.iter_rows(preds=preds, rids=True))
+  assert(len(pairs) == 2*bs - 10)
+  assert(all(rid == row[0] for rid, row in pairs))
+
+
+def test_zonemap_nulls():
+  col = np.array([np.nan, np.nan, 1., 5., np.nan, 3.])
+  zonemap = ZoneMap.build(col, 2)
+  assert(list(zonemap.nulls) == [2, 0, 1])
+  assert(not zonemap.may_match(0, ">", 0))
+  assert(zonemap.may_match(1, "=", 3))
+  assert(not zonemap.may_match(2, "<", 3))
+
+
+index_qs = [
+  "SELECT t, v, s FROM ordered WHERE t = 8192",
+  "SELECT t, s FROM ordered WHERE t >= 100 AND t < 110 AND v > 50",
+  "SELECT count(1) FROM ordered WHERE v = 5 AND t < 1000",
+  "SELECT o.t, d.e FROM ordered AS o, data AS d WHERE o.v = d.a AND o.t <= 3"
+]
+
+@pytest.mark.parametrize("q", index_qs)
+def test_index_scan(context, ordered, q):
+  db = context['db']
+  db.create_index("ordered", ["t"])
+  db.create_index("ordered", ["v", "t"])
+  try:
+    plan = context['opt'](parse(q).to_plan())
+    assert(plan.collect("IndexScan"))
+
+    run_query(context, q)
+    rows1 = run_sqlite_query(context, q)
+    rows2 = [tup.row for tup in PyCompiledQuery(q)(db)]
+    compare_results(context, rows1, rows2, False)
+  finally:
+    for index in db.table_indexes("ordered"):
+      db.drop_index(index.name)
+
+
+def test_index_selectivity(context, ordered):
+  db = context['db']
+  index = db.create_index("ordered", "t")
+  try:
+    # most of the table matches, so scanning it is cheaper
+    plan = context['opt'](parse("SELECT v FROM ordered WHERE t > 10").to_plan())
+    assert(not plan.collect("IndexScan"))
+
+    plan = context['opt'](parse("SELECT v FROM ordered WHERE t < 10").to_plan())
+    assert(plan.collectone("IndexScan").index == index.name)
+  finally:
+    db.drop_index(index.name)
+
+
+def test_index_lookup(context, ordered):
+  db = context['db']
+  index = db.create_index("ordered", ["v", "t"], "v_t")
+  try:
+    vals = db._df_registry["ordered"][["t", "v"]].values
+    preds = [(1, "=", 7), (0, ">", 500), (0, "<=", 9000)]
+    assert(index.served_preds(preds) == preds)
+    rids = [rid for rid, row in index.iter_rows(preds, rids=True)]
+    expected = [i for i, (t, v) in enumerate(vals) if v == 7 and 500 < t <= 9000]
+    assert(sorted(rids) == expected)
+
+    # only the leading key attribute's predicates are served
+    assert(index.served_preds([(0, "=", 3)]) == [])
+  finally:
+    db.drop_index("v_t")
+
+
+@pytest.fixture(scope="module")
+@pytest.mark.usefixtures("context")
+def partitioned(context):
+  """
+  Register a range partitioned and two hash partitioned tables
+  """
+  db = context['db']
+  n = 1000
+  events = pd.DataFrame(dict(ts=np.arange(n), k=np.arange(n) % 37))
+  db.register_partitioned("events", events, "ts", "range", bounds=[250, 500, 750])
+  events.to_sql("events", context['sqlite'], index=False)
+
+  keys = pd.DataFrame(dict(k=np.arange(37), name=["k%d" % i for i in range(37)]))
+  db.register_partitioned("hevents", events, "k", "hash", npartitions=3,
+      columnar=True)
+  db.register_partitioned("hkeys", keys, "k", "hash", npartitions=3)
+  events.to_sql("hevents", context['sqlite'], index=False)
+  keys.to_sql("hkeys", context['sqlite'], index=False)
+  return db
+
+
+partition_qs = [
+  ("SELECT ts, k FROM events WHERE ts < 250", [0]),
+  ("SELECT count(1) FROM events WHERE ts >= 500 AND ts <= 600", [2]),
+  ("SELECT k, count(1) FROM events WHERE ts > 700 GROUP BY k", [2, 3]),
+  ("SELECT ts FROM hevents WHERE k = 5", None),
+]
+
+@pytest.mark.parametrize("q,parts", partition_qs)
+def test_partition_pruning(context, partitioned, q, parts):
+  plan = context['opt'](parse(q).to_plan())
+  scan = plan.collectone("Scan")
+  if parts is not None:
+    assert(scan.partitions == parts)
+  else:
+    assert(len(scan.partitions) == 1)
+
+  run_query(context, q)
+  rows1 = run_sqlite_query(context, q)
+  rows2 = [tup.row for tup in PyCompiledQuery(q)(context['db'])]
+  compare_results(context, rows1, rows2, False)
+
+
+partition_join_qs = [
+  "SELECT e.ts, h.name FROM hevents AS e, hkeys AS h WHERE e.k = h.k",
+  "SELECT e.ts, h.name FROM hevents AS e, hkeys AS h WHERE e.k = h.k AND h.k = 3",
+  "SELECT e.ts, h.name FROM hevents AS e, hkeys AS h WHERE e.k = h.k AND e.ts < 100"
+]
+
+@pytest.mark.parametrize("q", partition_join_qs)
+def test_partition_wise_join(context, partitioned, q):
+  plan = context['opt'](parse(q).to_plan())
+  assert(plan.collectone("HashJoin").is_partition_wise())
+
+  run_query(context, q)
+  rows1 = run_sqlite_query(context, q)
+  rows2 = [tup.row for tup in PyCompiledQuery(q)(context['db'])]
+  compare_results(context, rows1, rows2, False)
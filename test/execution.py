@@ -0,0 +1,430 @@
+from .conftest import *
+from databass import *
+from databass.ops import *
+from databass.tables import *
+from databass.hashcache import HashTableCache
+from databass.spill import ExternalSort, SpillStats
+from databass.udfs import IncAggUDF
+from databass.util import cond_to_func
+
+
+join_qs = [
+  "SELECT d1.a, d2.g FROM data AS d1, data AS d2 WHERE d1.a = d2.b",
+  "SELECT t.a, d.e FROM tdata AS t, data AS d WHERE t.b = d.c AND t.c > 50"
+]
+
+@pytest.mark.parametrize("q", join_qs)
+def test_cached_hash_tables(context, q):
+  db = context['db']
+  db.hash_tables.clear()
+  rows1 = run_sqlite_query(context, q)
+  for i in range(2):
+    rows2 = run_databass_query(context, q)
+    compare_results(context, rows1, rows2, False)
+    rows3 = [tup.row for tup in PyCompiledQuery(q)(db)]
+    compare_results(context, rows1, rows3, False)
+  assert(db.hash_tables.hits >= 2)
+
+
+def test_hash_table_cache_lru(context):
+  db = context['db']
+  table = db["data"]
+  nbytes = len(table) * (HashTableCache.ROW_BYTES + 
+      HashTableCache.VALUE_BYTES * len(table.schema.attrs))
+  cache = HashTableCache(2 * nbytes)
+
+  ht = cache.get(table, 0)
+  assert(sorted(ht.keys()) == sorted(set(table.col_values(table.schema.attrs[0]))))
+  assert(cache.get(table, 0) is ht and cache.hits == 1)
+
+  cache.get(table, 1)
+  cache.get(table, 0)
+  cache.get(table, 2)
+  assert(len(cache) == 2 and cache.nbytes <= cache.budget)
+  assert((table.id, 1, False, table.version) not in cache.entries)
+
+  # a new version of the table invalidates its hash tables
+  table.version += 1
+  try:
+    assert(cache.get(table, 0) is not ht)
+    assert(len(cache) == 1)
+  finally:
+    table.version -= 1
+
+
+@pytest.mark.parametrize("columnar", [True, False])
+def test_hash_table_cache_null_keys(context, columnar):
+  # NULL and NaN keys are left out, like in the hash tables joins build
+  df = pd.DataFrame({"k": [1.0, np.nan, None, 2.0], "s": ["x", None, "y", "x"]})
+  table = (ColumnarTable.from_dataframe(df, infer_schema_from_df(df)) 
+      if columnar else InMemoryTable(infer_schema_from_df(df), df.values.tolist()))
+  assert(sorted(HashTableCache.build(table, 0).keys()) == [1.0, 2.0])
+  assert(sorted(HashTableCache.build(table, 1).keys()) == ["x", "y"])
+  ht = HashTableCache.build(table, (0, 1), (False, False))
+  assert(sorted(ht.keys()) == [(1.0, "x"), (2.0, "x")])
+
+
+batched_qs = [
+  ("SELECT * FROM {t} WHERE a > 2", False),
+  ("SELECT a + b, c * 2, -a FROM {t} WHERE b < 3 AND c >= 1", False),
+  ("SELECT a, e FROM {t} WHERE (a BETWEEN 2 AND 6) OR b < 1", False),
+  ("SELECT a, sum(b), count(c), avg(b) FROM {t} GROUP BY a", False),
+  ("SELECT e, sum(a) FROM {t} GROUP BY e", False),
+  ("SELECT sum(a) FROM {t}", False),
+  ("SELECT d1.a, d2.g FROM {t} AS d1, {t} AS d2 WHERE d1.a = d2.b", False),
+  ("SELECT a, b FROM {t} ORDER BY b DESC, a LIMIT 5", True),
+  ("SELECT a FROM {t} ORDER BY a LIMIT 4 OFFSET 3", True),
+  ("SELECT a, b FROM {t} WHERE a > 3 and a < 10 or b = 2", False),
+]
+
+# parsed as a < (10 or b = 2), unlike sqlite, so these are checked against
+# the row engine, whose and/or return one of their operands
+row_engine_qs = [
+  "SELECT a, b FROM {t} WHERE a > 3 and a < 10 or b = 2",
+]
+
+@pytest.mark.parametrize("q,order_matters", batched_qs)
+@pytest.mark.parametrize("table", ["data", "bdata"])
+def test_batched_execution(context, q, order_matters, table):
+  db = context['db']
+  if "bdata" not in db:
+    db.register_dataframe("bdata", db._df_registry["data"], dict_encode=True)
+
+  if q in row_engine_qs:
+    rows1 = run_databass_query(context, q.format(t=table))
+  else:
+    rows1 = run_sqlite_query(context, q.format(t="data"))
+  plan = parse(q.format(t=table)).to_plan()
+  rows2 = run_plan(context, Yield(plan, batched=True))
+  compare_results(context, rows1, rows2, order_matters)
+
+
+composite_join_qs = [
+  "SELECT d1.a, d2.b FROM data AS d1, data AS d2 WHERE d1.a = d2.b AND d1.c = d2.c",
+  "SELECT t.a, d.e FROM tdata AS t, data AS d WHERE t.b = d.c AND t.a = d.a",
+  "SELECT t.a, d.e FROM tdata AS t, data AS d WHERE t.b = d.c AND d.a = t.a AND t.c > d.b",
+]
+
+@pytest.mark.parametrize("q", composite_join_qs)
+def test_composite_hash_join(context, q):
+  db = context['db']
+  plan = context['opt'](parse(q).to_plan())
+  join = plan.collectone("HashJoin")
+  assert(len(join.join_attrs[0]) == 2)
+  assert(len(plan.collect("HashJoin")) == 1)
+
+  # the hash table is built over the smaller table
+  est = Estimator(db)
+  assert(est.card(join.l) <= est.card(join.r))
+
+  rows1 = run_sqlite_query(context, q)
+  rows2 = run_databass_query(context, q)
+  compare_results(context, rows1, rows2, False)
+  rows3 = [tup.row for tup in PyCompiledQuery(q)(db)]
+  compare_results(context, rows1, rows3, False)
+  rows4 = run_plan(context, Yield(parse(q).to_plan(), batched=True))
+  compare_results(context, rows1, rows4, False)
+
+
+def test_hash_join_colliding_keys(context):
+  # hash(-1) == hash(-2), so a hash table keyed on hashes would match them
+  db = context['db']
+  db.register_dataframe("hkeys", pd.DataFrame({"k": [-1, -2, 3], "v": [1, 2, 3]}))
+  q = """SELECT h1.v, h2.v FROM hkeys AS h1, hkeys AS h2 
+    WHERE h1.k = h2.k AND h1.v > 0 AND h2.v > 0"""
+  try:
+    assert(context['opt'](parse(q).to_plan()).collectone("HashJoin") is not None)
+    rows = run_databass_query(context, q)
+    compare_results(context, [[1, 1], [2, 2], [3, 3]], rows, False)
+  finally:
+    db.unregister_table("hkeys")
+
+
+nan_join_qs = [
+  "SELECT n1.v, n2.v FROM nkeys AS n1, nkeys AS n2 WHERE n1.k = n2.k",
+  "SELECT n1.v, n2.v FROM nkeys AS n1, nkeys AS n2 WHERE n1.k = n2.k AND n1.v = n2.v",
+]
+
+@pytest.mark.parametrize("q", nan_join_qs)
+@pytest.mark.parametrize("columnar", [True, False])
+def test_hash_join_nan_keys(context, q, columnar):
+  # NaN keys are NULL, so they don't match anything, even the same NaN 
+  # object, which all of a row table's NaNs may be
+  db = context['db']
+  db.register_dataframe("nkeys", pd.DataFrame(
+    {"k": [1.0, np.nan, 2.0, np.nan], "v": [1, 1, 2, 1]}), columnar=columnar)
+  expected = [[1, 1], [2, 2]]
+  try:
+    compare_results(context, expected, run_databass_query(context, q), False)
+    rows = [tup.row for tup in PyCompiledQuery(q)(db)]
+    compare_results(context, expected, rows, False)
+    rows = run_plan(context, Yield(parse(q).to_plan(), batched=True))
+    compare_results(context, expected, rows, False)
+  finally:
+    db.unregister_table("nkeys")
+
+
+spill_qs = [
+  "SELECT t1.a, t2.b FROM tdata AS t1, tdata AS t2 WHERE t1.a = t2.b",
+  "SELECT t1.a, t2.d FROM tdata AS t1, tdata AS t2 WHERE t1.a = t2.b AND t1.c = t2.c",
+  "SELECT t.a, d.e FROM tdata AS t, data AS d WHERE t.b = d.c AND t.c > 50",
+]
+
+@pytest.mark.parametrize("q", spill_qs)
+def test_spilling_hash_join(context, q):
+  db = context['db']
+  rows1 = run_sqlite_query(context, q)
+  db.join_memory_budget = 1024
+  db.spill_stats.reset()
+  try:
+    rows2 = run_databass_query(context, q)
+    compare_results(context, rows1, rows2, False)
+    rows3 = [tup.row for tup in PyCompiledQuery(q)(db)]
+    compare_results(context, rows1, rows3, False)
+    rows4 = run_plan(context, Yield(parse(q).to_plan(), batched=True))
+    compare_results(context, rows1, rows4, False)
+  finally:
+    db.join_memory_budget = None
+  assert(db.spill_stats.bytes_written > 0)
+
+
+def sort_merge_plan(context, q):
+  """
+  @return @q's optimized plan with its hash joins replaced by sort-merge joins
+  """
+  plan = context['opt'](parse(q).to_plan())
+  for hj in plan.collect(HashJoin):
+    hj.replace(SortMergeJoin(hj.l, hj.r, hj.join_attrs))
+  assert(plan.collectone(SortMergeJoin) is not None)
+  return plan
+
+@pytest.mark.parametrize("q", spill_qs)
+@pytest.mark.parametrize("budget", [None, 2048])
+def test_sort_merge_join(context, q, budget):
+  db = context['db']
+  rows1 = run_sqlite_query(context, q)
+  db.sort_memory_budget = budget
+  db.spill_stats.reset()
+  try:
+    rows2 = run_plan(context, sort_merge_plan(context, q))
+    compare_results(context, rows1, rows2, False)
+    rows3 = [tup.row for tup in PyCompiledQuery(Collect(sort_merge_plan(context, q)))(db)]
+    compare_results(context, rows1, rows3, False)
+    rows4 = run_plan(context, Yield(sort_merge_plan(context, q), batched=True))
+    compare_results(context, rows1, rows4, False)
+  finally:
+    db.sort_memory_budget = None
+  assert((db.spill_stats.runs > 0) == (budget is not None))
+
+
+def test_sort_merge_join_sorted_inputs(context):
+  db = context['db']
+  q = """SELECT s.a, t.b FROM (SELECT a FROM tdata ORDER BY a) AS s, 
+    (SELECT b FROM tdata ORDER BY b) AS t WHERE s.a = t.b"""
+  rows1 = run_sqlite_query(context, q)
+
+  # a grace hash join would spill both inputs, which are already sorted
+  db.join_memory_budget = 1024
+  try:
+    plan = context['opt'](parse(q).to_plan())
+    smj = plan.collectone(SortMergeJoin)
+    assert(smj is not None)
+    assert(SortMergeJoin.sorted_on(smj.l, smj.join_attrs[0]))
+    assert(SortMergeJoin.sorted_on(smj.r, smj.join_attrs[1]))
+    compare_results(context, rows1, run_databass_query(context, q), False)
+    rows = [tup.row for tup in PyCompiledQuery(q)(db)]
+    compare_results(context, rows1, rows, False)
+  finally:
+    db.join_memory_budget = None
+
+
+index_join_qs = [
+  "SELECT d.a, l.l_quantity FROM data AS d, lineitem AS l WHERE d.a = l.l_orderkey",
+  """SELECT d.a, l.l_quantity FROM data AS d, lineitem AS l 
+    WHERE d.a = l.l_orderkey AND d.b = l.l_linenumber AND l.l_quantity > 20""",
+  "SELECT d.a, l.l_tax FROM lineitem AS l, data AS d WHERE l.l_orderkey = d.a AND d.c < 3",
+]
+
+@pytest.mark.parametrize("q", index_join_qs)
+def test_index_join(context, q):
+  db = context['db']
+  rows1 = run_sqlite_query(context, q)
+  index = db.create_index("lineitem", "l_orderkey")
+  try:
+    plan = context['opt'](parse(q).to_plan())
+    ijoin = plan.collectone(IndexNestedLoopJoin)
+    assert(ijoin is not None and ijoin.index == index.name)
+    assert(ijoin.r.tablename == "lineitem")
+
+    compare_results(context, rows1, run_databass_query(context, q), False)
+    rows = [tup.row for tup in PyCompiledQuery(q)(db)]
+    compare_results(context, rows1, rows, False)
+    rows = run_plan(context, Yield(parse(q).to_plan(), batched=True))
+    compare_results(context, rows1, rows, False)
+  finally:
+    db.drop_index(index.name)
+
+
+external_sort_qs = [
+  "SELECT a, b, c FROM tdata ORDER BY b DESC, a",
+  "SELECT a, d FROM tdata ORDER BY d, a DESC",
+  "SELECT d1.a, d2.e FROM data AS d1, data AS d2 ORDER BY d1.a, d2.e",
+]
+
+@pytest.mark.parametrize("q", external_sort_qs)
+def test_external_sort(context, q):
+  db = context['db']
+  rows1 = run_databass_query(context, q)
+  db.sort_memory_budget = 2048
+  db.spill_stats.reset()
+  try:
+    rows2 = run_databass_query(context, q)
+    compare_results(context, rows1, rows2, True)
+    rows3 = [tup.row for tup in PyCompiledQuery(q)(db)]
+    compare_results(context, rows1, rows3, True)
+    rows4 = run_plan(context, Yield(parse(q).to_plan(), batched=True))
+    compare_results(context, rows1, rows4, True)
+  finally:
+    db.sort_memory_budget = None
+  assert(db.spill_stats.runs > 1)
+
+
+def test_external_sort_merge_passes():
+  stats = SpillStats()
+  rows = ExternalSort(lambda row: row[0], 100, 1, stats)
+  rows.FANIN = 4
+  vals = [(i * 7919) % 13 for i in range(2000)]
+  for i, v in enumerate(vals):
+    rows.add([v, i])
+  assert(len(rows) == len(vals))
+
+  # stable, like list.sort()
+  expected = sorted([[v, i] for i, v in enumerate(vals)], key=lambda row: row[0])
+  assert(list(rows) == expected)
+  assert(stats.runs > len(vals) // 101)
+
+
+top_n_qs = [
+  ("SELECT a, b FROM tdata ORDER BY b DESC, a", 10, 0),
+  ("SELECT a, d FROM tdata ORDER BY d, a DESC", 5, 20),
+  ("SELECT a, b FROM data ORDER BY b", 100, 2),
+  ("SELECT a FROM tdata ORDER BY a", 0, 0),
+]
+
+@pytest.mark.parametrize("q,limit,offset", top_n_qs)
+def test_top_n(context, q, limit, offset):
+  db = context['db']
+  expected = run_databass_query(context, q)[offset:offset+limit]
+
+  q = "%s LIMIT %d OFFSET %d" % (q, limit, offset)
+  plan = context['opt'](parse(q).to_plan())
+  assert(plan.collectone("TopN") is not None)
+  assert(plan.collectone("Limit") is None)
+
+  compare_results(context, expected, run_databass_query(context, q), True)
+  rows = [tup.row for tup in PyCompiledQuery(q)(db)]
+  compare_results(context, expected, rows, True)
+  rows = run_plan(context, Yield(parse(q).to_plan(), batched=True))
+  compare_results(context, expected, rows, True)
+
+
+incremental_gb_qs = [
+  "SELECT a, count(b), sum(b), avg(c), min(d), max(d) FROM tdata GROUP BY a",
+  "SELECT a + b, min(c), max(c) FROM tdata GROUP BY a + b",
+  "SELECT sum(a), min(b), max(b), count(c) FROM tdata",
+]
+
+@pytest.mark.parametrize("q", incremental_gb_qs)
+def test_incremental_group_by(context, q):
+  plan = context['opt'](parse(q).to_plan())
+  assert(plan.collectone("GroupBy").is_incremental)
+  rows1 = run_sqlite_query(context, q)
+  compare_results(context, rows1, run_databass_query(context, q), False)
+  rows = run_plan(context, Yield(parse(q).to_plan(), batched=True))
+  compare_results(context, rows1, rows, False)
+  rows = [tup.row for tup in PyCompiledQuery(q)(context['db'])]
+  compare_results(context, rows1, rows, False)
+
+
+def test_hand_built_group_by(context):
+  q = "SELECT a, sum(b) AS s, min(c) AS m FROM tdata GROUP BY a"
+  rows1 = run_sqlite_query(context, q)
+  exprs = [cond_to_func("a"), cond_to_func("sum(b)"), cond_to_func("min(c)")]
+  plan = GroupBy(Scan("tdata"), [cond_to_func("a")], exprs, ["a", "s", "m"])
+  compare_results(context, rows1, run_plan(context, plan), False)
+
+  # an AggFunc of an incremental UDF is still aggregated over buffered rows
+  exprs[2] = AggFunc(UDFRegistry.registry()["min"], [cond_to_func("c")])
+  plan = GroupBy(Scan("tdata"), [cond_to_func("a")], exprs, ["a", "s", "m"])
+  assert(not plan.is_incremental)
+  compare_results(context, rows1, run_plan(context, plan), False)
+
+
+def test_compiled_inc_agg_udf(context):
+  db = context['db']
+  registry = UDFRegistry.registry()
+  registry.add(IncAggUDF("test_sumsq", 1, lambda vs: sum(v*v for v in vs),
+    lambda: 0, lambda s, v: s + v*v, lambda s: s))
+  registry.add(IncAggUDF("test_wsum", 2, 
+    lambda vs, ws: sum(v*w for v, w in zip(vs, ws)),
+    lambda: 0, lambda s, v, w: s + v*w, lambda s: s))
+  try:
+    q = "SELECT a, test_sumsq(b), test_wsum(b, c), count(c) FROM tdata GROUP BY a"
+    cq = PyCompiledQuery(q)
+    assert("test_wsum'].update" in cq.code)
+    rows = [tup.row for tup in cq(db)]
+    compare_results(context, run_databass_query(context, q), rows, False)
+  finally:
+    registry.agg_udfs.pop("test_sumsq", None)
+    registry.agg_udfs.pop("test_wsum", None)
+
+
+def test_incremental_std(context):
+  df = context['db']._df_registry['tdata']
+  q = "SELECT a, std(b) FROM tdata GROUP BY a"
+  expected = [[a, np.std(g.values)] for a, g in df.groupby("a")["b"]]
+  compiled = [tup.row for tup in PyCompiledQuery(q)(context['db'])]
+  for rows in [run_databass_query(context, q), compiled]:
+    assert(len(rows) == len(expected))
+    for (a1, v1), (a2, v2) in zip(sorted(rows), sorted(expected)):
+      assert(a1 == a2 and abs(v1 - v2) < 1e-6)
+
+
+
+def test_min_max_nan(context):
+  # NaNs are skipped wherever they are in the group, and a group without
+  # any values is NaN
+  db = context['db']
+  db.register_dataframe("nanvals", pd.DataFrame({"g": [1, 1, 1, 2, 2, 2, 3], 
+    "v": [np.nan, 5, 3, 5, np.nan, 3, np.nan]}))
+  q = "SELECT g, min(v), max(v) FROM nanvals GROUP BY g"
+  try:
+    compiled = [tup.row for tup in PyCompiledQuery(q)(db)]
+    batched = run_plan(context, Yield(parse(q).to_plan(), batched=True))
+    for rows in [run_databass_query(context, q), compiled, batched]:
+      rows = sorted(rows)
+      assert([list(row) for row in rows[:2]] == [[1, 3, 5], [2, 3, 5]])
+      assert(rows[2][0] == 3 and np.isnan(rows[2][1]) and np.isnan(rows[2][2]))
+  finally:
+    db.unregister_table("nanvals")
+
+
+limit_qs = [
+  "SELECT a, b FROM tdata LIMIT 5 OFFSET 3",
+  "SELECT d1.a, d2.g FROM data AS d1, data AS d2 WHERE d1.a = d2.b LIMIT 3 OFFSET 1",
+  "SELECT a, count(b) FROM tdata GROUP BY a LIMIT 2",
+  "SELECT a FROM tdata LIMIT 0",
+]
+
+@pytest.mark.parametrize("q", limit_qs)
+def test_compiled_limit_stops_early(context, q):
+  db = context['db']
+  expected = run_databass_query(context, q)
+
+  rows = [tup.row for tup in PyCompiledQuery(q)(db)]
+  compare_results(context, expected, rows, False)
+
+  # under a Yield, the generator returns
+  cq = PyCompiledQuery(Yield(parse(q).to_plan()))
+  assert("return" in cq.code)
+  compare_results(context, expected, [list(tup.row) for tup in cq(db)], False)
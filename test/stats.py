@@ -0,0 +1,139 @@
+from .conftest import *
+from databass import *
+from databass.ops import *
+from databass.tables import *
+from databass.optimizer.estimation import Estimator
+from databass.statscatalog import StatsCatalog
+
+
+@pytest.fixture(scope="module")
+@pytest.mark.usefixtures("context")
+def skewed(context):
+  """
+  Register skew(k, v, s), where half of the rows have k = 0 and the rest
+  are spread over 1..999, and dim(k, w) with one row per k
+  """
+  rand = np.random.RandomState(0)
+  n = 20000
+  k = np.where(rand.rand(n) < 0.5, 0, rand.randint(1, 1000, n))
+  df = pd.DataFrame(dict(
+    k=k, 
+    v=rand.rand(n) * 1000, 
+    s=rand.choice(["x"] * 8 + ["y", "z"], n)))
+  db = context['db']
+  db.register_dataframe("skew", df)
+  db.register_dataframe("dim", pd.DataFrame(dict(
+    k=np.arange(1000), w=np.arange(1000) % 10)))
+  return df
+
+
+def estimate(context, q):
+  db = context['db']
+  plan = context['opt'](parse(q).to_plan())
+  return Estimator(db).card(plan)
+
+
+skewed_qs = [
+  ("SELECT * FROM skew WHERE k = 0", lambda df: df.k == 0),
+  ("SELECT * FROM skew WHERE k = 7", lambda df: df.k == 7),
+  ("SELECT * FROM skew WHERE k > 500", lambda df: df.k > 500),
+  ("SELECT * FROM skew WHERE v < 250", lambda df: df.v < 250),
+  ("SELECT * FROM skew WHERE v BETWEEN 100 AND 300", 
+    lambda df: (df.v >= 100) & (df.v <= 300)),
+  ("SELECT * FROM skew WHERE k IN (0, 1, 2)", lambda df: df.k.isin([0, 1, 2])),
+  ("SELECT * FROM skew WHERE s = 'x'", lambda df: df.s == "x"),
+  ("SELECT * FROM skew WHERE s <> 'x'", lambda df: df.s != "x")
+]
+
+@pytest.mark.parametrize("q,mask", skewed_qs)
+def test_filter_estimates(context, skewed, q, mask):
+  actual = mask(skewed).sum()
+  est = estimate(context, q)
+  assert(abs(est - actual) <= max(0.2 * actual, 20))
+
+
+def test_join_estimates(context, skewed):
+  actual = len(skewed)
+  est = estimate(context, "SELECT s.v FROM skew AS s, dim AS d WHERE s.k = d.k")
+  assert(abs(est - actual) <= 0.2 * actual)
+
+  # the uniform estimate is off by orders of magnitude for the skewed value
+  actual = (skewed.k == 0).sum() ** 2
+  est = estimate(context, "SELECT s1.v FROM skew AS s1, skew AS s2 WHERE s1.k = s2.k")
+  assert(est >= 0.8 * actual)
+
+
+def test_distribution_alias(context, skewed):
+  # an alias that names another table resolves to the aliased table
+  db = context['db']
+  plan = context['opt'](parse("SELECT dim.v FROM skew AS dim WHERE dim.k = 0").to_plan())
+  attr = Attr("k", tablename="dim")
+  est = Estimator(db)
+  assert(est.distribution(attr) is None)
+  dist = est.distribution(attr, plan.collectone("Scan"))
+  assert(dist.to_dict() == db["skew"].stats.distribution(attr).to_dict())
+
+
+@pytest.mark.parametrize("kind", ["rows", "columnar", "partitioned"])
+def test_sketched_stats(context, skewed, kind):
+  db = context['db']
+  if kind == "partitioned":
+    db.register_partitioned("skstats", skewed, "k", npartitions=3)
+  else:
+    db.register_dataframe("skstats", skewed, columnar=(kind == "columnar"))
+  table = db["skstats"]
+  for t in [table] + list(getattr(table, "partitions", [])):
+    t.sample_size = 1000
+
+  for attr in table.schema:
+    stat = table.stats[attr]
+    col = skewed[attr.aname]
+    assert(abs(stat['ndistinct'] - col.nunique()) <= 0.05 * col.nunique())
+    if attr.typ == "num":
+      assert(stat['min'] == col.min() and stat['max'] == col.max())
+  assert(len(table.stats.sample) == 1000)
+
+  # appends maintain the sketches and the reservoir sample
+  more = skewed.copy()
+  more['k'] += 1000
+  table.append_dataframe(more)
+  stat = table.stats[table.schema.attrs[0]]
+  assert(stat['max'] == more.k.max())
+  nunique = pd.concat([skewed.k, more.k]).nunique()
+  assert(abs(stat['ndistinct'] - nunique) <= 0.05 * nunique)
+  assert(len(table.stats.sample) == 1000 and table.stats.card == 2 * len(skewed))
+  assert(sum(row[0] >= 1000 for row in table.stats.sample) > 300)
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_stats_catalog(context, skewed, tmpdir, streaming):
+  path = str(tmpdir.join("analyzed.csv"))
+  skewed.to_csv(path, index=False)
+
+  # stats are only saved when asked for
+  db = Database(lazy=True)
+  db.register_file_by_path(path, streaming=streaming)
+  db.analyze("analyzed")
+  assert(not os.path.exists(str(tmpdir.join(StatsCatalog.FNAME))))
+
+  db = Database(lazy=True, persist_stats=True)
+  db.register_file_by_path(path, streaming=streaming)
+  stats = db.analyze("analyzed")
+  assert(os.path.exists(str(tmpdir.join(StatsCatalog.FNAME))))
+
+  # a fresh database uses the saved stats without reading the table
+  db = Database(lazy=True, persist_stats=True)
+  db.register_file_by_path(path, streaming=streaming)
+  table = db["analyzed"]
+  assert(table._stats is not None and table.stats.card == stats.card)
+  table.col_values = table.value_chunks = None
+  for attr in table.schema:
+    assert(table.stats[attr] == stats[attr])
+    assert(table.stats.distribution(attr).to_dict() == 
+        stats.distribution(attr).to_dict())
+
+  # modifying the file invalidates its stats
+  skewed[:10].to_csv(path, index=False)
+  db = Database(lazy=True, persist_stats=True)
+  db.register_file_by_path(path, streaming=streaming)
+  assert(db["analyzed"]._stats is None and db["analyzed"].stats.card == 10)
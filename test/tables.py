@@ -0,0 +1,256 @@
+from .conftest import *
+from databass import *
+from databass.ops import *
+from databass.tables import *
+
+
+@pytest.fixture(scope="module")
+@pytest.mark.usefixtures("context")
+def columnar(context):
+  """
+  Register columnar copies of tdata and data
+  """
+  db = context['db']
+  db.register_dataframe("ctdata", db._df_registry["tdata"], columnar=True)
+  db.register_dataframe("cdata", db._df_registry["data"],
+      columnar=True, dict_encode=True)
+  return db
+
+
+columnar_qs = [
+  ("SELECT * FROM tdata", "SELECT * FROM ctdata"),
+  ("SELECT a, sum(b) FROM tdata GROUP BY a",
+   "SELECT a, sum(b) FROM ctdata GROUP BY a"),
+  ("SELECT * FROM data WHERE a > 2", "SELECT * FROM cdata WHERE a > 2"),
+  ("SELECT d1.a, d2.g FROM data AS d1, data AS d2 WHERE d1.a = d2.b",
+   "SELECT d1.a, d2.g FROM cdata AS d1, cdata AS d2 WHERE d1.a = d2.b")
+]
+
+@pytest.mark.parametrize("q,cq", columnar_qs)
+def test_columnar_scan(context, columnar, q, cq):
+  rows1 = run_sqlite_query(context, q)
+  rows2 = run_databass_query(context, cq)
+  compare_results(context, rows1, rows2, False)
+
+  compiled_q = PyCompiledQuery(cq)
+  rows3 = [tup.row for tup in compiled_q(context['db'])]
+  compare_results(context, rows1, rows3, False)
+
+
+def test_columnar_stats(context, columnar):
+  db = context['db']
+  for tname, ctname in [("tdata", "ctdata"), ("data", "cdata")]:
+    db.register_dataframe("r" + tname, db._df_registry[tname], columnar=False)
+    try:
+      table, ctable = db["r" + tname], db[ctname]
+      assert(isinstance(table, InMemoryTable))
+      assert(table.stats.card == ctable.stats.card)
+      for attr in table.schema:
+        assert(table.stats[attr] == ctable.stats[attr])
+    finally:
+      db.unregister_table("r" + tname)
+
+
+def test_lazy_loading(context):
+  db = Database(lazy=True)
+  assert("data" in db)
+  assert("data" in db.tablenames)
+  assert("data" in db.catalog and "data" not in db.registry)
+
+  table = db["data"]
+  assert(len(table) == len(context['db']["data"]))
+  assert("data" not in db.catalog)
+  assert(db.schema("data") is not None)
+
+
+def test_lazy_warmup(context):
+  db = Database(lazy=True)
+  db.start_warmup().join()
+  assert(not db.catalog)
+  assert(set(db.tablenames) <= set(db.registry.keys()))
+
+
+def test_table_cache(context, tmpdir):
+  cache_dir = str(tmpdir.join("cache"))
+  path = str(tmpdir.join("cached.csv"))
+  context['db']._df_registry["data"].to_csv(path, index=False)
+
+  db = Database(lazy=True, cache_dir=cache_dir)
+  db.register_file_by_path(path)
+  assert("cached" in db._df_registry)
+  rows = list(db["cached"].iter_rows())
+
+  # a fresh database reads the memory-mapped copy instead of the csv
+  db = Database(lazy=True, cache_dir=cache_dir)
+  db.register_file_by_path(path)
+  assert("cached" not in db._df_registry)
+  assert(isinstance(db["cached"].cols[0], np.memmap))
+  assert(list(db["cached"].iter_rows()) == rows)
+
+  # modifying the csv invalidates its entry
+  context['db']._df_registry["data"][:10].to_csv(path, index=False)
+  db = Database(lazy=True, cache_dir=cache_dir)
+  db.register_file_by_path(path)
+  assert(len(db["cached"]) == 10)
+  assert(len(os.listdir(cache_dir)) == 1)
+
+
+def test_table_cache_dict_encode(context, tmpdir):
+  cache_dir = str(tmpdir.join("cache"))
+  path = str(tmpdir.join("cached.csv"))
+  pd.DataFrame(dict(a=[1, 2, 3], s=["x", "y", "x"])).to_csv(path, index=False)
+
+  # cached tables follow the database's dict_encode setting
+  for encode in [False, False, True, True, False]:
+    db = Database(lazy=True, cache_dir=cache_dir, dict_encode=encode)
+    db.register_file_by_path(path)
+    assert(isinstance(db["cached"].cols[1], DictColumn) == encode)
+    assert([tuple(r) for r in db["cached"].iter_rows()] ==
+        [(1, "x"), (2, "y"), (3, "x")])
+
+
+def test_file_table(context, tmpdir):
+  path = str(tmpdir.join("streamed.csv"))
+  df = context['db']._df_registry["tdata"]
+  df.to_csv(path, index=False)
+
+  db = Database.db()
+  db.register_file_by_path(path, streaming=True)
+  table = db["streamed"]
+  try:
+    table.chunksize = 64
+    assert(isinstance(table, FileTable))
+    assert(table.stats.card == len(df))
+    assert(table.stats[table.schema.attrs[0]]['min'] == df.iloc[:, 0].min())
+
+    q = "SELECT a, sum(b) FROM %s WHERE c > 50 GROUP BY a"
+    rows1 = run_sqlite_query(context, q % "tdata")
+    rows2 = run_databass_query(context, q % "streamed")
+    compare_results(context, rows1, rows2, False)
+
+    rows3 = [tup.row for tup in PyCompiledQuery(q % "streamed")(db)]
+    compare_results(context, rows1, rows3, False)
+  finally:
+    # the file is deleted with tmpdir, so later tests shouldn't see the table
+    db.unregister_table("streamed")
+
+
+def test_zero_copy_registration(context):
+  db = context['db']
+  df = db._df_registry["data"]
+  db.register_dataframe("zcdata", df)
+  try:
+    table = db["zcdata"]
+    assert(isinstance(table, ColumnarTable))
+    for i, attr in enumerate(table.schema):
+      if attr.typ == "num":
+        assert(np.shares_memory(table.cols[i], df.iloc[:, i].to_numpy()))
+    assert(list(table.iter_rows()) == df.values.tolist())
+  finally:
+    db.unregister_table("zcdata")
+
+
+def test_unregister_table(context):
+  db = context['db']
+  db.register_dataframe("dropped", db._df_registry["data"])
+  table = db["dropped"]
+  db.create_index("dropped", "a")
+  db.hash_tables.get(table, 0)
+
+  db.unregister_table("dropped")
+  assert("dropped" not in db and db["dropped"] is None)
+  assert(db.table_by_id(table.id) is None)
+  assert(not db.table_indexes("dropped"))
+  assert(all(key[0] != table.id for key in db.hash_tables.entries))
+
+
+encoded_qs = [
+  "SELECT a, e FROM {t} WHERE e = 'b'",
+  "SELECT a, g FROM {t} WHERE e <> 'b'",
+  "SELECT e, sum(a) FROM {t} GROUP BY e",
+  "SELECT e, g, count(1) FROM {t} GROUP BY e, g",
+  "SELECT d1.a, d2.g FROM {t} AS d1, {t} AS d2 WHERE d1.e = d2.e",
+  "SELECT d1.a, d2.a FROM {t} AS d1, {t} AS d2 WHERE d1.e = d2.g"
+]
+
+@pytest.mark.parametrize("q", encoded_qs)
+def test_dictionary_encoding(context, columnar, q):
+  rows1 = run_sqlite_query(context, q.format(t="data"))
+  rows2 = run_databass_query(context, q.format(t="cdata"))
+  compare_results(context, rows1, rows2, False)
+
+  compiled_q = PyCompiledQuery(q.format(t="cdata"))
+  rows3 = [tup.row for tup in compiled_q(context['db'])]
+  compare_results(context, rows1, rows3, False)
+
+
+def test_dictionary_codes(context, columnar):
+  db = context['db']
+  plan = context['opt'](parse("SELECT a FROM cdata WHERE e = 'b'").to_plan())
+  cond = plan.collectone("Filter").cond
+  assert(cond.l.raw and cond.r.v == db["cdata"].schema.attrs[4].dictionary.code('b'))
+
+  # encoded attributes are decoded by the sink when there is no Project
+  rows = [list(tup.row) for tup in context['opt'](Yield(Scan("cdata")))]
+  assert(rows == db._df_registry["data"].values.tolist())
+
+
+def test_dictionary_schema_copy(context):
+  # tables built from the same schema don't share Dictionaries through it
+  schema = Schema([Attr("s", "str")])
+  t1 = ColumnarTable.from_dataframe(pd.DataFrame(dict(s=["x", "y"])), schema, True)
+  t2 = ColumnarTable.from_dataframe(pd.DataFrame(dict(s=["z"])), schema, True)
+  assert(schema.attrs[0].dictionary is None)
+  assert(t1.schema.attrs[0].dictionary.table_id == t1.id)
+  assert(t2.schema.attrs[0].dictionary.table_id == t2.id)
+
+
+@pytest.mark.parametrize("kind", ["rows", "columnar", "dict", "partitioned"])
+def test_append(context, kind):
+  db = context['db']
+  df = db._df_registry["data"]
+  half = len(df) // 2
+  if kind == "partitioned":
+    db.register_partitioned("apdata", df[:half], "a", npartitions=3)
+  else:
+    db.register_dataframe("apdata", df[:half], 
+        columnar=(kind != "rows"), dict_encode=(kind == "dict"))
+  table = db["apdata"]
+  attrs = list(table.schema)
+  before = [dict(table.stats[attr]) for attr in attrs]
+  db.create_index("apdata", "a")
+  version = table.version
+
+  table.append_dataframe(df[half:])
+  assert(table.version > version)
+  assert(len(table) == len(df) and table.stats.card == len(df))
+  for attr, stat in zip(attrs, before):
+    col = df[attr.aname]
+    if attr.typ == "num":
+      assert(table.stats[attr]['min'] == col.min())
+      assert(table.stats[attr]['max'] == col.max())
+    ndistinct = table.stats[attr]['ndistinct']
+    assert(stat['ndistinct'] <= ndistinct <= col.nunique(dropna=False))
+
+  for q in ["SELECT a, e FROM {t} WHERE a > 2",
+            "SELECT a, g FROM {t} WHERE a = 2",
+            "SELECT e, sum(a) FROM {t} GROUP BY e",
+            "SELECT d1.a, d2.g FROM data AS d1, {t} AS d2 WHERE d1.a = d2.b"]:
+    rows1 = run_sqlite_query(context, q.format(t="data"))
+    rows2 = run_databass_query(context, q.format(t="apdata"))
+    compare_results(context, rows1, rows2, False)
+    rows3 = [tup.row for tup in PyCompiledQuery(q.format(t="apdata"))(db)]
+    compare_results(context, rows1, rows3, False)
+
+
+def test_hyperloglog():
+  from databass.sketch import HyperLogLog
+  hll1, hll2 = HyperLogLog(), HyperLogLog()
+  hll1.add(np.arange(50000))
+  hll2.add(np.arange(25000, 75000).astype(float))
+  assert(abs(hll1.estimate() - 50000) < 2500)
+  assert(abs(hll1.merge(hll2).estimate() - 75000) < 3750)
+
+  hll = HyperLogLog()
+  hll.add(["a", "b", None, np.nan, "a"])
+  assert(hll.estimate() == 2)